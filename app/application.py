@@ -1,56 +1,160 @@
-from flask import Flask,render_template,request,session,redirect,url_for,jsonify
-from components.memory import create_session_qa_chain
-from config.config import OPEN_AI_API_KEY
+from flask import Flask,render_template,request,session,redirect,url_for,jsonify,Response
+from components.memory import create_session_qa_chain, append_turn
+from components.registry import get_shared_answer_cache, get_shared_conversation_store, get_shared_summary_worker
+from components.streaming import AnswerStream
+from components.vector_store import get_vector_store_version
+from components.hedged_llm import LLMUnavailableError
+from common.metrics import span, start_trace, current_trace, server_timing, render_metrics, CONTENT_TYPE
+from config.config import OPEN_AI_API_KEY, ANSWER_CACHE_ENABLED, SUMMARY_AFTER_MESSAGES, SERVER_TIMING_ENABLED, LLM_DEGRADED_ANSWER
+import json
 import os
 import traceback
+import uuid
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
 
-def get_qa_chain_with_memory(session_messages=None):
+def get_session_id(session):
+    """The conversation's key in the conversation store (the cookie holds nothing else)"""
+    if "session_id" not in session:
+        session["session_id"] = uuid.uuid4().hex
+    return session["session_id"]
+
+def get_messages(session):
+    session_id = session.get("session_id")
+    return get_shared_conversation_store().get_messages(session_id) if session_id else []
+
+def add_question(session_id, question):
+    """Store the question and return the conversation's message count"""
+    return get_shared_conversation_store().append_message(session_id, "user", question)
+
+def get_qa_chain_with_memory(session_id, message_count, stream_answer=False):
     """Get QA chain with conversation memory"""
     try:
-        # Create QA chain with memory populated from session
-        return create_session_qa_chain(session_messages)
+        # Resume the memory state the previous turn left in the store
+        with span("memory_load"):
+            memory_state = get_shared_conversation_store().load_memory_state(session_id)
+        return create_session_qa_chain(memory_state, message_count, stream_answer=stream_answer)
     except Exception as e:
         print(f"Failed to create QA chain with memory: {e}")
         raise
 
+def save_answer(session_id, question, answer, message_count):
+    """Store the answer and the turn in the memory state; long conversations are summarized in the background"""
+    store = get_shared_conversation_store()
+    with span("save_turn"):
+        store.append_message(session_id, "assistant", answer)
+        store.update_memory_state(session_id, lambda state: append_turn(state, question, answer))
+
+    if message_count > SUMMARY_AFTER_MESSAGES:
+        try:
+            get_shared_summary_worker().submit(session_id)
+        except Exception as e:
+            # The answer is already stored; the next turn queues the summary again
+            print(f"Failed to queue conversation summary: {e}")
+
+def use_answer_cache(message_count):
+    """Only a conversation's first question is independent of chat history"""
+    return ANSWER_CACHE_ENABLED and message_count == 1
+
+def get_cached_answer(question, index_version):
+    """
+    Cached answer to a first-turn question, or None
+
+    `index_version` is read once per request, before retrieval, and the same
+    value is passed to store_cached_answer, so an answer built from an index
+    that was replaced meanwhile is never cached under the new version.
+    """
+    try:
+        with span("answer_cache"):
+            return get_shared_answer_cache().lookup(question, index_version)
+    except Exception as e:
+        # The cache is an optimization; never fail the request because of it
+        print(f"Answer cache lookup failed: {e}")
+        return None
+
+def store_cached_answer(question, answer, index_version):
+    try:
+        get_shared_answer_cache().store(question, answer, index_version)
+    except Exception as e:
+        print(f"Answer cache store failed: {e}")
+
+def friendly_error_message(e):
+    if isinstance(e, LLMUnavailableError):
+        return LLM_DEGRADED_ANSWER
+    if "API" in str(e) or "OpenAI" in str(e):
+        return "API connection error. Please check your OpenAI API key and try again."
+    elif "vector" in str(e).lower() or "faiss" in str(e).lower():
+        return "Database error. Please contact administrator."
+    return f"An error occurred: {str(e)}"
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def iter_conversation_text(messages):
+    """Conversation history as plain text for export, one message at a time"""
+    yield "Medical AI Assistant Conversation\n"
+    yield "=" * 50 + "\n\n"
+    
+    for msg in messages:
+        role = "You" if msg["role"] == "user" else "AI Assistant"
+        yield f"{role}: {msg['content']}\n\n"
+
 from markupsafe import Markup
 def nl2br(value):
     return Markup(value.replace("\n" , "<br>\n"))
 
 app.jinja_env.filters['nl2br'] = nl2br
 
+@app.before_request
+def begin_trace():
+    start_trace()
+
+@app.after_request
+def add_server_timing(response):
+    """Report the request's stage timings (not available yet for streamed bodies)"""
+    if SERVER_TIMING_ENABLED:
+        timings = current_trace()
+        if timings:
+            response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
 @app.route("/" , methods=["GET","POST"])
 def index():
-    if "messages" not in session:
-        session["messages"]=[]
-
     if request.method=="POST":
         user_input = request.form.get("prompt")
 
         if user_input:
-            messages = session["messages"]
-            messages.append({"role" : "user" , "content":user_input})
-            session["messages"] = messages
+            session_id = get_session_id(session)
 
             try:
+                message_count = add_question(session_id, user_input)
+
                 # Check if API key is configured
                 if not OPEN_AI_API_KEY:
                     error_msg = "OpenAI API key not configured. Please check your .env file."
-                    return render_template("index.html", messages=session["messages"], error=error_msg)
+                    return render_template("index.html", messages=get_messages(session), error=error_msg)
                 
-                # Get QA chain with conversation memory
-                qa_chain = get_qa_chain_with_memory(session.get("messages", []))
-                
-                # Invoke the QA chain with question
-                response = qa_chain.invoke({"question": user_input})
-                result = response.get("answer", "Sorry, I couldn't generate a response.")
-                
-                # Add assistant response to messages
-                messages.append({"role": "assistant", "content": result})
-                session["messages"] = messages
+                # Standalone first-turn questions may already have been answered
+                cacheable = use_answer_cache(message_count)
+                index_version = get_vector_store_version() if cacheable else None
+                result = get_cached_answer(user_input, index_version) if cacheable else None
+
+                if result is None:
+                    # Get QA chain with conversation memory
+                    qa_chain = get_qa_chain_with_memory(session_id, message_count)
+
+                    # Invoke the QA chain with question
+                    with span("qa_chain"):
+                        response = qa_chain.invoke({"question": user_input})
+                    result = response.get("answer")
+
+                    if result and cacheable:
+                        store_cached_answer(user_input, result, index_version)
+                    result = result or "Sorry, I couldn't generate a response."
+
+                # Add assistant response to the conversation
+                save_answer(session_id, user_input, result, message_count)
                 
             except Exception as e:
                 # Detailed error logging
@@ -58,47 +162,93 @@ def index():
                 print(f"Error in chatbot: {error_details}")
                 
                 # User-friendly error message
-                if "API" in str(e) or "OpenAI" in str(e):
-                    error_msg = "API connection error. Please check your OpenAI API key and try again."
-                elif "vector" in str(e).lower() or "faiss" in str(e).lower():
-                    error_msg = "Database error. Please contact administrator."
-                else:
-                    error_msg = f"An error occurred: {str(e)}"
-                    
-                return render_template("index.html", messages=session["messages"], error=error_msg)
+                error_msg = friendly_error_message(e)
+                return render_template("index.html", messages=get_messages(session), error=error_msg)
             
         return redirect(url_for("index"))
-    return render_template("index.html" , messages=session.get("messages" , []))
+    return render_template("index.html" , messages=get_messages(session))
+
+@app.route("/stream", methods=["POST"])
+def stream():
+    """Answer a question as Server-Sent Events: `token` events, then `done` or `error`"""
+    user_input = request.form.get("prompt")
+    if not user_input:
+        return "Missing prompt", 400
+
+    session_id = get_session_id(session)
+
+    def events():
+        try:
+            message_count = add_question(session_id, user_input)
+            if not OPEN_AI_API_KEY:
+                raise Exception("OpenAI API key not configured. Please check your .env file.")
+
+            cacheable = use_answer_cache(message_count)
+            index_version = get_vector_store_version() if cacheable else None
+            answer = get_cached_answer(user_input, index_version) if cacheable else None
+
+            if answer is None:
+                qa_chain = get_qa_chain_with_memory(session_id, message_count, stream_answer=True)
+                answer_stream = AnswerStream(qa_chain, {"question": user_input})
+
+                streamed = False
+                for token in answer_stream:
+                    streamed = True
+                    yield sse_event("token", {"token": token})
+
+                answer = answer_stream.answer
+                if answer and cacheable:
+                    store_cached_answer(user_input, answer, index_version)
+                answer = answer or "Sorry, I couldn't generate a response."
+                if not streamed:
+                    yield sse_event("token", {"token": answer})
+            else:
+                yield sse_event("token", {"token": answer})
+
+            save_answer(session_id, user_input, answer, message_count)
+            yield sse_event("done", {})
+
+        except Exception as e:
+            print(f"Error in chatbot: {traceback.format_exc()}")
+            yield sse_event("error", {"message": friendly_error_message(e)})
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.route("/clear")
 def clear():
     """Clear conversation history and reset session"""
-    session.pop("messages", None)
+    session_id = session.pop("session_id", None)
+    if session_id:
+        get_shared_conversation_store().clear(session_id)
     session.pop("conversation_id", None)  # Clear conversation tracking
     return redirect(url_for("index"))
 
 @app.route("/export")
 def export_conversation():
     """Export conversation history as text"""
-    messages = session.get("messages", [])
-    if not messages:
+    session_id = session.get("session_id")
+    store = get_shared_conversation_store()
+    if not session_id or not store.message_count(session_id):
         return "No conversation to export", 400
     
-    # Format conversation for export
-    export_text = "Medical AI Assistant Conversation\n"
-    export_text += "=" * 50 + "\n\n"
+    # Stream the conversation from the store, message by message
+    export_text = iter_conversation_text(store.iter_messages(session_id))
     
-    for msg in messages:
-        role = "You" if msg["role"] == "user" else "AI Assistant"
-        export_text += f"{role}: {msg['content']}\n\n"
-    
-    from flask import Response
     return Response(
         export_text,
         mimetype="text/plain",
         headers={"Content-Disposition": "attachment;filename=medical_conversation.txt"}
     )
 
+@app.route("/metrics")
+def metrics():
+    """Stage latency histograms and token counters in the Prometheus text format"""
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
 if __name__=="__main__":
     app.run(host="0.0.0.0" , port=5000 , debug=False , use_reloader = False)
 
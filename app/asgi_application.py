@@ -0,0 +1,309 @@
+"""
+Async (ASGI) entry point with the same routes as application.py
+
+    uvicorn asgi_application:app --host 0.0.0.0 --port 5000
+
+A question waiting on OpenAI holds no thread: the chain, retriever and chat
+model run through their async (`ainvoke`) variants on the event loop, so one
+worker serves many questions at once. At most ASYNC_MAX_CONCURRENT_QUESTIONS
+are answered at a time; ASYNC_MAX_QUEUED_QUESTIONS more may wait up to
+ASYNC_QUEUE_TIMEOUT_SECONDS for a slot, and anything beyond that gets a 503.
+"""
+import asyncio
+import contextlib
+import os
+import traceback
+from urllib.parse import parse_qs
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.responses import PlainTextResponse, RedirectResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.templating import Jinja2Templates
+
+from application import (
+    get_session_id, get_messages, add_question, get_qa_chain_with_memory, save_answer,
+    use_answer_cache, get_cached_answer, store_cached_answer,
+    friendly_error_message, sse_event, iter_conversation_text, nl2br,
+)
+from components.registry import (
+    get_shared_retriever, get_shared_llm, get_shared_answer_cache, get_shared_conversation_store,
+)
+from components.streaming import AnswerStream
+from components.vector_store import get_vector_store_version
+from common.metrics import span, start_trace, server_timing, render_metrics, CONTENT_TYPE
+from config.config import (
+    OPEN_AI_API_KEY, ANSWER_CACHE_ENABLED, SERVER_TIMING_ENABLED,
+    ASYNC_MAX_CONCURRENT_QUESTIONS, ASYNC_MAX_QUEUED_QUESTIONS, ASYNC_QUEUE_TIMEOUT_SECONDS,
+)
+
+BUSY_MESSAGE = "The assistant is busy right now. Please try again in a moment."
+
+templates = Jinja2Templates(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates"))
+templates.env.filters['nl2br'] = nl2br
+
+
+class ServerBusy(Exception):
+    pass
+
+
+class QuestionLimiter:
+    """
+    Bounds the questions answered at once and the queue in front of them
+
+    Args:
+        max_concurrent: Questions answered at the same time
+        max_queued: Questions allowed to wait for a slot
+        queue_timeout: Longest wait for a slot, in seconds
+    """
+
+    def __init__(self, max_concurrent, max_queued, queue_timeout):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        if self._semaphore.locked():
+            if self._waiting >= self.max_queued:
+                self.rejected += 1
+                raise ServerBusy()
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise ServerBusy()
+            finally:
+                self._waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+    def release(self):
+        self._semaphore.release()
+
+    def full(self):
+        """True when a new question would be rejected right away"""
+        return self._semaphore.locked() and self._waiting >= self.max_queued
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class ServerTimingMiddleware:
+    """Collects each request's spans and reports them in a Server-Timing header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = start_trace()
+
+        async def send_with_timing(message):
+            # Streamed bodies only report the stages finished before the first byte
+            if message["type"] == "http.response.start":
+                if timings:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", server_timing(timings).encode("latin-1"))
+                    ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
+
+
+limiter = QuestionLimiter(ASYNC_MAX_CONCURRENT_QUESTIONS, ASYNC_MAX_QUEUED_QUESTIONS, ASYNC_QUEUE_TIMEOUT_SECONDS)
+
+
+async def read_prompt(request):
+    # Both the chat form and the streaming fetch post urlencoded bodies
+    form = parse_qs((await request.body()).decode("utf-8"))
+    return (form.get("prompt") or [""])[0]
+
+async def render_index(request, error=None, status_code=200, headers=None):
+    messages = await run_in_threadpool(get_messages, request.session)
+    return templates.TemplateResponse(
+        request, "index.html",
+        {"messages": messages, "error": error},
+        status_code=status_code, headers=headers,
+    )
+
+def busy_headers():
+    return {"Retry-After": str(max(1, int(limiter.queue_timeout)))}
+
+async def answer_question(session_id, question):
+    """
+    Answer with the async chain and store the turn
+
+    Cache lookups (embedding + FAISS) and conversation store reads and writes
+    run in the thread pool.
+    """
+    message_count = await run_in_threadpool(add_question, session_id, question)
+    if not OPEN_AI_API_KEY:
+        raise Exception("OpenAI API key not configured. Please check your .env file.")
+
+    cacheable = use_answer_cache(message_count)
+    index_version = get_vector_store_version() if cacheable else None
+    answer = await run_in_threadpool(get_cached_answer, question, index_version) if cacheable else None
+
+    if answer is None:
+        qa_chain = await run_in_threadpool(get_qa_chain_with_memory, session_id, message_count)
+        with span("qa_chain"):
+            response = await qa_chain.ainvoke({"question": question})
+        answer = response.get("answer")
+
+        if answer and cacheable:
+            await run_in_threadpool(store_cached_answer, question, answer, index_version)
+        answer = answer or "Sorry, I couldn't generate a response."
+
+    await run_in_threadpool(save_answer, session_id, question, answer, message_count)
+
+async def index(request):
+    if request.method == "POST":
+        user_input = await read_prompt(request)
+
+        if user_input:
+            session_id = get_session_id(request.session)
+
+            try:
+                async with limiter:
+                    await answer_question(session_id, user_input)
+
+            except ServerBusy:
+                return await render_index(request, BUSY_MESSAGE, status_code=503, headers=busy_headers())
+
+            except Exception as e:
+                print(f"Error in chatbot: {traceback.format_exc()}")
+                return await render_index(request, friendly_error_message(e))
+
+        return RedirectResponse(request.url_for("index"), status_code=303)
+    return await render_index(request)
+
+async def stream(request):
+    """Answer a question as Server-Sent Events: `token` events, then `done` or `error`"""
+    user_input = await read_prompt(request)
+    if not user_input:
+        return PlainTextResponse("Missing prompt", status_code=400)
+
+    if limiter.full():
+        limiter.rejected += 1
+        return PlainTextResponse(BUSY_MESSAGE, status_code=503, headers=busy_headers())
+
+    session_id = get_session_id(request.session)
+
+    async def events():
+        # The slot is taken inside the generator so it is always given back
+        try:
+            await limiter.acquire()
+        except ServerBusy:
+            yield sse_event("error", {"message": BUSY_MESSAGE})
+            return
+
+        try:
+            message_count = await run_in_threadpool(add_question, session_id, user_input)
+            if not OPEN_AI_API_KEY:
+                raise Exception("OpenAI API key not configured. Please check your .env file.")
+
+            cacheable = use_answer_cache(message_count)
+            index_version = get_vector_store_version() if cacheable else None
+            answer = await run_in_threadpool(get_cached_answer, user_input, index_version) if cacheable else None
+
+            if answer is None:
+                qa_chain = await run_in_threadpool(get_qa_chain_with_memory, session_id, message_count, True)
+                answer_stream = AnswerStream(qa_chain, {"question": user_input})
+
+                streamed = False
+                async for token in answer_stream:
+                    streamed = True
+                    yield sse_event("token", {"token": token})
+
+                answer = answer_stream.answer
+                if answer and cacheable:
+                    await run_in_threadpool(store_cached_answer, user_input, answer, index_version)
+                answer = answer or "Sorry, I couldn't generate a response."
+                if not streamed:
+                    yield sse_event("token", {"token": answer})
+            else:
+                yield sse_event("token", {"token": answer})
+
+            await run_in_threadpool(save_answer, session_id, user_input, answer, message_count)
+            yield sse_event("done", {})
+
+        except Exception as e:
+            print(f"Error in chatbot: {traceback.format_exc()}")
+            yield sse_event("error", {"message": friendly_error_message(e)})
+        finally:
+            limiter.release()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def clear(request):
+    """Clear conversation history and reset session"""
+    session_id = request.session.pop("session_id", None)
+    if session_id:
+        await run_in_threadpool(get_shared_conversation_store().clear, session_id)
+    request.session.pop("conversation_id", None)
+    return RedirectResponse(request.url_for("index"), status_code=303)
+
+async def export_conversation(request):
+    """Export conversation history as text"""
+    session_id = request.session.get("session_id")
+    store = get_shared_conversation_store()
+    if not session_id or not await run_in_threadpool(store.message_count, session_id):
+        return PlainTextResponse("No conversation to export", status_code=400)
+
+    # A sync iterator: Starlette pulls each message from the store in its thread pool
+    return StreamingResponse(
+        iter_conversation_text(store.iter_messages(session_id)),
+        media_type="text/plain",
+        headers={"Content-Disposition": "attachment;filename=medical_conversation.txt"}
+    )
+
+async def metrics(request):
+    """Stage latency histograms and token counters in the Prometheus text format"""
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Load the shared index, retriever and LLM before the first question arrives"""
+    try:
+        await run_in_threadpool(get_shared_conversation_store)
+        await run_in_threadpool(get_shared_retriever)
+        await run_in_threadpool(get_shared_llm)
+        if ANSWER_CACHE_ENABLED:
+            await run_in_threadpool(get_shared_answer_cache)
+    except Exception as e:
+        # Loading is retried on the first request
+        print(f"Failed to preload shared resources: {e}")
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/", index, methods=["GET", "POST"], name="index"),
+        Route("/stream", stream, methods=["POST"], name="stream"),
+        Route("/clear", clear, name="clear"),
+        Route("/export", export_conversation, name="export_conversation"),
+        Route("/metrics", metrics, name="metrics"),
+    ],
+    middleware=[Middleware(SessionMiddleware, secret_key=os.urandom(24).hex())]
+    + ([Middleware(ServerTimingMiddleware)] if SERVER_TIMING_ENABLED else []),
+    lifespan=lifespan,
+)
+
+if __name__=="__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=5000)
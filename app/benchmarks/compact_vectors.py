@@ -0,0 +1,130 @@
+"""
+Recall / memory of compact vector settings (truncation, int8/float16, rerank)
+
+Run from the app/ directory:
+
+    python -m benchmarks.compact_vectors --vectors 100000 --dimension 1536
+    python -m benchmarks.compact_vectors --vectors-file embeddings.npy
+
+Every setting is compared with an exact flat search of the full float32
+vectors: recall@k is reported for the compact index alone and after the
+full-precision rerank (components.compact_index.RerankingIndex). Resident
+memory is the compact index; the full vectors stay on disk and a query reads
+only its `rerank_factor * k` candidate rows. Synthetic vectors put most of
+their variance in the leading dimensions, as Matryoshka-trained embeddings
+do; pass real embeddings with --vectors-file for numbers that mean something.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from benchmarks.index_types import recall_at_k
+from components.compact_index import RerankingIndex, build_compact_index, truncate_vectors
+
+DEFAULT_SETTINGS = [
+    (None, None),
+    (None, "float16"),
+    (None, "int8"),
+    (512, None),
+    (512, "int8"),
+    (256, None),
+    (256, "float16"),
+    (256, "int8"),
+    (128, "int8"),
+]
+
+
+def matryoshka_vectors(count, dimension, clusters=64, decay=0.004, seed=0):
+    """Unit-length clustered vectors whose variance falls off along the dimensions"""
+    rng = np.random.default_rng(seed)
+    scale = np.exp(-decay * np.arange(dimension)).astype(np.float32)
+    centres = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    assignment = rng.integers(0, clusters, count)
+    vectors = (centres[assignment] + 0.6 * rng.standard_normal((count, dimension)).astype(np.float32)) * scale
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def search_all(search, queries, k):
+    timings, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, ids = search(query[None, :], k)
+        timings.append(time.perf_counter() - started)
+        results.append(ids[0])
+    return np.asarray(timings) * 1000, np.asarray(results)
+
+def run(vectors, queries, k, settings, rerank_factor, workdir):
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    _, ground_truth = flat.search(queries, k)
+    full_mb = vectors.nbytes / 2**20
+
+    # The rerank reads the full vectors from a memory-mapped file, as the app does
+    full_path = os.path.join(workdir, "vectors.f32.npy")
+    np.save(full_path, vectors)
+    full_vectors = np.load(full_path, mmap_mode="r")
+
+    report = []
+    for dimensions, quantization in settings:
+        compact = build_compact_index(vectors, dimensions, quantization)
+        # The compact index alone, queried with the same truncation
+        _, compact_results = search_all(lambda query, k: compact.search(truncate_vectors(query, compact.d), k), queries, k)
+        latencies, reranked = search_all(RerankingIndex(compact, full_vectors, rerank_factor).search, queries, k)
+
+        resident_mb = faiss.serialize_index(compact).nbytes / 2**20
+        row = {
+            "dimensions": compact.d,
+            "quantization": quantization or "float32",
+            f"recall@{k}": round(recall_at_k(compact_results, ground_truth), 4),
+            f"recall@{k}_reranked": round(recall_at_k(reranked, ground_truth), 4),
+            "resident_mb": round(resident_mb, 2),
+            "resident_vs_full": round(resident_mb / full_mb, 3),
+            "rerank_kb_per_query": round(rerank_factor * k * vectors.shape[1] * 4 / 1024, 1),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        }
+        report.append(row)
+        print(
+            f"{row['dimensions']:>5}d {row['quantization']:<8} recall@{k}={row[f'recall@{k}']:.3f} "
+            f"reranked={row[f'recall@{k}_reranked']:.3f} mem={row['resident_mb']}MB "
+            f"({row['resident_vs_full']:.1%} of {full_mb:.1f}MB) p50={row['p50_ms']:.3f}ms p99={row['p99_ms']:.3f}ms"
+        )
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--vectors-file", help=".npy file of real embeddings (the last --queries rows are the queries)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rerank-factor", type=int, default=4, help="Candidates per result reranked at full precision")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.vectors_file:
+        data = np.ascontiguousarray(np.load(args.vectors_file), dtype=np.float32)
+        faiss.normalize_L2(data)
+    else:
+        data = matryoshka_vectors(args.vectors + args.queries, args.dimension)
+    vectors, queries = data[:-args.queries], data[-args.queries:]
+
+    settings = [(d, q) for d, q in DEFAULT_SETTINGS if d is None or d < vectors.shape[1]]
+    with tempfile.TemporaryDirectory(prefix="rag-compact-") as workdir:
+        report = run(vectors, queries, args.k, settings, args.rerank_factor, workdir)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "vectors": len(vectors), "dimension": vectors.shape[1], "k": args.k,
+                "rerank_factor": args.rerank_factor, "results": report,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+End-to-end ingestion and question answering against stub models
+
+Run from the app/ directory:
+
+    python -m benchmarks.end_to_end --pdfs 20 --pages-per-pdf 50 --output run.json
+    python -m benchmarks.end_to_end --pdfs 20 --pages-per-pdf 50 --compare run.json
+
+Synthetic PDFs are written to a scratch working directory, then the real
+pipeline runs there with the OpenAI models replaced by the stubs in
+benchmarks/fakes.py: `process_and_store_pdfs` (a full build, then a no-op
+incremental run), `load_vector_store`, and questions answered through
+`create_qa_chain` and `create_session_qa_chain` (multi-turn conversations),
+building the chain per request as the app does. Results are printed and can
+be written as JSON; `--compare` prints the change against an earlier run.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+FIRST_QUESTIONS = [
+    "What are the symptoms of type 2 diabetes?",
+    "How is hypertension treated?",
+    "What are the risk factors for gout?",
+    "How is hypothyroidism diagnosed?",
+]
+FOLLOW_UPS = [
+    "How is it treated?",
+    "What are the complications?",
+    "How often should patients be followed up?",
+    "Which risk factors matter most for asthma?",
+]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children (PDF workers)"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    return round(own / scale, 1), round(children / scale, 1)
+
+def latency_summary(seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        "requests": len(milliseconds),
+        "mean_ms": round(float(milliseconds.mean()), 2),
+        "p50_ms": round(float(np.percentile(milliseconds, 50)), 2),
+        "p90_ms": round(float(np.percentile(milliseconds, 90)), 2),
+        "p99_ms": round(float(np.percentile(milliseconds, 99)), 2),
+    }
+
+def write_corpus(data_path, pdfs, pages_per_pdf, lines_per_page):
+    from benchmarks.fakes import synthetic_pages, write_pdf
+
+    os.makedirs(data_path, exist_ok=True)
+    for i in range(pdfs):
+        write_pdf(os.path.join(data_path, f"synthetic_{i:04d}.pdf"), synthetic_pages(pages_per_pdf, lines_per_page, seed=i))
+
+def install_stubs(llm_latency, embedding_latency, dimension):
+    """Replace the OpenAI models used by ingestion and by the shared registry"""
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+    from benchmarks.fakes import StubChatModel, StubEmbeddings
+    from components import vector_store
+    from components.hedged_llm import HedgedChatModel
+    from components.registry import registry
+
+    embeddings = StubEmbeddings(dimension=dimension, latency=embedding_latency)
+    vector_store.get_embedding_model = lambda: embeddings
+    registry.register("embedding_model", lambda: embeddings)
+    registry.register("llm", lambda: HedgedChatModel(llm=StubChatModel(latency=llm_latency)))
+    return embeddings
+
+def measure_ingestion(pages):
+    from components.data_loader import process_and_store_pdfs
+    from components.vector_store import load_vector_store, vector_store_exists
+
+    started = time.perf_counter()
+    process_and_store_pdfs(full=True)
+    build_seconds = time.perf_counter() - started
+    # process_and_store_pdfs logs failures instead of raising them
+    if not vector_store_exists():
+        raise RuntimeError("Ingestion failed, see the log in the working directory")
+
+    started = time.perf_counter()
+    process_and_store_pdfs()
+    noop_seconds = time.perf_counter() - started
+
+    chunks = load_vector_store().index.ntotal
+    return {
+        "pages": pages,
+        "chunks": chunks,
+        "build_s": round(build_seconds, 3),
+        "pages_per_s": round(pages / build_seconds, 1),
+        "chunks_per_s": round(chunks / build_seconds, 1),
+        "noop_update_s": round(noop_seconds, 3),
+    }
+
+def measure_index_load(embeddings, repeats):
+    from components.vector_store import load_vector_store
+
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        load_vector_store(embeddings)
+        timings.append(time.perf_counter() - started)
+    return {"first_s": round(timings[0], 4), "median_s": round(float(np.median(timings)), 4)}
+
+def measure_qa_chain(requests):
+    from components.retriever import create_qa_chain
+
+    timings = []
+    for i in range(requests):
+        started = time.perf_counter()
+        create_qa_chain().invoke({"query": FIRST_QUESTIONS[i % len(FIRST_QUESTIONS)]})
+        timings.append(time.perf_counter() - started)
+    return latency_summary(timings)
+
+def measure_session_chain(requests, turns):
+    """Conversations of `turns` questions, resumed from the stored memory state every turn"""
+    from components.memory import create_session_qa_chain, append_turn
+
+    first_turn, follow_ups = [], []
+    state, message_count = None, 0
+    for i in range(requests):
+        turn = i % turns
+        if turn == 0:
+            state, message_count = None, 0
+        question = FIRST_QUESTIONS[i % len(FIRST_QUESTIONS)] if turn == 0 else FOLLOW_UPS[turn % len(FOLLOW_UPS)]
+        message_count += 1
+
+        started = time.perf_counter()
+        answer = create_session_qa_chain(state, message_count).invoke({"question": question})["answer"]
+        (first_turn if turn == 0 else follow_ups).append(time.perf_counter() - started)
+
+        state = append_turn(state, question, answer)
+        message_count += 1
+
+    return {
+        "all": latency_summary(first_turn + follow_ups),
+        "first_turn": latency_summary(first_turn),
+        "follow_up": latency_summary(follow_ups) if follow_ups else None,
+    }
+
+def run(args):
+    from config.config import DATA_PATH
+    from components.index_versions import current_index_dir
+
+    write_corpus(DATA_PATH, args.pdfs, args.pages_per_pdf, args.lines_per_page)
+    embeddings = install_stubs(args.llm_latency, args.embedding_latency, args.dimension)
+
+    results = {"ingestion": measure_ingestion(args.pdfs * args.pages_per_pdf)}
+    results["peak_rss_mb_after_ingestion"], results["peak_rss_mb_children"] = peak_rss_mb()
+    results["index_size_mb"] = round(
+        sum(entry.stat().st_size for entry in os.scandir(current_index_dir()) if entry.is_file()) / 2**20, 2
+    )
+    results["index_load"] = measure_index_load(embeddings, args.load_repeats)
+    results["qa_chain"] = measure_qa_chain(args.requests)
+    results["session_chain"] = measure_session_chain(args.requests, args.turns)
+    results["peak_rss_mb"], _ = peak_rss_mb()
+    return results
+
+def flatten(values, prefix=""):
+    for key, value in values.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+def compare(baseline, results):
+    """Print every metric next to its baseline value and the relative change"""
+    before = dict(flatten(baseline))
+    for name, value in flatten(results):
+        if name not in before:
+            continue
+        change = f"{(value - before[name]) / before[name]:+.1%}" if before[name] else "n/a"
+        print(f"{name:<40} {before[name]:>12} -> {value:<12} {change}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", type=int, default=10)
+    parser.add_argument("--pages-per-pdf", type=int, default=40)
+    parser.add_argument("--lines-per-page", type=int, default=40)
+    parser.add_argument("--requests", type=int, default=50, help="Questions per chain type")
+    parser.add_argument("--turns", type=int, default=5, help="Questions per conversation for the session chain")
+    parser.add_argument("--load-repeats", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stub LLM takes per call")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Seconds per stub embedding call")
+    parser.add_argument("--dimension", type=int, default=256, help="Stub embedding size")
+    parser.add_argument("--workdir", help="Scratch directory for the PDFs and the index (default: a temporary one)")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--compare", help="Earlier JSON output to compare against")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    # DATA_PATH, DB_FAISS_PATH and the logs are relative to the working directory
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    try:
+        results = run(args)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "settings": {k: v for k, v in vars(args).items() if k not in ("workdir", "output", "compare")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "results": results,
+    }
+    print(json.dumps(results, indent=2))
+
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            compare(json.load(f)["results"], results)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
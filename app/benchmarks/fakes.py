@@ -0,0 +1,206 @@
+"""
+Offline stand-ins for the OpenAI chat and embedding models, and synthetic PDFs
+
+Both models sleep for a configurable latency (time.sleep on the sync path,
+asyncio.sleep on the async path) so benchmarks exercise the serving and
+ingestion code without network access or API cost.
+"""
+import asyncio
+import hashlib
+import random
+import time
+from typing import Any
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+DEFAULT_ANSWER = (
+    "Based on the provided context, this condition is usually managed with lifestyle changes "
+    "and medication. Please consult a healthcare professional for personal advice."
+)
+
+
+class StubEmbeddings(Embeddings):
+    """
+    Deterministic unit vectors derived from a hash of the text
+
+    Args:
+        dimension: Vector size
+        latency: Seconds each embedding call takes
+    """
+
+    def __init__(self, dimension=64, latency=0.0):
+        self.dimension = dimension
+        self.latency = latency
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class StubUpstreamError(Exception):
+    pass
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Chat model that answers every prompt with the same text after `latency` seconds
+
+    When streamed, the latency is spread over the words of the answer (the
+    base class reports each chunk to the streaming callbacks). A share
+    `tail_probability` of the calls takes `tail_latency` instead, and a share
+    `failure_probability` fails after the latency, like a slow or failing upstream.
+    """
+
+    latency: float = 0.5
+    answer: str = DEFAULT_ANSWER
+    tail_latency: float = 0.0
+    tail_probability: float = 0.0
+    failure_probability: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def get_num_tokens(self, text: str) -> int:
+        # About four characters per token, like OpenAI's tokenizers on English
+        return max(1, len(text) // 4)
+
+    def _result(self):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    def _words(self):
+        words = self.answer.split(" ")
+        return [word if i == len(words) - 1 else word + " " for i, word in enumerate(words)]
+
+    def _draw(self):
+        """(latency, fails) of one call"""
+        latency = self.tail_latency if random.random() < self.tail_probability else self.latency
+        return latency, random.random() < self.failure_probability
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        latency, fails = self._draw()
+        time.sleep(latency)
+        if fails:
+            raise StubUpstreamError("stub upstream error")
+        return self._result()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        latency, fails = self._draw()
+        await asyncio.sleep(latency)
+        if fails:
+            raise StubUpstreamError("stub upstream error")
+        return self._result()
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        latency, fails = self._draw()
+        words = self._words()
+        for word in words:
+            time.sleep(latency / len(words))
+            if fails:
+                raise StubUpstreamError("stub upstream error")
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        latency, fails = self._draw()
+        words = self._words()
+        for word in words:
+            await asyncio.sleep(latency / len(words))
+            if fails:
+                raise StubUpstreamError("stub upstream error")
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+
+CONDITIONS = [
+    "hypertension", "type 2 diabetes", "asthma", "migraine", "osteoarthritis", "pneumonia",
+    "hypothyroidism", "anemia", "gastritis", "psoriasis", "atrial fibrillation", "gout",
+]
+SENTENCES = [
+    "Patients with {c} commonly report fatigue, and symptoms may worsen over several weeks.",
+    "First-line treatment of {c} combines lifestyle changes with medication adjusted to the patient.",
+    "Diagnosis of {c} relies on the clinical history, a physical examination and laboratory tests.",
+    "Complications of untreated {c} include damage to the heart, kidneys and nervous system.",
+    "Follow-up visits for {c} are usually scheduled every three to six months.",
+    "Risk factors for {c} include age, family history, smoking and obesity.",
+]
+
+
+QUALIFIERS = [
+    "especially in older adults", "according to current guidelines", "in most primary care settings",
+    "when renal function is reduced", "unless contraindicated", "after the initial assessment",
+    "in patients with comorbidities", "as several cohort studies report", "during pregnancy",
+    "in children and adolescents", "once other causes are excluded", "in severe cases",
+]
+
+
+def synthetic_pages(pages, lines_per_page=40, seed=0, running_header=True):
+    """
+    Page texts of medical-sounding sentences, `lines_per_page` lines each
+
+    With `running_header` every page also starts with the book title and
+    ends with a page number and copyright line, as printed books do.
+    """
+    rng = np.random.default_rng(seed)
+    texts = []
+    for page in range(pages):
+        lines = [
+            SENTENCES[rng.integers(len(SENTENCES))].format(c=CONDITIONS[rng.integers(len(CONDITIONS))])[:-1]
+            + f", {QUALIFIERS[rng.integers(len(QUALIFIERS))]}."
+            for _ in range(lines_per_page)
+        ]
+        if running_header:
+            lines = [f"Handbook of Internal Medicine, volume {seed + 1}"] + lines + [
+                f"Page {page + 1} - Copyright 2024 Example Medical Press. All rights reserved."
+            ]
+        texts.append("\n".join(lines))
+    return texts
+
+def write_pdf(path, pages):
+    """Write a minimal text PDF with one page per string in `pages`"""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages)
+        ),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        lines = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in text.split("\n")]
+        content = "BT /F1 9 Tf 12 TL 40 780 Td " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+
+    data, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    data += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+
+    with open(path, "wb") as f:
+        f.write(data)
@@ -0,0 +1,120 @@
+"""
+Recall / latency / memory of the FAISS index types on synthetic vectors
+
+Run from the app/ directory:
+
+    python -m benchmarks.index_types --vectors 100000 --dimension 1536
+
+Every configuration is compared with an exact flat index: recall@k is the
+share of the flat top-k that the configuration also returns, latency is
+measured one query at a time (as the chat path searches), memory is the
+size of the serialized index.
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from components.faiss_index import create_faiss_index, train_faiss_index, apply_search_parameters
+
+DEFAULT_CONFIGURATIONS = [
+    ("Flat", {}),
+    ("IVF{nlist},Flat", {"nprobe": 8}),
+    ("IVF{nlist},Flat", {"nprobe": 32}),
+    ("IVF{nlist},PQ{m}", {"nprobe": 16}),
+    ("IVF{nlist},PQ{m}", {"nprobe": 64}),
+    ("HNSW32", {"efSearch": 32}),
+    ("HNSW32", {"efSearch": 128}),
+]
+
+
+def synthetic_vectors(count, dimension, clusters=64, seed=0):
+    """Unit-length vectors drawn around random centres, like text embeddings"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    assignment = rng.integers(0, clusters, count)
+    vectors = centres[assignment] + 0.6 * rng.standard_normal((count, dimension)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def measure_latency(index, queries, k):
+    timings, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        timings.append(time.perf_counter() - started)
+        results.append(ids[0])
+    return np.asarray(timings) * 1000, np.asarray(results)
+
+def recall_at_k(results, ground_truth):
+    hits = sum(len(set(found) & set(expected)) for found, expected in zip(results, ground_truth))
+    return hits / ground_truth.size
+
+def run(vectors, queries, k, configurations, train_size, search_threads=1):
+    build_threads = faiss.omp_get_max_threads()
+    nlist = max(16, int(4 * np.sqrt(len(vectors))))
+    m = next((m for m in (64, 48, 32, 16, 8, 4, 2) if vectors.shape[1] % m == 0 and vectors.shape[1] // m >= 8), 1)
+
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    _, ground_truth = flat.search(queries, k)
+
+    report, built = [], {}
+    for factory, parameters in configurations:
+        factory = factory.format(nlist=nlist, m=m)
+
+        # Each index type is built once and searched with every parameter set
+        if factory not in built:
+            started = time.perf_counter()
+            index = create_faiss_index(vectors.shape[1], factory)
+            index = train_faiss_index(index, vectors[:train_size])
+            index.add(vectors)
+            built[factory] = (index, time.perf_counter() - started)
+        index, build_seconds = built[factory]
+
+        apply_search_parameters(index, nprobe=parameters.get("nprobe", 1), ef_search=parameters.get("efSearch", 16))
+        faiss.omp_set_num_threads(search_threads)
+        latencies, results = measure_latency(index, queries, k)
+        faiss.omp_set_num_threads(build_threads)
+
+        row = {
+            "index": factory,
+            "params": parameters,
+            f"recall@{k}": round(recall_at_k(results, ground_truth), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            "memory_mb": round(faiss.serialize_index(index).nbytes / 2**20, 1),
+            "build_s": round(build_seconds, 2),
+        }
+        report.append(row)
+        print(
+            f"{row['index']:<22} {json.dumps(parameters):<20} recall@{k}={row[f'recall@{k}']:.3f} "
+            f"p50={row['p50_ms']:.3f}ms p99={row['p99_ms']:.3f}ms mem={row['memory_mb']}MB build={row['build_s']}s"
+        )
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--train-size", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=1, help="FAISS threads while searching (1 = per-request latency)")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    data = synthetic_vectors(args.vectors + args.queries, args.dimension)
+    vectors, queries = data[:args.vectors], data[args.vectors:]
+
+    report = run(vectors, queries, args.k, DEFAULT_CONFIGURATIONS, args.train_size, args.threads)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"vectors": args.vectors, "dimension": args.dimension, "k": args.k, "results": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Tail latency of chat model calls with and without hedging, and fail-fast during an outage
+
+Run from the app/ directory:
+
+    python -m benchmarks.llm_hedging --requests 2000 --latency 0.2 --tail-latency 5 --tail-probability 0.02
+
+A stub chat model (benchmarks/fakes.py) answers in `--latency` seconds, and
+in `--tail-latency` seconds for a share `--tail-probability` of the calls.
+The same calls are made, `--concurrency` at a time, against the bare stub
+and through components.hedged_llm.HedgedChatModel; p50/p95/p99 of what the
+caller waited and the hedge rate (extra requests per call) are reported.
+With --stream the latency is time to first token.
+
+The outage phase makes every call fail after `--latency` seconds and
+reports how long callers wait for their error with and without the
+circuit breaker.
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.fakes import StubChatModel
+from components.hedged_llm import HedgedChatModel, CircuitBreaker
+
+
+def latency_summary(seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(milliseconds, 50)), 2),
+        "p95_ms": round(float(np.percentile(milliseconds, 95)), 2),
+        "p99_ms": round(float(np.percentile(milliseconds, 99)), 2),
+        "max_ms": round(float(milliseconds.max()), 2),
+    }
+
+def timed_call(model, prompt, stream):
+    started = time.perf_counter()
+    try:
+        if stream:
+            next(iter(model.stream(prompt)))
+        else:
+            model.invoke(prompt)
+    except Exception:
+        pass
+    return time.perf_counter() - started
+
+def run_calls(model, requests, concurrency, stream):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda i: timed_call(model, f"question {i}", stream), range(requests)))
+
+def run(args):
+    stub = StubChatModel(
+        latency=args.latency, tail_latency=args.tail_latency, tail_probability=args.tail_probability,
+        answer="word " * 20,
+    )
+    # Streamed, the stub spreads its latency over the words; scale it so the first token takes --latency
+    if args.stream:
+        stub.latency, stub.tail_latency = stub.latency * 20, stub.tail_latency * 20
+
+    hedged = HedgedChatModel(
+        llm=stub, deadline_seconds=args.deadline, hedge_percentile=args.hedge_percentile,
+        hedge_min_seconds=0.0, cache_size=0,
+    )
+    # Fill the latency window first, as a worker that has been serving would have
+    run_calls(hedged, args.warmup, args.concurrency, args.stream)
+    before = hedged.stats()
+
+    report = {
+        "bare": latency_summary(run_calls(stub, args.requests, args.concurrency, args.stream)),
+        "hedged": latency_summary(run_calls(hedged, args.requests, args.concurrency, args.stream)),
+    }
+    after = hedged.stats()
+    report["hedged"].update({
+        "hedge_rate": round((after["hedged"] - before["hedged"]) / args.requests, 4),
+        "hedge_wins": after["hedge_wins"] - before["hedge_wins"],
+    })
+
+    outage = stub.model_copy(update={"tail_probability": 0.0, "failure_probability": 1.0})
+    for name, failures in (("outage_without_breaker", 0), ("outage_with_breaker", 5)):
+        model = HedgedChatModel(
+            llm=outage, deadline_seconds=args.deadline, hedge_percentile=None, cache_size=0,
+            breaker=CircuitBreaker(failures=failures, reset_seconds=60),
+        )
+        report[name] = latency_summary(run_calls(model, args.outage_requests, args.concurrency, args.stream))
+        report[name]["short_circuited"] = model.stats()["short_circuited"]
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=200, help="Calls that fill the latency window before measuring")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds a normal call takes")
+    parser.add_argument("--tail-latency", type=float, default=2.0, help="Seconds a slow call takes")
+    parser.add_argument("--tail-probability", type=float, default=0.02)
+    parser.add_argument("--hedge-percentile", type=float, default=95)
+    parser.add_argument("--deadline", type=float, default=10.0)
+    parser.add_argument("--outage-requests", type=int, default=200)
+    parser.add_argument("--stream", action="store_true", help="Measure time to first token of streamed calls")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
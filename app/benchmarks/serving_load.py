@@ -0,0 +1,182 @@
+"""
+Throughput of the Flask and the async (ASGI) app against a stub LLM
+
+Run from the app/ directory:
+
+    python -m benchmarks.serving_load --requests 400 --concurrency 100 --llm-latency 0.5
+
+Each app is started in its own process with the OpenAI models replaced by
+the stubs in benchmarks/fakes.py and an in-memory index of synthetic
+chunks. Every request is a first-turn question posted to `/`; the answer
+cache is off so each one reaches the LLM. The Flask app is served with a
+fixed pool of `--flask-threads` threads, like a threaded WSGI worker in
+production; the ASGI app is served by a single uvicorn worker.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+
+SERVERS = ("flask", "asgi")
+
+
+def install_stubs(llm_latency, embedding_latency, chunks=2000):
+    """Point the shared registry at the stub models and an in-memory index"""
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+    from langchain_community.vectorstores import FAISS
+    from benchmarks.fakes import StubChatModel, StubEmbeddings
+    from components.hybrid_retriever import create_retriever
+    from components.registry import registry
+    import application
+
+    texts = [f"Synthetic medical chunk {i} about treatment option {i % 97}." for i in range(chunks)]
+    registry.register("embedding_model", lambda: StubEmbeddings(latency=embedding_latency))
+    registry.register("llm", lambda: StubChatModel(latency=llm_latency))
+    registry.register("vector_store", lambda: FAISS.from_texts(texts, registry.get("embedding_model")))
+    registry.register("retriever", lambda: create_retriever(registry.get("vector_store")))
+    application.ANSWER_CACHE_ENABLED = False
+
+def serve_flask(port, threads):
+    from werkzeug.serving import BaseWSGIServer
+    import application
+
+    class PooledWSGIServer(BaseWSGIServer):
+        """Handles requests on a fixed thread pool instead of a thread per request"""
+
+        pool = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer("127.0.0.1", port, application.app).serve_forever()
+
+def serve_asgi(port):
+    import uvicorn
+    import asgi_application
+
+    uvicorn.run(asgi_application.app, host="127.0.0.1", port=port, log_level="warning")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_until_up(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+async def load(url, requests, concurrency):
+    """Post `requests` questions with `concurrency` in flight; return per-request (seconds, status)"""
+    results = []
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async def user(client):
+        while not queue.empty():
+            i = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, data={"prompt": f"What is the treatment for condition {i}?"})
+                status = response.status_code
+            except httpx.HTTPError:
+                status = None
+            results.append((time.perf_counter() - started, status))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+        await asyncio.gather(*(user(client) for _ in range(concurrency)))
+    return results
+
+def run(server, args):
+    port = free_port()
+    command = [
+        sys.executable, "-m", "benchmarks.serving_load", "--serve", server, "--port", str(port),
+        "--flask-threads", str(args.flask_threads),
+        "--llm-latency", str(args.llm_latency), "--embedding-latency", str(args.embedding_latency),
+    ]
+    process = subprocess.Popen(command)
+    try:
+        url = f"http://127.0.0.1:{port}/"
+        wait_until_up(url)
+
+        started = time.perf_counter()
+        results = asyncio.run(load(url, args.requests, args.concurrency))
+        elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait()
+
+    # Both apps answer a question with a redirect back to the chat page
+    latencies = np.asarray([seconds for seconds, status in results if status in (302, 303)])
+    row = {
+        "server": server,
+        "ok": len(latencies),
+        "rejected": sum(1 for _, status in results if status == 503),
+        "failed": sum(1 for _, status in results if status not in (302, 303, 503)),
+        "questions_per_s": round(len(latencies) / elapsed, 2),
+        "p50_s": round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+        "p95_s": round(float(np.percentile(latencies, 95)), 3) if len(latencies) else None,
+        "wall_s": round(elapsed, 2),
+    }
+    print(
+        f"{server:<6} {row['questions_per_s']:>8} q/s  p50={row['p50_s']}s p95={row['p95_s']}s "
+        f"ok={row['ok']} rejected={row['rejected']} failed={row['failed']} wall={row['wall_s']}s"
+    )
+    return row
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=100, help="Questions in flight at once")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds the stub LLM takes per call")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per stub embedding call")
+    parser.add_argument("--flask-threads", type=int, default=8, help="Request threads of the Flask server")
+    parser.add_argument("--servers", nargs="+", choices=SERVERS, default=list(SERVERS))
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--serve", choices=SERVERS, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        install_stubs(args.llm_latency, args.embedding_latency)
+        if args.serve == "flask":
+            serve_flask(args.port, args.flask_threads)
+        else:
+            serve_asgi(args.port)
+        return
+
+    report = [run(server, args) for server in args.servers]
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k not in ("serve", "port", "output")},
+                       "results": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Search latency of a sharded vector store as the shard count grows
+
+Run from the app/ directory:
+
+    python -m benchmarks.shard_scaling --vectors 200000 --dimension 1536 --shards 1 2 4 8 16
+
+The same synthetic vectors are split into N flat shards and searched through
+components.sharded_store.ShardedIndex, one query at a time as the chat path
+does: fanned out over the thread pool ("all"), restricted to a single shard
+as a collection filter would ("one"), and sequentially (workers=1) to show
+what the pool buys. Recall@k is against one unsharded flat index; rebuild_s
+is the time to rebuild one shard, i.e. what changing one PDF costs.
+"""
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+from benchmarks.index_types import synthetic_vectors, recall_at_k
+from components.sharded_store import ShardedIndex
+
+
+def build_shards(vectors, count):
+    indexes, offsets = [], [0]
+    for part in np.array_split(vectors, count):
+        index = faiss.IndexFlatL2(vectors.shape[1])
+        index.add(part)
+        indexes.append(index)
+        offsets.append(offsets[-1] + len(part))
+    return indexes, offsets
+
+def measure(search, queries, k):
+    search(queries[:1], k)
+    timings, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, positions = search(query[None, :], k)
+        timings.append(time.perf_counter() - started)
+        results.append(positions[0])
+    milliseconds = np.asarray(timings) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(milliseconds, 50)), 3),
+        "p99_ms": round(float(np.percentile(milliseconds, 99)), 3),
+    }, np.asarray(results)
+
+def run(vectors, queries, k, shard_counts, workers):
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    _, ground_truth = flat.search(queries, k)
+
+    report = []
+    for count in shard_counts:
+        started = time.perf_counter()
+        indexes, offsets = build_shards(vectors, count)
+        rebuild_seconds = (time.perf_counter() - started) / count
+
+        parallel = ShardedIndex(indexes, offsets, workers)
+        sequential = ShardedIndex(indexes, offsets, workers=1)
+        fan_out, results = measure(parallel.search, queries, k)
+        one_shard, _ = measure(lambda query, k: parallel.search(query, k, [0]), queries, k)
+        in_turn, _ = measure(sequential.search, queries, k)
+
+        row = {
+            "shards": count,
+            f"recall@{k}": round(recall_at_k(results, ground_truth), 4),
+            "all": fan_out,
+            "one": one_shard,
+            "sequential": in_turn,
+            "rebuild_s": round(rebuild_seconds, 3),
+        }
+        report.append(row)
+        print(
+            f"{count:>4} shards recall@{k}={row[f'recall@{k}']:.3f} all p50={fan_out['p50_ms']:.3f}ms "
+            f"p99={fan_out['p99_ms']:.3f}ms | one shard p50={one_shard['p50_ms']:.3f}ms | "
+            f"sequential p50={in_turn['p50_ms']:.3f}ms | rebuild one shard {row['rebuild_s']}s"
+        )
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1), help="Threads searching shards at once")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # One FAISS thread per search: the parallelism under test is across shards
+    faiss.omp_set_num_threads(1)
+    data = synthetic_vectors(args.vectors + args.queries, args.dimension)
+    vectors, queries = data[:args.vectors], data[args.vectors:]
+
+    report = run(vectors, queries, args.k, args.shards, args.workers)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "vectors": args.vectors, "dimension": args.dimension, "k": args.k,
+                "workers": args.workers, "cpus": os.cpu_count(), "results": report,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Stage timings and counters in the Prometheus text format
+
+`span(stage)` times a block: the duration is added to the
+`rag_stage_seconds` histogram and, while a request trace is active (see
+`start_trace`), to that request's timings for the `Server-Timing` header.
+Metrics are kept per process, like the default Prometheus client registry.
+With METRICS_ENABLED off `span` returns a shared no-op context manager.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+
+from config.config import METRICS_ENABLED, METRICS_LATENCY_BUCKETS
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_trace = contextvars.ContextVar("trace", default=None)
+_NO_SPAN = contextlib.nullcontext()
+_metrics = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Histogram with fixed bucket bounds (durations in seconds unless `buckets` says otherwise)"""
+
+    def __init__(self, name, documentation, label_names=(), buckets=METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, le)} {cumulative}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent in each stage of answering a question", ["stage"])
+LLM_TOKENS = Counter("rag_llm_tokens_total", "Tokens sent to and generated by the chat model", ["model", "kind"])
+QUERY_EMBEDDING_BATCH = Histogram(
+    "rag_query_embedding_batch_size", "Query texts coalesced into one embedding call", buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+CONTEXT_TOKENS = Counter("rag_context_tokens_total", "Context tokens retrieved and actually put into the prompt", ["kind"])
+LLM_EVENTS = Counter(
+    "rag_llm_events_total", "Chat model calls, hedged requests, deadline misses and circuit breaker refusals", ["model", "event"]
+)
+CACHE_EVENTS = Counter(
+    "rag_cache_events_total", "Hits, misses, stores and evictions of the answer, query embedding and question rewrite caches",
+    ["cache", "event"],
+)
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        STAGE_SECONDS.observe(elapsed, self.stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((self.stage, elapsed))
+
+
+def span(stage):
+    """Context manager timing one stage of the current request"""
+    if not METRICS_ENABLED:
+        return _NO_SPAN
+    return _Span(stage)
+
+def observe(stage, seconds):
+    """Record a stage timed elsewhere (e.g. time to first token)"""
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage)
+
+def start_trace():
+    """
+    Collect the spans of the current request (context)
+
+    Returns the list the (stage, seconds) timings are appended to. Threads
+    and tasks started from this context (e.g. run_in_threadpool) share it.
+    """
+    trace = [] if METRICS_ENABLED else None
+    _trace.set(trace)
+    return trace
+
+def current_trace():
+    trace = _trace.get()
+    return trace if trace is not None else []
+
+def server_timing(timings):
+    """`Server-Timing` header value; repeated stages are summed"""
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+def count_tokens(model, prompt_tokens, completion_tokens):
+    if METRICS_ENABLED:
+        LLM_TOKENS.inc(prompt_tokens, model, "prompt")
+        LLM_TOKENS.inc(completion_tokens, model, "completion")
+
+def observe_embedding_batch(size):
+    if METRICS_ENABLED:
+        QUERY_EMBEDDING_BATCH.observe(size)
+
+def count_context_tokens(retrieved_tokens, packed_tokens):
+    if METRICS_ENABLED:
+        CONTEXT_TOKENS.inc(retrieved_tokens, "retrieved")
+        CONTEXT_TOKENS.inc(packed_tokens, "packed")
+
+def count_llm_event(model, event):
+    if METRICS_ENABLED:
+        LLM_EVENTS.inc(1, model, event)
+
+def count_cache_event(cache, event, amount=1):
+    if METRICS_ENABLED and amount:
+        CACHE_EVENTS.inc(amount, cache, event)
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format"""
+    return "\n".join(line for metric in _metrics for line in metric.render()) + "\n"
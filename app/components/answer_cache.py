@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+from common.logger import get_logger
+from common.metrics import count_cache_event
+
+from config.config import ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES
+
+logger = get_logger(__name__)
+
+
+class SemanticAnswerCache:
+    """
+    Reuse answers to earlier standalone questions that mean the same thing
+
+    Questions are embedded and kept in a small inner-product FAISS index of
+    their own. A lookup returns the stored answer when the closest earlier
+    question passes the similarity threshold, has not expired, and was
+    answered against the same vector store version. Entries are evicted by
+    TTL and least-recent use, and everything is dropped when the vector
+    store version changes.
+    """
+
+    def __init__(self, embedding_model, threshold=ANSWER_CACHE_THRESHOLD,
+                 ttl_seconds=ANSWER_CACHE_TTL_SECONDS, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._index = None
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._version = None
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    def _count(self, event, amount=1):
+        self.counters[event] += amount
+        count_cache_event("answer", event, amount)
+
+    def _embed(self, question):
+        vector = np.asarray([self.embedding_model.embed_query(question)], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _check_version(self, version):
+        """Drop every entry once the vector store has been rebuilt"""
+        if version != self._version:
+            if self._entries:
+                logger.info("Vector store changed, clearing the answer cache")
+                self._count("invalidations")
+            self._reset()
+            self._version = version
+
+    def _reset(self):
+        self._index = None
+        self._entries.clear()
+
+    def _remove(self, entry_ids):
+        if entry_ids:
+            for entry_id in entry_ids:
+                self._entries.pop(entry_id, None)
+            self._index.remove_ids(np.asarray(entry_ids, dtype=np.int64))
+
+    def _evict(self, now):
+        expired = [entry_id for entry_id, entry in self._entries.items() if now - entry["created"] > self.ttl_seconds]
+        self._remove(expired)
+
+        # Entries are kept in least-recently-used order
+        overflow = max(0, len(self._entries) - self.max_entries)
+        self._remove(list(self._entries)[:overflow])
+
+        self._count("evictions", len(expired) + overflow)
+
+    def lookup(self, question, version):
+        """Return a cached answer for `question`, or None"""
+        vector = self._embed(question)
+        now = time.time()
+
+        with self._lock:
+            self._check_version(version)
+            if self._index is None or self._index.ntotal == 0:
+                self._count("misses")
+                return None
+
+            scores, ids = self._index.search(vector, 1)
+            entry_id, score = int(ids[0][0]), float(scores[0][0])
+            entry = self._entries.get(entry_id)
+
+            if entry is None or score < self.threshold:
+                self._count("misses")
+                return None
+
+            if now - entry["created"] > self.ttl_seconds:
+                self._remove([entry_id])
+                self._count("evictions")
+                self._count("misses")
+                return None
+
+            self._entries.move_to_end(entry_id)
+            self._count("hits")
+            logger.info(f"Answer cache hit (similarity {score:.3f}) for: {question[:80]}")
+            return entry["answer"]
+
+    def store(self, question, answer, version):
+        vector = self._embed(question)
+        now = time.time()
+
+        with self._lock:
+            self._check_version(version)
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.asarray([entry_id], dtype=np.int64))
+            self._entries[entry_id] = {"question": question, "answer": answer, "created": now}
+            self._count("stores")
+
+            self._evict(now)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries))
@@ -0,0 +1,43 @@
+from typing import Any
+
+from langchain.chains import LLMChain
+from langchain.chains.combine_documents.stuff import StuffDocumentsChain
+
+from components.context_packer import pack_context
+from common.metrics import span
+
+from config.config import CONTEXT_PACKING_ENABLED
+
+
+class TimedStuffDocumentsChain(StuffDocumentsChain):
+    """
+    Stuff chain that packs the retrieved chunks into a token budget first
+
+    Prompt assembly (including packing) and generation are reported as separate stages.
+    """
+
+    pack_chunks: bool = CONTEXT_PACKING_ENABLED
+
+    def _get_inputs(self, docs, **kwargs: Any) -> dict:
+        with span("prompt_assembly"):
+            if self.pack_chunks:
+                docs = pack_context(docs)
+            return super()._get_inputs(docs, **kwargs)
+
+    def combine_docs(self, docs, callbacks=None, **kwargs: Any) -> tuple[str, dict]:
+        inputs = self._get_inputs(docs, **kwargs)
+        with span("generation"):
+            return self.llm_chain.predict(callbacks=callbacks, **inputs), {}
+
+    async def acombine_docs(self, docs, callbacks=None, **kwargs: Any) -> tuple[str, dict]:
+        inputs = self._get_inputs(docs, **kwargs)
+        with span("generation"):
+            return await self.llm_chain.apredict(callbacks=callbacks, **inputs), {}
+
+
+def create_answer_chain(llm, prompt):
+    """Chain that puts the retrieved chunks into `prompt`'s {context} and asks the LLM"""
+    return TimedStuffDocumentsChain(
+        llm_chain=LLMChain(llm=llm, prompt=prompt),
+        document_variable_name="context",
+    )
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import random
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from components.embeddings import embedding_signature
+
+from common.logger import get_logger
+from common.custom_exception import CustomException
+
+from config.config import EMBED_MAX_CONCURRENCY, EMBED_MAX_RETRIES, EMBED_BACKOFF_SECONDS, EMBED_CHECKPOINT_PATH
+
+logger = get_logger(__name__)
+
+# Errors that retrying will not fix
+_FATAL_STATUS_CODES = {400, 401, 403, 404, 422}
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+def _is_rate_limited(error):
+    return (
+        _status_code(error) == 429
+        or type(error).__name__ == "RateLimitError"
+        or "rate limit" in str(error).lower()
+    )
+
+def _chunk_key(chunk):
+    """Checkpoint key of a chunk: its docstore id, or a hash of its text"""
+    if chunk.id:
+        return chunk.id
+    return hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()[:32]
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit that halves on rate limits and grows back on success
+
+    Works like a semaphore whose size moves between 1 and `max_limit`.
+    """
+
+    def __init__(self, max_limit):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self._active = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+
+    def release(self, rate_limited=False):
+        with self._condition:
+            self._active -= 1
+            if rate_limited:
+                self._successes = 0
+                if self.limit > 1:
+                    self.limit = max(1, self.limit // 2)
+                    logger.warning(f"Rate limited, lowering embedding concurrency to {self.limit}")
+            else:
+                self._successes += 1
+                if self.limit < self.max_limit and self._successes >= self.limit:
+                    self._successes = 0
+                    self.limit += 1
+            self._condition.notify_all()
+
+
+class EmbeddingCheckpoint:
+    """
+    Embeddings of finished batches, kept on disk until the index is saved
+
+    Every batch is written as one .npz file holding its chunk keys and vectors,
+    so a build that dies halfway only re-embeds the batches it had not finished.
+    Each file also records the signature of the embedding model (see
+    embeddings.embedding_signature); a checkpoint left by another model is
+    cleared instead of resumed.
+
+    Args:
+        path: Directory of the .npz files
+        signature: Signature of the model embedding this build (None only
+            to open a checkpoint in order to clear it)
+    """
+
+    def __init__(self, path=EMBED_CHECKPOINT_PATH, signature=None):
+        self.path = path
+        self.signature = json.dumps(signature, sort_keys=True)
+        self._locations = {}
+        self._lock = threading.Lock()
+        self._cached_file = (None, None)
+
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".npz"):
+                    with np.load(os.path.join(path, name)) as data:
+                        stored = str(data["signature"]) if "signature" in data.files else None
+                        stale = signature is not None and stored != self.signature
+                        if not stale:
+                            for row, key in enumerate(data["keys"]):
+                                self._locations[str(key)] = (name, row)
+                    if stale:
+                        logger.warning(f"Embedding checkpoint in {path} was written by another embedding model, discarding it")
+                        self.clear()
+                        break
+
+            if self._locations:
+                logger.info(f"Resuming from checkpoint: {len(self._locations)} embeddings already computed")
+
+    def __len__(self):
+        return len(self._locations)
+
+    def get(self, key):
+        location = self._locations.get(key)
+        if location is None:
+            return None
+
+        name, row = location
+        with self._lock:
+            if self._cached_file[0] != name:
+                with np.load(os.path.join(self.path, name)) as data:
+                    self._cached_file = (name, data["vectors"])
+            return self._cached_file[1][row].tolist()
+
+    def put(self, keys, vectors):
+        if not keys:
+            return
+        os.makedirs(self.path, exist_ok=True)
+
+        name = hashlib.sha256("\0".join(keys).encode("utf-8")).hexdigest()[:24] + ".npz"
+        tmp_path = os.path.join(self.path, name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, keys=np.array(keys), vectors=np.asarray(vectors, dtype=np.float32), signature=np.array(self.signature))
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+        with self._lock:
+            for row, key in enumerate(keys):
+                self._locations[key] = (name, row)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self._locations = {}
+        self._cached_file = (None, None)
+
+
+def _embed_with_retries(embedding_model, texts, concurrency, max_retries, backoff_seconds):
+    for attempt in range(1, max_retries + 1):
+        concurrency.acquire()
+        rate_limited = False
+        try:
+            return embedding_model.embed_documents(texts)
+        except Exception as e:
+            rate_limited = _is_rate_limited(e)
+            if _status_code(e) in _FATAL_STATUS_CODES or attempt == max_retries:
+                raise CustomException(f"Embedding batch of {len(texts)} chunks failed after {attempt} attempts", e)
+
+            delay = backoff_seconds * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            logger.warning(f"Embedding attempt {attempt} failed ({e}); retrying in {delay:.1f}s")
+        finally:
+            concurrency.release(rate_limited=rate_limited)
+
+        time.sleep(delay)
+
+def _embed_batch(embedding_model, batch, checkpoint, concurrency, max_retries, backoff_seconds):
+    keys = [_chunk_key(chunk) for chunk in batch]
+    vectors = [checkpoint.get(key) for key in keys]
+
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        fresh = _embed_with_retries(
+            embedding_model, [batch[i].page_content for i in missing],
+            concurrency, max_retries, backoff_seconds,
+        )
+        checkpoint.put([keys[i] for i in missing], fresh)
+        for i, vector in zip(missing, fresh):
+            vectors[i] = vector
+
+    return batch, vectors
+
+def embed_batches(batches, embedding_model, checkpoint=None, max_concurrency=EMBED_MAX_CONCURRENCY,
+                  max_retries=EMBED_MAX_RETRIES, backoff_seconds=EMBED_BACKOFF_SECONDS):
+    """
+    Embed chunk batches concurrently and yield (batch, vectors) in input order
+
+    Up to `max_concurrency` requests run at once; the limit shrinks while the
+    API is rate limiting and recovers afterwards. Finished batches are written
+    to `checkpoint`, and chunks already in it are not sent again.
+
+    Args:
+        batches: Iterable of chunk lists
+        embedding_model: Any LangChain Embeddings (a fake one works for testing)
+        checkpoint: EmbeddingCheckpoint to resume from / write to
+        max_concurrency: Maximum embedding requests in flight
+        max_retries: Attempts per batch
+        backoff_seconds: Base delay of the exponential backoff
+    """
+    if checkpoint is None:
+        checkpoint = EmbeddingCheckpoint(signature=embedding_signature(embedding_model))
+    concurrency = AdaptiveConcurrency(max_concurrency)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(
+                _embed_batch, embedding_model, batch, checkpoint, concurrency, max_retries, backoff_seconds
+            ))
+            # Keep at most one extra batch queued per worker
+            if len(pending) >= 2 * max(1, max_concurrency):
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
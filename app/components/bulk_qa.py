@@ -0,0 +1,155 @@
+"""
+Answer a JSONL file of questions with the single-turn QA chain
+
+    python -m components.bulk_qa questions.jsonl answers.jsonl --concurrency 16
+
+Each input line is {"id": ..., "question": ...} (the id defaults to the line
+number). Questions are embedded in groups with one embedding call and
+retrieved with one FAISS search per group; answers are generated with at most
+`--concurrency` LLM calls in flight and appended to the output as they
+finish, so an interrupted run picks up where it stopped when started again.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from components.registry import get_shared_embedding_model, get_shared_retriever
+from components.retriever import create_qa_chain
+
+from common.logger import get_logger
+from common.custom_exception import CustomException
+
+from config.config import BULK_QA_BATCH_SIZE, BULK_QA_CONCURRENCY
+
+logger = get_logger(__name__)
+
+PROGRESS_EVERY = 100
+
+
+def read_questions(path):
+    """Yield (id, question) pairs; ids default to the line number"""
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            yield str(item.get("id", number)), item["question"]
+
+def answered_ids(path):
+    """Ids already in the output file; a line cut off by an interruption is dropped"""
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+
+    return {json.loads(line)["id"] for line in data.decode("utf-8").splitlines() if line.strip()}
+
+def iter_groups(items, size):
+    group = []
+    for item in items:
+        group.append(item)
+        if len(group) >= size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+def retrieve_group(group):
+    """Embed a group of questions in one call and retrieve for all of them at once"""
+    questions = [question for _, question in group]
+    vectors = get_shared_embedding_model().embed_documents(questions)
+    return get_shared_retriever().retrieve_batch(questions, vectors)
+
+async def run_bulk_qa(input_path, output_path, batch_size=BULK_QA_BATCH_SIZE, concurrency=BULK_QA_CONCURRENCY):
+    """
+    Answer every question of `input_path` not yet in `output_path`
+
+    Args:
+        input_path: JSONL file of questions
+        output_path: JSONL file the answers are appended to
+        batch_size: Questions embedded and searched together
+        concurrency: LLM calls in flight at once
+    """
+    done = answered_ids(output_path)
+    answer_chain = create_qa_chain().combine_documents_chain
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    counts = {"answered": 0, "failed": 0, "skipped": 0}
+    started = time.perf_counter()
+
+    async def answer(question_id, question, docs, out):
+        try:
+            output = await answer_chain.ainvoke({"input_documents": docs, "question": question})
+            out.write(json.dumps({
+                "id": question_id,
+                "question": question,
+                "answer": output["output_text"],
+                "sources": [doc.id for doc in docs],
+            }, ensure_ascii=False) + "\n")
+            out.flush()
+            counts["answered"] += 1
+            if counts["answered"] % PROGRESS_EVERY == 0:
+                rate = counts["answered"] / (time.perf_counter() - started)
+                logger.info(f"Bulk QA: {counts['answered']} answered, {rate:.2f} questions/s")
+        except Exception as e:
+            # Not written, so the next run retries it
+            counts["failed"] += 1
+            logger.error(f"Bulk QA failed for question {question_id}: {e}")
+        finally:
+            slots.release()
+
+    def pending():
+        for question_id, question in read_questions(input_path):
+            if question_id in done:
+                counts["skipped"] += 1
+            else:
+                yield question_id, question
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        for group in iter_groups(pending(), batch_size):
+            # Retrieval runs in a thread while earlier answers are still generating
+            documents = await loop.run_in_executor(None, retrieve_group, group)
+            for (question_id, question), docs in zip(group, documents):
+                await slots.acquire()
+                task = asyncio.create_task(answer(question_id, question, docs, out))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    elapsed = time.perf_counter() - started
+    report = {
+        **counts,
+        "seconds": round(elapsed, 2),
+        "questions_per_s": round(counts["answered"] / elapsed, 2) if elapsed else 0.0,
+    }
+    logger.info(f"Bulk QA finished: {report}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of questions")
+    parser.add_argument("output", help="JSONL file the answers are appended to")
+    parser.add_argument("--batch-size", type=int, default=BULK_QA_BATCH_SIZE, help="Questions embedded and searched together")
+    parser.add_argument("--concurrency", type=int, default=BULK_QA_CONCURRENCY, help="LLM calls in flight at once")
+    args = parser.parse_args()
+
+    try:
+        report = asyncio.run(run_bulk_qa(args.input, args.output, args.batch_size, args.concurrency))
+        print(json.dumps(report))
+    except Exception as e:
+        error_message = CustomException("Bulk QA failed", e)
+        logger.error(str(error_message))
+        raise error_message
+
+
+if __name__ == "__main__":
+    main()
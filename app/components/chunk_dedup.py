@@ -0,0 +1,80 @@
+"""
+Exact and near-duplicate detection for chunks at ingestion time
+
+Exact duplicates are found by a hash of the normalized text (lower case,
+words only). Near duplicates by MinHash: the Jaccard similarity of two
+chunks' word 3-shingles (the measure the prompt packer uses at query time)
+is estimated from 128-value signatures, and a chunk at or above
+CHUNK_NEAR_DUPLICATE_THRESHOLD to one kept before is dropped. Signatures are
+split into bands of 8 values; only chunks sharing a band are compared.
+"""
+import hashlib
+import re
+
+import numpy as np
+
+from config.config import CHUNK_NEAR_DUPLICATE_THRESHOLD
+
+_SHINGLE_SIZE = 3
+_WORD_PATTERN = re.compile(r"\w+")
+_PERMUTATIONS = 128
+_BAND_SIZE = 8
+
+_rng = np.random.default_rng(0)
+# Odd multipliers make each (a * x + b) mod 2**64 a permutation of the hashes
+_MULTIPLIERS = _rng.integers(1, 2**63, _PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_INCREMENTS = _rng.integers(0, 2**63, _PERMUTATIONS, dtype=np.uint64)
+
+
+def _words(text):
+    return _WORD_PATTERN.findall(text.lower())
+
+def _shingle_hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+
+def text_digest(text):
+    """Hash of the normalized text; equal for chunks that differ only in case, spacing or punctuation"""
+    return hashlib.sha1(" ".join(_words(text)).encode("utf-8")).digest()
+
+def minhash(text):
+    """MinHash signature of the word 3-shingles of `text`"""
+    words = _words(text)
+    shingles = {" ".join(words[i:i + _SHINGLE_SIZE]) for i in range(max(1, len(words) - _SHINGLE_SIZE + 1))}
+    # Not the built-in str hash: it is salted per process, and runs must agree on which chunks are duplicates
+    hashes = np.fromiter((_shingle_hash(shingle) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    with np.errstate(over="ignore"):
+        return (hashes[:, None] * _MULTIPLIERS + _INCREMENTS).min(axis=0)
+
+
+class ChunkDeduplicator:
+    """Remembers the chunks kept so far and tells whether a new one repeats any of them"""
+
+    def __init__(self, threshold=CHUNK_NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self._digests = set()
+        self._signatures = []
+        self._buckets = [{} for _ in range(_PERMUTATIONS // _BAND_SIZE)]
+
+    def _bands(self, signature):
+        return [signature[i * _BAND_SIZE:(i + 1) * _BAND_SIZE].tobytes() for i in range(len(self._buckets))]
+
+    def add(self, text):
+        """Remember `text`; False if it (or a near duplicate of it) was added before"""
+        digest = text_digest(text)
+        if digest in self._digests:
+            return False
+
+        if self.threshold is not None:
+            signature = minhash(text)
+            bands = self._bands(signature)
+            candidates = {position for band, buckets in zip(bands, self._buckets) for position in buckets.get(band, ())}
+            for position in candidates:
+                if np.mean(self._signatures[position] == signature) >= self.threshold:
+                    return False
+
+            for band, buckets in zip(bands, self._buckets):
+                buckets.setdefault(band, []).append(len(self._signatures))
+            self._signatures.append(signature)
+
+        self._digests.add(digest)
+        return True
@@ -0,0 +1,159 @@
+"""
+Compact search index with a full-precision rerank
+
+The vectors searched for every query are cut to their first
+VECTOR_COMPACT_DIMENSIONS components (text-embedding-3 models are trained so
+that a prefix, renormalized, is still a good embedding) and optionally stored
+as int8 or float16. The full float32 vectors are written next to them and
+memory-mapped: only the rows of the candidates a query reranks are read, so
+they cost page cache rather than worker memory.
+"""
+import os
+
+import numpy as np
+from langchain_community.vectorstores.faiss import dependable_faiss_import
+
+from common.logger import get_logger
+from common.custom_exception import CustomException
+
+from config.config import (
+    VECTOR_COMPACT_DIMENSIONS, VECTOR_COMPACT_QUANTIZATION, VECTOR_RERANK_FACTOR, FAISS_TRAIN_SAMPLE_SIZE,
+)
+
+logger = get_logger(__name__)
+
+COMPACT_INDEX_FILE = "compact.faiss"
+FULL_VECTORS_FILE = "vectors.f32.npy"
+
+# faiss.index_factory scalar quantizers; the "int8" codes are per-dimension ranges learnt in training
+QUANTIZERS = {None: "Flat", "float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}
+
+
+def compact_mode_enabled(dimensions=VECTOR_COMPACT_DIMENSIONS, quantization=VECTOR_COMPACT_QUANTIZATION):
+    return bool(dimensions) or quantization not in (None, "float32")
+
+def compact_index_exists(index_dir):
+    return all(os.path.exists(os.path.join(index_dir, name)) for name in (COMPACT_INDEX_FILE, FULL_VECTORS_FILE))
+
+def truncate_vectors(vectors, dimensions):
+    """First `dimensions` components of each vector, scaled back to unit length"""
+    # Always a copy: normalize_L2 works in place
+    vectors = np.array(np.atleast_2d(vectors)[:, :dimensions], dtype=np.float32, order="C")
+    dependable_faiss_import().normalize_L2(vectors)
+    return vectors
+
+def build_compact_index(vectors, dimensions=VECTOR_COMPACT_DIMENSIONS, quantization=VECTOR_COMPACT_QUANTIZATION,
+                        train_size=FAISS_TRAIN_SAMPLE_SIZE):
+    """
+    Flat index of the truncated and quantized vectors
+
+    Args:
+        vectors: Full-precision vectors in FAISS position order
+        dimensions: Components kept (None keeps all)
+        quantization: "int8", "float16" or None (float32)
+        train_size: Vectors the int8 quantizer learns its ranges from
+    """
+    if quantization not in QUANTIZERS:
+        raise CustomException(f"Unknown vector quantization {quantization!r}; use one of int8, float16, float32")
+
+    faiss = dependable_faiss_import()
+    compact = truncate_vectors(vectors, dimensions or vectors.shape[1])
+    index = faiss.index_factory(compact.shape[1], QUANTIZERS[quantization])
+    if not index.is_trained:
+        index.train(compact[:train_size])
+    index.add(compact)
+    return index
+
+def read_full_vectors(index):
+    """Every vector of a FAISS index, for the full-precision copy"""
+    faiss = dependable_faiss_import()
+    try:
+        # IVF indexes only reconstruct by position with a direct map
+        faiss.extract_index_ivf(index).make_direct_map()
+    except Exception:
+        pass
+    return index.reconstruct_n(0, index.ntotal)
+
+def write_compact_index(index, index_dir):
+    """
+    Write the compact index and the full-precision vectors next to index.faiss
+
+    Does nothing (after a warning) when the index cannot give its vectors
+    back, e.g. PQ indexes, which keep only codes.
+    """
+    faiss = dependable_faiss_import()
+    try:
+        vectors = read_full_vectors(index)
+    except Exception as e:
+        logger.warning(f"Not writing the compact index: cannot read the vectors of the FAISS index ({e})")
+        return
+
+    compact = build_compact_index(vectors)
+
+    full_path = os.path.join(index_dir, FULL_VECTORS_FILE)
+    compact_path = os.path.join(index_dir, COMPACT_INDEX_FILE)
+    with open(full_path + ".tmp", "wb") as f:
+        np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+    faiss.write_index(compact, compact_path + ".tmp")
+    os.replace(full_path + ".tmp", full_path)
+    os.replace(compact_path + ".tmp", compact_path)
+
+    logger.info(
+        f"Wrote compact index: {compact.d} of {vectors.shape[1]} dimensions, "
+        f"{VECTOR_COMPACT_QUANTIZATION or 'float32'}, {faiss.serialize_index(compact).nbytes / 2**20:.1f} MB"
+    )
+
+
+class RerankingIndex:
+    """
+    Stands in for the FAISS index of a read-only vector store
+
+    `search` takes full-size queries: it searches the compact index for
+    `rerank_factor * k` candidates, then orders them by their exact L2
+    distance to the memory-mapped full-precision vectors, as IndexFlatL2 would.
+    """
+
+    def __init__(self, compact_index, full_vectors, rerank_factor=VECTOR_RERANK_FACTOR):
+        if compact_index.ntotal != len(full_vectors):
+            raise CustomException(
+                f"Compact index has {compact_index.ntotal} vectors but the full-precision file has {len(full_vectors)}"
+            )
+        self.compact_index = compact_index
+        self.full_vectors = full_vectors
+        self.rerank_factor = max(1, rerank_factor)
+        self.d = full_vectors.shape[1]
+        self.is_trained = True
+
+    @property
+    def ntotal(self):
+        return self.compact_index.ntotal
+
+    def search(self, queries, k):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        fetch = min(self.ntotal, k * self.rerank_factor)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        positions = np.full((len(queries), k), -1, dtype=np.int64)
+        if not fetch:
+            return distances, positions
+
+        _, candidates = self.compact_index.search(truncate_vectors(queries, self.compact_index.d), fetch)
+        for row, (query, found) in enumerate(zip(queries, candidates)):
+            found = found[found != -1]
+            # Sorted reads keep the access to the mapped file sequential
+            found = np.sort(found)
+            exact = ((self.full_vectors[found] - query) ** 2).sum(axis=1)
+            best = np.argsort(exact, kind="stable")[:k]
+            distances[row, :len(best)] = exact[best]
+            positions[row, :len(best)] = found[best]
+        return distances, positions
+
+    def reconstruct(self, position):
+        return np.array(self.full_vectors[position])
+
+
+def load_reranking_index(index_dir, rerank_factor=VECTOR_RERANK_FACTOR):
+    """The compact index read into memory with its full-precision vectors memory-mapped"""
+    faiss = dependable_faiss_import()
+    compact = faiss.read_index(os.path.join(index_dir, COMPACT_INDEX_FILE))
+    full_vectors = np.load(os.path.join(index_dir, FULL_VECTORS_FILE), mmap_mode="r")
+    return RerankingIndex(compact, full_vectors, rerank_factor)
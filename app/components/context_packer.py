@@ -0,0 +1,169 @@
+import re
+
+from langchain_core.documents import Document
+
+from common.logger import get_logger
+from common.metrics import count_context_tokens
+
+from config.config import (
+    OPEN_AI_MODEL, CHUNK_OVERLAP, CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD, CONTEXT_MMR_LAMBDA,
+)
+
+logger = get_logger(__name__)
+
+_SHINGLE_SIZE = 3
+_MIN_OVERLAP_CHARS = max(1, CHUNK_OVERLAP // 2)
+_MAX_GAP_CHARS = 2
+_WORD_PATTERN = re.compile(r"\w+")
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Tokens of `text` for OPEN_AI_MODEL (about four characters per token if tiktoken's files are unavailable)"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model(OPEN_AI_MODEL)
+        except Exception as e:
+            logger.warning(f"Estimating context tokens from characters: {e}")
+            _encoding = False
+    if _encoding is False:
+        return max(1, len(text) // 4)
+    return len(_encoding.encode(text, disallowed_special=()))
+
+def _shingles(text):
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < _SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + _SHINGLE_SIZE]) for i in range(len(words) - _SHINGLE_SIZE + 1)}
+
+def _similarity(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+def _overlap(left, right):
+    """Characters at the end of `left` repeated at the start of `right` (0 when they do not overlap)"""
+    if right in left:
+        return len(right)
+    for size in range(min(len(left), len(right), 2 * CHUNK_OVERLAP), _MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def _try_merge(left, right):
+    """`left` and `right` joined without the repeated text, or None if they are not neighbours"""
+    start_left, start_right = left.metadata.get("start_index"), right.metadata.get("start_index")
+    if start_left is not None and start_right is not None:
+        # Chunks ingested with their offset in the page; a split on a separator
+        # leaves a gap of a character or two between neighbours
+        end_left = start_left + len(left.page_content)
+        if start_left <= start_right <= end_left + _MAX_GAP_CHARS:
+            if start_right > end_left:
+                merged = left.page_content + "\n" + right.page_content
+            else:
+                merged = left.page_content + right.page_content[end_left - start_right:]
+            return Document(page_content=merged, metadata=left.metadata)
+        return None
+
+    size = _overlap(left.page_content, right.page_content)
+    if size:
+        return Document(page_content=left.page_content + right.page_content[size:], metadata=left.metadata)
+    return None
+
+def merge_adjacent(docs):
+    """
+    Merge chunks of the same page that overlap (the splitter's CHUNK_OVERLAP)
+    or, for chunks that carry their start_index, that are next to each other
+
+    Returns (rank, document) blocks; a merged block keeps the best rank of its chunks.
+    """
+    blocks = []
+    for rank, doc in enumerate(docs):
+        # A merged block may now bridge to another block of the page, so keep merging
+        while True:
+            page = (doc.metadata.get("source"), doc.metadata.get("page"))
+            for i, (block_rank, block) in enumerate(blocks):
+                if (block.metadata.get("source"), block.metadata.get("page")) != page:
+                    continue
+                combined = _try_merge(block, doc) or _try_merge(doc, block)
+                if combined is not None:
+                    del blocks[i]
+                    rank, doc = min(block_rank, rank), combined
+                    break
+            else:
+                break
+        blocks.append((rank, doc))
+    return sorted(blocks, key=lambda item: item[0])
+
+def drop_near_duplicates(blocks, threshold=CONTEXT_DEDUP_THRESHOLD):
+    """Drop blocks whose word shingles mostly repeat a better-ranked block"""
+    kept = []
+    for rank, block, shingles in sorted(blocks, key=lambda item: item[0]):
+        if all(_similarity(shingles, other) < threshold for _, _, other in kept):
+            kept.append((rank, block, shingles))
+    return kept
+
+def mmr_order(blocks, mmr_lambda):
+    """
+    Reorder blocks by maximal marginal relevance
+
+    Relevance is the retrieval rank (no vectors needed); redundancy is the
+    shingle similarity to blocks already chosen.
+    """
+    remaining = list(blocks)
+    ordered = []
+    while remaining:
+        def score(item):
+            relevance = 1.0 / (item[0] + 1)
+            redundancy = max((_similarity(item[2], chosen[2]) for chosen in ordered), default=0.0)
+            return mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+
+        best = max(remaining, key=score)
+        remaining.remove(best)
+        ordered.append(best)
+    return ordered
+
+def pack_context(docs, token_budget=CONTEXT_TOKEN_BUDGET, dedup_threshold=CONTEXT_DEDUP_THRESHOLD,
+                 mmr_lambda=CONTEXT_MMR_LAMBDA):
+    """
+    Documents to put into {context}: overlapping chunks merged, near-duplicates
+    dropped, optionally reordered by MMR, within `token_budget` tokens
+
+    Args:
+        docs: Retrieved chunks, best first
+        token_budget: Most context tokens to send; blocks that do not fit are skipped
+        dedup_threshold: Shingle similarity at which a block counts as a duplicate
+        mmr_lambda: Relevance/diversity trade-off (1 = retrieval order); None skips MMR
+    """
+    if not docs:
+        return docs
+
+    blocks = [(rank, block, _shingles(block.page_content)) for rank, block in merge_adjacent(docs)]
+    blocks = drop_near_duplicates(blocks, dedup_threshold)
+    if mmr_lambda is not None:
+        blocks = mmr_order(blocks, mmr_lambda)
+
+    packed, used = [], 0
+    for _, block, _ in blocks:
+        tokens = count_tokens(block.page_content)
+        if used + tokens > token_budget:
+            continue
+        packed.append(block)
+        used += tokens
+
+    if not packed:
+        # Even the best block is over budget: send it cut down to size
+        best = blocks[0][1]
+        text = best.page_content[:token_budget * 4]
+        while len(text) > 1 and count_tokens(text) > token_budget:
+            text = text[:int(len(text) * 0.9)]
+        packed, used = [Document(page_content=text, metadata=best.metadata)], count_tokens(text)
+
+    retrieved = sum(count_tokens(doc.page_content) for doc in docs)
+    count_context_tokens(retrieved, used)
+    logger.info(
+        f"Packed context: {len(docs)} chunks -> {len(packed)} blocks, "
+        f"{retrieved} -> {used} tokens ({retrieved - used} saved)"
+    )
+    return packed
@@ -0,0 +1,252 @@
+import json
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from common.logger import get_logger
+from common.custom_exception import CustomException
+
+from config.config import CONVERSATION_STORE, CONVERSATION_STORE_PATH, CONVERSATION_STORE_MAX_SESSIONS
+
+logger = get_logger(__name__)
+
+EXPORT_PAGE_SIZE = 500
+
+
+class ConversationStore(ABC):
+    """
+    Server-side conversations keyed by session id
+
+    A conversation is its message log plus its memory state (recent messages
+    and the running summary), so a turn appends and loads a bounded amount of
+    data however long the conversation is.
+    The browser's cookie only carries the session id.
+    """
+
+    @abstractmethod
+    def append_message(self, session_id, role, content):
+        """Append a message and return the conversation's new message count"""
+        ...
+
+    @abstractmethod
+    def message_count(self, session_id):
+        ...
+
+    @abstractmethod
+    def iter_messages(self, session_id):
+        """Yield the message dicts in order without loading them all at once"""
+        ...
+
+    def get_messages(self, session_id):
+        return list(self.iter_messages(session_id))
+
+    @abstractmethod
+    def load_memory_state(self, session_id):
+        ...
+
+    @abstractmethod
+    def update_memory_state(self, session_id, update):
+        """
+        Atomically replace the memory state with `update(current_state)`
+
+        `update` receives None for a new conversation and may return None to
+        leave the state unchanged. It must be quick: it runs inside the lock
+        (or SQLite write transaction) that serializes writers.
+        """
+        ...
+
+    @abstractmethod
+    def clear(self, session_id):
+        ...
+
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    Per-process LRU of conversations
+
+    Only suitable for a single worker process; the least recently used
+    conversations are dropped beyond `max_sessions`.
+    """
+
+    def __init__(self, max_sessions=CONVERSATION_STORE_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _conversation(self, session_id, create=False):
+        conversation = self._conversations.get(session_id)
+        if conversation is None and create:
+            conversation = self._conversations[session_id] = {"messages": [], "memory": None}
+            while len(self._conversations) > self.max_sessions:
+                self._conversations.popitem(last=False)
+        if conversation is not None:
+            self._conversations.move_to_end(session_id)
+        return conversation
+
+    def append_message(self, session_id, role, content):
+        with self._lock:
+            messages = self._conversation(session_id, create=True)["messages"]
+            messages.append({"role": role, "content": content})
+            return len(messages)
+
+    def message_count(self, session_id):
+        with self._lock:
+            conversation = self._conversation(session_id)
+            return len(conversation["messages"]) if conversation else 0
+
+    def iter_messages(self, session_id):
+        with self._lock:
+            conversation = self._conversation(session_id)
+            messages = list(conversation["messages"]) if conversation else []
+        yield from messages
+
+    def load_memory_state(self, session_id):
+        with self._lock:
+            conversation = self._conversation(session_id)
+            return conversation["memory"] if conversation else None
+
+    def update_memory_state(self, session_id, update):
+        with self._lock:
+            conversation = self._conversation(session_id)
+            state = update(conversation["memory"] if conversation else None)
+            if state is not None:
+                self._conversation(session_id, create=True)["memory"] = state
+
+    def clear(self, session_id):
+        with self._lock:
+            self._conversations.pop(session_id, None)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Conversations in a SQLite file shared by every worker process
+
+    WAL mode with one connection per thread, as for the embedding cache.
+    Messages are rows keyed by (session, sequence number); the memory state
+    is one JSON column per conversation.
+    """
+
+    def __init__(self, path=CONVERSATION_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connect()
+
+    def _connect(self):
+        # A connection inherited through fork() must not be reused by the child
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "session_id TEXT PRIMARY KEY, message_count INTEGER NOT NULL, "
+                "memory_state TEXT, updated_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+                "PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def append_message(self, session_id, role, content):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            (count,) = connection.execute(
+                "INSERT INTO conversations (session_id, message_count, updated_at) VALUES (?, 1, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET message_count = message_count + 1, updated_at = excluded.updated_at "
+                "RETURNING message_count",
+                (session_id, time.time()),
+            ).fetchone()
+            connection.execute(
+                "INSERT INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                (session_id, count, role, content),
+            )
+            connection.execute("COMMIT")
+            return count
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def message_count(self, session_id):
+        row = self._connect().execute(
+            "SELECT message_count FROM conversations WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def iter_messages(self, session_id):
+        # Page by sequence number so no cursor stays open between pages (the
+        # consumer may resume on another thread, e.g. a streamed response)
+        last_seq = 0
+        while True:
+            rows = self._connect().execute(
+                "SELECT seq, role, content FROM messages WHERE session_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (session_id, last_seq, EXPORT_PAGE_SIZE),
+            ).fetchall()
+            for last_seq, role, content in rows:
+                yield {"role": role, "content": content}
+            if len(rows) < EXPORT_PAGE_SIZE:
+                return
+
+    def load_memory_state(self, session_id):
+        row = self._connect().execute(
+            "SELECT memory_state FROM conversations WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def update_memory_state(self, session_id, update):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT memory_state FROM conversations WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            state = update(json.loads(row[0]) if row and row[0] else None)
+            if state is not None:
+                connection.execute(
+                    "INSERT INTO conversations (session_id, message_count, memory_state, updated_at) VALUES (?, 0, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET memory_state = excluded.memory_state, updated_at = excluded.updated_at",
+                    (session_id, json.dumps(state), time.time()),
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def clear(self, session_id):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            connection.execute("DELETE FROM conversations WHERE session_id = ?", (session_id,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+
+def create_conversation_store(backend=CONVERSATION_STORE):
+    """Conversation store selected by CONVERSATION_STORE ("sqlite" or "memory")"""
+    try:
+        if backend == "sqlite":
+            store = SQLiteConversationStore()
+        elif backend == "memory":
+            store = InMemoryConversationStore()
+        else:
+            raise CustomException(f"Unknown conversation store: {backend}")
+
+        logger.info(f"Using the {backend} conversation store")
+        return store
+
+    except Exception as e:
+        error_message = CustomException("Failed to create conversation store", e)
+        logger.error(str(error_message))
+        raise error_message
@@ -1,21 +1,305 @@
 import os
-from components.pdf_loader import load_pdf_files,create_text_chunks
-from components.vector_store import save_vector_store
+import shutil
+import argparse
+from components.pdf_loader import list_pdf_files,iter_pdf_pages,iter_clean_chunks,iter_chunk_batches,new_cleanup_stats,log_cleanup_stats
+from components.chunk_dedup import ChunkDeduplicator
+from components.vector_store import load_vector_store,convert_legacy_vector_store,add_chunk_batches,delete_from_vector_store,persist_vector_store,vector_store_exists,iter_vector_store_documents,embedding_mismatch
+from components.local_embeddings import fit_local_embedding_model
+from components.lexical_index import build_lexical_index,lexical_index_exists
+from components.manifest import new_manifest,load_manifest,save_manifest,is_compatible,file_key,hash_file,chunk_id
+from components.sharded_store import group_files_by_shard,shard_dir,collection_of,load_shard_list,save_shard_list
+from components.index_versions import current_index_dir,new_index_dir,publish_index_dir,discard_index_dir,link_index_dir
 
 from common.logger import get_logger
 from common.custom_exception import CustomException
 
+from config.config import VECTOR_STORE_SHARDING,CHUNK_DEDUP_ENABLED,EMBEDDING_BACKEND,LOCAL_EMBEDDING_MODEL_PATH
+
 logger = get_logger(__name__)
 
-def process_and_store_pdfs():
+def _file_entry(file_path, file_hash, chunk_ids, duplicate_chunks=0):
+    stat = os.stat(file_path)
+    return {
+        "sha256": file_hash, "size": stat.st_size, "mtime": stat.st_mtime,
+        "chunk_ids": chunk_ids, "duplicate_chunks": duplicate_chunks,
+    }
+
+def _file_unchanged(file_path, entry):
+    """Cheap size/mtime check first, content hash only when those differ"""
+    stat = os.stat(file_path)
+    if stat.st_size == entry.get("size") and stat.st_mtime == entry.get("mtime"):
+        return True, entry["sha256"]
+    file_hash = hash_file(file_path)
+    return file_hash == entry.get("sha256"), file_hash
+
+def _index_files(file_paths, chunk_ids_by_key, known_ids_by_key, db=None, deduplicator=None, stats=None):
+    """
+    Stream PDFs through parsing, clean-up, splitting and embedding
+
+    Pages are parsed in parallel and split as they arrive, without boilerplate
+    lines and duplicate chunks; only chunks whose id is not already in the
+    index are embedded, in bounded batches.
+
+    Args:
+        file_paths: PDFs to (re)index
+        chunk_ids_by_key: Filled with the ids of every chunk kept, per manifest key
+        known_ids_by_key: Chunk ids already embedded, per manifest key
+        db: Index to extend, or None to create one
+        deduplicator: ChunkDeduplicator holding the chunks that stay in the index
+        stats: Clean-up counters to fill (see new_cleanup_stats)
+    """
+    if stats is None:
+        stats = new_cleanup_stats()
+
+    def new_chunks():
+        current_key, seen = None, {}
+        for chunk in iter_clean_chunks(iter_pdf_pages(file_paths), deduplicator, stats):
+            key = file_key(chunk.metadata["source"])
+            if key != current_key:
+                current_key, seen = key, {}
+
+            chunk.id = chunk_id(key, chunk, seen)
+            chunk_ids_by_key.setdefault(key, []).append(chunk.id)
+
+            if chunk.id not in known_ids_by_key.get(key, ()):
+                yield chunk
+
+    db = add_chunk_batches(iter_chunk_batches(new_chunks()), db=db)
+    log_cleanup_stats(stats)
+    return db
+
+def rebuild_vector_store(file_paths=None, index_dir=None):
+    """
+    Embed every PDF from scratch and write a fresh manifest
+
+    Args:
+        file_paths: PDFs of the index (every PDF in DATA_PATH when None)
+        index_dir: Where to write it (a shard of a staged version); when None
+            a new version is written and published once complete
+    """
+    logger.info("Rebuilding the vectorstore from every PDF...")
+    publish = index_dir is None
+
+    if file_paths is None:
+        file_paths = list_pdf_files()
+    file_hashes = {file_key(path): hash_file(path) for path in file_paths}
+
+    chunk_ids_by_key, stats = {}, new_cleanup_stats()
+    db = _index_files(file_paths, chunk_ids_by_key, {}, stats=stats)
+    if db is None:
+        raise CustomException("No text chunks extracted from PDFs")
+
+    manifest = new_manifest()
+    for file_path in file_paths:
+        key = file_key(file_path)
+        manifest["files"][key] = _file_entry(
+            file_path, file_hashes[key], chunk_ids_by_key.get(key, []), stats["duplicates_by_source"].get(file_path, 0)
+        )
+
+    if publish:
+        index_dir = new_index_dir()
+    persist_vector_store(db, index_dir)
+    save_manifest(manifest, index_dir)
+    if publish:
+        publish_index_dir(index_dir)
+
+    logger.info(f"Rebuilt vectorstore from {len(file_paths)} files / {db.index.ntotal} chunks")
+    return db
+
+def update_vector_store_incrementally(file_paths=None, previous_dir=None, index_dir=None):
+    """
+    Embed only new or changed chunks and drop the vectors of removed ones
+
+    Args:
+        file_paths: PDFs of the index (every PDF in DATA_PATH when None)
+        previous_dir: Index to start from (the published version when None)
+        index_dir: Where the updated index goes (a shard of a staged version);
+            when None a new version is written and published, unless nothing changed
+    """
+    publish = index_dir is None
+    if file_paths is None:
+        file_paths = list_pdf_files()
+    if previous_dir is None:
+        previous_dir = current_index_dir()
+    manifest = load_manifest(previous_dir)
+
+    if not vector_store_exists(previous_dir) or not is_compatible(manifest):
+        logger.info("No compatible manifest/index found, falling back to a full rebuild")
+        return rebuild_vector_store(file_paths, index_dir)
+
+    mismatch = embedding_mismatch(previous_dir)
+    if mismatch:
+        logger.info(f"Embedding model changed ({mismatch}), falling back to a full rebuild")
+        return rebuild_vector_store(file_paths, index_dir)
+
+    db = load_vector_store(writable=True, index_dir=previous_dir)
+
+    current_files = {file_key(path): path for path in file_paths}
+    delete_ids = []
+    to_index, file_hashes = [], {}
+    originals_changed = False
+
+    for key in sorted(set(manifest["files"]) - set(current_files)):
+        logger.info(f"Removed: {key}")
+        delete_ids.extend(manifest["files"].pop(key)["chunk_ids"])
+        originals_changed = True
+
+    for key, file_path in current_files.items():
+        entry = manifest["files"].get(key)
+
+        if entry is None:
+            file_hashes[key] = hash_file(file_path)
+            logger.info(f"Added: {key}")
+        else:
+            is_unchanged, file_hashes[key] = _file_unchanged(file_path, entry)
+            if is_unchanged:
+                continue
+            logger.info(f"Changed: {key}")
+            originals_changed = True
+
+        to_index.append(file_path)
+
+    if CHUNK_DEDUP_ENABLED and originals_changed:
+        # A chunk dropped as a duplicate may have lost the copy that was kept
+        for key, file_path in current_files.items():
+            if manifest["files"].get(key, {}).get("duplicate_chunks") and file_path not in to_index:
+                logger.info(f"Rechecking duplicates: {key}")
+                to_index.append(file_path)
+        to_index.sort()
+
+    deduplicator = ChunkDeduplicator()
+    if CHUNK_DEDUP_ENABLED and to_index:
+        # New chunks are compared with those of the files that stay as they are
+        reindexed = {file_key(path) for path in to_index}
+        for document in iter_vector_store_documents(db):
+            key = file_key(document.metadata["source"])
+            if key in current_files and key not in reindexed:
+                deduplicator.add(document.page_content)
+
+    # Chunks whose content did not change keep their id and their vector
+    known_ids_by_key = {
+        file_key(path): set(manifest["files"][file_key(path)]["chunk_ids"])
+        for path in to_index if file_key(path) in manifest["files"]
+    }
+    chunk_ids_by_key, stats = {}, new_cleanup_stats()
+    db = _index_files(to_index, chunk_ids_by_key, known_ids_by_key, db=db, deduplicator=deduplicator, stats=stats)
+
+    embedded = 0
+    for file_path in to_index:
+        key = file_key(file_path)
+        new_ids = chunk_ids_by_key.get(key, [])
+        known_ids = known_ids_by_key.get(key, set())
+        embedded += len(set(new_ids) - known_ids)
+        delete_ids.extend(known_ids.difference(new_ids))
+        manifest["files"][key] = _file_entry(
+            file_path, file_hashes[key], new_ids, stats["duplicates_by_source"].get(file_path, 0)
+        )
+
+    logger.info(
+        f"Incremental ingestion: {len(to_index)} new/changed and "
+        f"{len(current_files) - len(to_index)} unchanged files; "
+        f"{embedded} chunks embedded, {len(delete_ids)} removed"
+    )
+
+    if not embedded and not delete_ids:
+        logger.info("Vectorstore already up to date")
+        missing_lexical_index = not lexical_index_exists(previous_dir)
+        if publish and not missing_lexical_index and manifest == load_manifest(previous_dir):
+            return db
+
+        # Carried into a staged version by hard links; the published one is never modified
+        if publish:
+            index_dir = new_index_dir()
+        link_index_dir(previous_dir, index_dir)
+        if missing_lexical_index:
+            # Stores built before hybrid search only need the lexical index
+            build_lexical_index(iter_vector_store_documents(db), index_dir)
+        save_manifest(manifest, index_dir)
+        if publish:
+            publish_index_dir(index_dir)
+        return db
+
+    if publish:
+        index_dir = new_index_dir()
+    delete_from_vector_store(db, delete_ids)
+    persist_vector_store(db, index_dir)
+    save_manifest(manifest, index_dir)
+    if publish:
+        publish_index_dir(index_dir)
+    return db
+
+def _carried_over(previous_shard, shard):
+    """True if the shard was linked unchanged from the previous version"""
+    try:
+        return os.path.samefile(os.path.join(previous_shard, "index.faiss"), os.path.join(shard, "index.faiss"))
+    except OSError:
+        return False
+
+def update_sharded_vector_store(full=False):
+    """
+    Build or update one index per shard (VECTOR_STORE_SHARDING) in a new index version
+
+    Shards without new, changed or removed PDFs are carried over by hard links,
+    and the version is only published if something changed. A shard that fails
+    keeps its previous index (if it had one) and the run raises at the end.
+    """
+    groups = group_files_by_shard(list_pdf_files())
+    previous_dir = current_index_dir()
+    previous = load_shard_list(previous_dir) or {}
+    index_dir = new_index_dir()
+    shards, failed = {}, []
+    changed = full or set(previous) != set(groups)
+
+    for name, (key, file_paths) in sorted(groups.items()):
+        previous_shard, shard = shard_dir(name, previous_dir), shard_dir(name, index_dir)
+        logger.info(f"Shard {name}: {len(file_paths)} files")
+        try:
+            if full:
+                db = rebuild_vector_store(file_paths, shard)
+            else:
+                db = update_vector_store_incrementally(file_paths, previous_shard, shard)
+        except Exception as e:
+            logger.error(f"Shard {name} failed: {e}")
+            failed.append(name)
+            if name in previous and vector_store_exists(previous_shard):
+                shutil.rmtree(shard, ignore_errors=True)
+                link_index_dir(previous_shard, shard)
+                shards[name] = previous[name]
+            continue
+
+        changed = changed or not _carried_over(previous_shard, shard)
+
+        shards[name] = {
+            "key": key,
+            "collection": collection_of(file_paths[0]),
+            "sources": sorted(file_paths),
+            "chunks": db.index.ntotal,
+        }
+
+    if changed:
+        save_shard_list(shards, index_dir)
+        publish_index_dir(index_dir)
+    else:
+        discard_index_dir(index_dir)
+    logger.info(f"Sharded vectorstore: {len(shards)} shards, {sum(s['chunks'] for s in shards.values())} chunks")
+
+    if failed:
+        raise CustomException(f"{len(failed)} shards failed to build: {', '.join(failed)}")
+
+def process_and_store_pdfs(full=False):
     try:
         logger.info("MAking the vectorstore....")
-        
-        documents = load_pdf_files()
 
-        text_chunks = create_text_chunks(documents)
+        if EMBEDDING_BACKEND == "local" and not os.path.exists(LOCAL_EMBEDDING_MODEL_PATH):
+            # The local model is fitted on the corpus before anything is embedded with it
+            fit_local_embedding_model()
 
-        save_vector_store(text_chunks)
+        if VECTOR_STORE_SHARDING:
+            update_sharded_vector_store(full)
+        elif full:
+            rebuild_vector_store()
+        else:
+            update_vector_store_incrementally()
 
         logger.info("Vectorstore created sucesfully....")
 
@@ -25,4 +309,12 @@ def process_and_store_pdfs():
 
 
 if __name__=="__main__":
-    process_and_store_pdfs()
+    parser = argparse.ArgumentParser(description="Build or update the FAISS vectorstore from the PDFs in DATA_PATH")
+    parser.add_argument("--full", action="store_true", help="Re-embed every PDF instead of only new or changed ones")
+    parser.add_argument("--convert", action="store_true", help="Only convert an index.faiss/index.pkl store to the pickle-free format")
+    args = parser.parse_args()
+
+    if args.convert:
+        convert_legacy_vector_store()
+    else:
+        process_and_store_pdfs(full=args.full)
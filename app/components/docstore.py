@@ -0,0 +1,130 @@
+import json
+import mmap
+import os
+from collections.abc import Mapping
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+from common.logger import get_logger
+from common.custom_exception import CustomException
+
+logger = get_logger(__name__)
+
+# Chunk records (JSON, back to back), their byte offsets and their ids, all
+# in FAISS position order. Replaces the pickled index.pkl.
+DOCSTORE_FILE = "docstore.bin"
+OFFSETS_FILE = "docstore.offsets.npy"
+IDS_FILE = "docstore.ids.npy"
+DOCSTORE_FILES = (DOCSTORE_FILE, OFFSETS_FILE, IDS_FILE)
+
+
+class MmapDocstore(Docstore):
+    """
+    Read-only docstore backed by memory-mapped files
+
+    Nothing is decoded up front: every worker maps the same files, the OS
+    shares their pages, and a query only parses the records it returns.
+    Lookups are by FAISS position (see PositionalIdMap); lookups by chunk id
+    build an id -> position table on first use.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self._offsets = np.load(os.path.join(index_dir, OFFSETS_FILE), mmap_mode="r")
+        self._ids = np.load(os.path.join(index_dir, IDS_FILE), mmap_mode="r")
+
+        with open(os.path.join(index_dir, DOCSTORE_FILE), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        self._positions = None
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def id_at(self, position):
+        return str(self._ids[position])
+
+    def document_at(self, position):
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        record = json.loads(self._data[start:end])
+        return Document(id=record["id"], page_content=record["page_content"], metadata=record["metadata"])
+
+    def iter_documents(self):
+        for position in range(len(self)):
+            yield self.document_at(position)
+
+    def search(self, search):
+        if isinstance(search, (int, np.integer)):
+            position = int(search)
+        else:
+            if self._positions is None:
+                self._positions = {str(id_): position for position, id_ in enumerate(self._ids)}
+            position = self._positions.get(search)
+
+        if position is None or not 0 <= position < len(self):
+            return f"ID {search} not found."
+        return self.document_at(position)
+
+
+class PositionalIdMap(Mapping):
+    """Stand-in for FAISS.index_to_docstore_id that maps a position to itself"""
+
+    def __init__(self, size):
+        self._size = size
+
+    def __getitem__(self, position):
+        position = int(position)
+        if not 0 <= position < self._size:
+            raise KeyError(position)
+        return position
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(range(self._size))
+
+
+def docstore_exists(index_dir):
+    return all(os.path.exists(os.path.join(index_dir, name)) for name in DOCSTORE_FILES)
+
+def write_docstore(documents, index_dir):
+    """
+    Write documents (in FAISS position order) in the memory-mappable format
+
+    Args:
+        documents: Iterable of Documents with their `id` set
+        index_dir: Directory of the index
+    """
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+        tmp_paths = {name: os.path.join(index_dir, name + ".tmp") for name in DOCSTORE_FILES}
+
+        offsets, ids = [0], []
+        with open(tmp_paths[DOCSTORE_FILE], "wb") as f:
+            for document in documents:
+                record = json.dumps(
+                    {"id": document.id, "page_content": document.page_content, "metadata": document.metadata},
+                    ensure_ascii=False,
+                ).encode("utf-8")
+                f.write(record)
+                offsets.append(offsets[-1] + len(record))
+                ids.append(document.id)
+
+        with open(tmp_paths[OFFSETS_FILE], "wb") as f:
+            np.save(f, np.asarray(offsets, dtype=np.int64))
+        with open(tmp_paths[IDS_FILE], "wb") as f:
+            np.save(f, np.asarray(ids, dtype=str))
+
+        for name, tmp_path in tmp_paths.items():
+            os.replace(tmp_path, os.path.join(index_dir, name))
+
+        logger.info(f"Wrote {len(ids)} documents to the docstore in {index_dir}")
+
+    except Exception as e:
+        error_message = CustomException("Failed to write docstore", e)
+        logger.error(str(error_message))
+        raise error_message
@@ -1,18 +1,316 @@
+import os
+import queue
+import asyncio
+import sqlite3
+import threading
+import time
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 
+from components.local_embeddings import TfidfSvdEmbeddings, OnnxEmbeddings
 
 from common.logger import get_logger
 from common.custom_exception import CustomException
+from common.metrics import observe_embedding_batch, count_cache_event
+
+from config.config import (
+    EMBEDDING_BACKEND, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MEMORY_ITEMS, EMBEDDING_CACHE_MAX_ENTRIES,
+    QUERY_EMBED_BATCHING_ENABLED, QUERY_EMBED_BATCH_WINDOW_MS, QUERY_EMBED_MAX_BATCH, QUERY_EMBED_MAX_CONCURRENCY,
+)
 
 logger = get_logger(__name__)
 
+class CachedEmbeddings(Embeddings):
+    """
+    Query-embedding cache: an in-process LRU in front of a shared SQLite file
+
+    Keys are derived from the model name, the dimensions and the normalized
+    text. SQLite (in WAL mode, one connection per thread) makes the on-disk
+    cache safe to share between Flask threads and worker processes. Document
+    embeddings (ingestion) go straight to the wrapped model.
+    """
+
+    def __init__(self, embeddings, model_name, dimensions, path=EMBEDDING_CACHE_PATH,
+                 memory_items=EMBEDDING_CACHE_MEMORY_ITEMS, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self.path = path
+        self.memory_items = memory_items
+        self.max_entries = max_entries
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes_since_eviction = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        self._connect()
+
+    def _connect(self):
+        # A connection inherited through fork() must not be reused by the child
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _key(self, text):
+        normalized = " ".join(unicodedata.normalize("NFC", text).split())
+        return hashlib.sha256(f"{self.model_name}\0{self.dimensions}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, key):
+        vector = self._lookup_memory(key)
+        if vector is None:
+            vector = self._lookup_disk(key)
+        return vector
+
+    def _lookup_memory(self, key):
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                count_cache_event("query_embedding", "memory_hits")
+            return vector
+
+    def _lookup_disk(self, key):
+        connection = self._connect()
+        row = connection.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            with self._lock:
+                self.counters["misses"] += 1
+                count_cache_event("query_embedding", "misses")
+            return None
+
+        vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+        connection.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+        with self._lock:
+            self.counters["disk_hits"] += 1
+            count_cache_event("query_embedding", "disk_hits")
+        self._remember(key, vector)
+        return vector
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _store(self, key, vector):
+        self._remember(key, vector)
+
+        connection = self._connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            (key, np.asarray(vector, dtype=np.float32).tobytes(), time.time()),
+        )
+
+        with self._lock:
+            self._writes_since_eviction += 1
+            due = self._writes_since_eviction >= max(1, self.max_entries // 100)
+            if due:
+                self._writes_since_eviction = 0
+        if due:
+            self._evict(connection)
+
+    def _evict(self, connection):
+        """Trim the SQLite file back under max_entries, least recently used first"""
+        (count,) = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            count_cache_event("query_embedding", "evictions", excess)
+            logger.info(f"Evicted {excess} embeddings from the query cache")
+
+    def embed_query(self, text):
+        key = self._key(text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._store(key, vector)
+        return vector
+
+    async def aembed_query(self, text):
+        key = self._key(text)
+        vector = self._lookup_memory(key)
+        # SQLite can block (slow disk, a write lock held by another worker); keep it off the event loop
+        if vector is None:
+            vector = await asyncio.to_thread(self._lookup_disk, key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self._store, key, vector)
+        return vector
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Coalesces the query embeddings of concurrent requests into one API call
+
+    A dispatcher thread takes the first waiting query, collects more for up to
+    `window_ms` or until `max_batch`, and sends them in a single
+    `embed_documents` call on a small pool (so a slow batch does not hold up
+    the next one). Threads block on the result; coroutines await it.
+    Document embeddings (ingestion) go straight to the wrapped model.
+
+    Args:
+        embeddings: Model the batches are sent to
+        window_ms: Longest wait for more queries after the first one
+        max_batch: Most queries per call
+        max_concurrency: Batches in flight at once
+    """
+
+    def __init__(self, embeddings, window_ms=QUERY_EMBED_BATCH_WINDOW_MS, max_batch=QUERY_EMBED_MAX_BATCH,
+                 max_concurrency=QUERY_EMBED_MAX_CONCURRENCY):
+        self.embeddings = embeddings
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.max_concurrency = max_concurrency
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pending = None
+        self._executor = None
+        self.counters = {"batches": 0, "queries": 0, "duplicates": 0}
+
+    def _queue(self):
+        # Threads do not survive fork(); a worker process starts its own
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pending = queue.Queue()
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="query-embedding")
+                threading.Thread(target=self._dispatch, args=(self._pending,), name="query-embedding-batcher", daemon=True).start()
+                self._pid = os.getpid()
+            return self._pending
+
+    def _submit(self, text):
+        future = Future()
+        self._queue().put((text, future))
+        return future
+
+    def _dispatch(self, pending):
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._embed_batch, batch)
+
+    def _embed_batch(self, batch):
+        # Users asking the same question at once share one input
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            vectors = dict(zip(texts, self.embeddings.embed_documents(texts)))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            self.counters["batches"] += 1
+            self.counters["queries"] += len(batch)
+            self.counters["duplicates"] += len(batch) - len(texts)
+        observe_embedding_batch(len(batch))
+
+        for text, future in batch:
+            future.set_result(vectors[text])
+
+    def embed_query(self, text):
+        return self._submit(text).result()
+
+    async def aembed_query(self, text):
+        return await asyncio.wrap_future(self._submit(text))
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["mean_batch_size"] = round(stats["queries"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["mean_batch_fill"] = round(stats["mean_batch_size"] / self.max_batch, 4)
+        return stats
+
+def embedding_signature(model):
+    """
+    Backend, model and dimensions of an embedding model (looking through the
+    caching and batching wrappers); stored with every index built by it
+    """
+    while not hasattr(model, "signature") and hasattr(model, "embeddings"):
+        model = model.embeddings
+
+    if hasattr(model, "signature"):
+        return model.signature
+    if isinstance(model, OpenAIEmbeddings):
+        return {"backend": "openai", "model": model.model, "dimensions": model.dimensions}
+    return {"backend": type(model).__name__, "model": None, "dimensions": None}
+
+def _load_backend(backend=EMBEDDING_BACKEND):
+    if backend == "openai":
+        return OpenAIEmbeddings( model=EMBEDDING_MODEL,dimensions=EMBEDDING_DIMENSIONS)
+    if backend == "local":
+        return TfidfSvdEmbeddings.load()
+    if backend == "onnx":
+        return OnnxEmbeddings()
+    raise CustomException(f"Unknown EMBEDDING_BACKEND {backend!r}; use 'openai', 'local' or 'onnx'")
+
 def get_embedding_model():
     try:
-        logger.info("Initializing OpenAI embedding model")
+        logger.info(f"Initializing {EMBEDDING_BACKEND} embedding model")
+
+        model = _load_backend()
+        signature = embedding_signature(model)
+
+        # Cache hits never wait for a batch
+        if QUERY_EMBED_BATCHING_ENABLED:
+            model = BatchingEmbeddings(model)
 
-        model = OpenAIEmbeddings( model="text-embedding-3-small",dimensions=1536)
+        if EMBEDDING_CACHE_ENABLED:
+            model = CachedEmbeddings(model, signature["model"], signature["dimensions"])
 
-        logger.info("OpenAI embedding model loaded successfully....")
+        logger.info(f"Embedding model {signature['model']} loaded successfully....")
 
         return model
     
@@ -0,0 +1,52 @@
+import numpy as np
+from langchain_community.vectorstores.faiss import dependable_faiss_import
+
+from common.logger import get_logger
+
+from config.config import FAISS_INDEX_FACTORY, FAISS_NPROBE, FAISS_EF_SEARCH
+
+logger = get_logger(__name__)
+
+
+def create_faiss_index(dimension, index_factory=FAISS_INDEX_FACTORY):
+    """Empty (possibly untrained) index of the configured type"""
+    faiss = dependable_faiss_import()
+    return faiss.index_factory(dimension, index_factory)
+
+def train_faiss_index(index, sample):
+    """
+    Train an IVF/PQ index on a sample of the vectors
+
+    Falls back to an exact flat index when the sample is too small for the
+    configured type (e.g. fewer vectors than IVF lists or PQ centroids).
+    """
+    faiss = dependable_faiss_import()
+    if index.is_trained:
+        return index
+
+    sample = np.ascontiguousarray(sample, dtype=np.float32)
+    try:
+        logger.info(f"Training FAISS index on {len(sample)} vectors")
+        index.train(sample)
+        return index
+    except Exception as e:
+        logger.warning(f"Could not train the configured FAISS index ({e}); using a flat index instead")
+        return faiss.IndexFlatL2(index.d)
+
+def apply_search_parameters(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH):
+    """Set query-time knobs on the index types that have them"""
+    faiss = dependable_faiss_import()
+    parameters = faiss.ParameterSpace()
+
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        try:
+            parameters.set_index_parameter(index, name, value)
+        except Exception:
+            # Not applicable to this index type
+            pass
+    return index
+
+def supports_removal(index):
+    """HNSW graphs cannot drop vectors; IVF and flat indexes can"""
+    faiss = dependable_faiss_import()
+    return not isinstance(faiss.downcast_index(index), faiss.IndexHNSW)
@@ -0,0 +1,545 @@
+"""
+Deadline, hedged requests and a circuit breaker around the chat model
+
+Every call gets LLM_DEADLINE_SECONDS end to end, the whole stream included.
+When the first request has not answered (or, streaming, sent its first
+token) within the LLM_HEDGE_PERCENTILE latency of recent calls, an identical
+request is sent and whichever answers first is used; the other one is
+cancelled. Requests of sync calls run on a shared event loop thread so they
+can be cancelled too. A request that fails outright is retried at once the
+same way. After LLM_BREAKER_FAILURES failed calls in a row the
+circuit breaker opens and calls fail fast for LLM_BREAKER_RESET_SECONDS.
+
+A call that cannot be made (breaker open, deadline passed, every request
+failed) returns the last response to the same prompt if one is cached, and
+otherwise raises LLMUnavailableError, which the app shows as
+LLM_DEGRADED_ANSWER. Degraded text is never returned as a model answer, so
+it cannot end up in the answer cache or a conversation summary.
+"""
+import asyncio
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field, PrivateAttr
+
+from common.logger import get_logger
+from common.custom_exception import CustomException
+from common.metrics import count_llm_event
+
+from config.config import (
+    LLM_DEADLINE_SECONDS, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SECONDS, LLM_HEDGE_MIN_SAMPLES, LLM_MAX_HEDGES,
+    LLM_LATENCY_WINDOW, LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS, LLM_RESPONSE_CACHE_SIZE,
+)
+
+logger = get_logger(__name__)
+
+
+class LLMUnavailableError(CustomException):
+    """The chat model failed, missed its deadline or is cut off by the circuit breaker, and nothing is cached"""
+
+
+class _DeadlineExceeded(Exception):
+    pass
+
+
+_request_loop_lock = threading.Lock()
+_request_loop_owner = None
+_request_loop = None
+
+def _get_request_loop():
+    """Event loop thread running the requests of sync calls (one per process, started on first use)"""
+    global _request_loop, _request_loop_owner
+    with _request_loop_lock:
+        # A forked worker does not inherit the thread, so it starts its own
+        if _request_loop is None or _request_loop_owner != os.getpid():
+            _request_loop = asyncio.new_event_loop()
+            _request_loop_owner = os.getpid()
+            threading.Thread(target=_request_loop.run_forever, name="llm-requests", daemon=True).start()
+        return _request_loop
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed calls
+
+    While open, calls are refused for `reset_seconds`; then a single trial
+    call goes through ("half-open") and closes the breaker if it succeeds.
+    """
+
+    def __init__(self, failures=LLM_BREAKER_FAILURES, reset_seconds=LLM_BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial_at = None
+
+    def _trial_pending(self):
+        # A trial call that never reported back (e.g. its caller went away) expires like the open period
+        return self._trial_at is not None and time.monotonic() - self._trial_at < self.reset_seconds
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._trial_at is not None or time.monotonic() - self._opened_at >= self.reset_seconds:
+                return "half_open"
+            return "open"
+
+    def allow(self):
+        """True if a call may go out now (the caller then owns the trial call when half-open)"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_pending() or time.monotonic() - self._opened_at < self.reset_seconds:
+                return False
+            self._trial_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Chat model answered again, closing the circuit breaker")
+            self._consecutive = 0
+            self._opened_at = None
+            self._trial_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._trial_at is not None or (self.failures > 0 and self._consecutive >= self.failures):
+                if self._opened_at is None:
+                    logger.warning(f"{self._consecutive} chat model calls failed in a row, opening the circuit breaker")
+                self._opened_at = time.monotonic()
+                self._trial_at = None
+
+
+class LatencyTracker:
+    """
+    Recent latencies and event counts of one model
+
+    Request latencies (what the caller waited: the whole answer, or the first
+    token when streaming) are reported; the latencies of the individual
+    requests sent upstream set the hedge delay.
+    """
+
+    KINDS = ("generate", "stream")
+
+    def __init__(self, model_name="llm", window=LLM_LATENCY_WINDOW):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._requests = {kind: deque(maxlen=window) for kind in self.KINDS}
+        self._attempts = {kind: deque(maxlen=window) for kind in self.KINDS}
+        self.counts = {
+            "calls": 0, "hedged": 0, "hedge_wins": 0, "retried": 0,
+            "failed": 0, "deadline_exceeded": 0, "short_circuited": 0, "cache_fallbacks": 0,
+        }
+
+    def count(self, event):
+        with self._lock:
+            self.counts[event] += 1
+        count_llm_event(self.model_name, event)
+
+    def record_attempt(self, kind, seconds):
+        with self._lock:
+            self._attempts[kind].append(seconds)
+
+    def record_request(self, kind, seconds):
+        with self._lock:
+            self._requests[kind].append(seconds)
+
+    def attempt_percentile(self, kind, percentile, min_samples=LLM_HEDGE_MIN_SAMPLES):
+        """Latency percentile of recent upstream requests, or None with fewer than `min_samples`"""
+        with self._lock:
+            samples = list(self._attempts[kind])
+        if len(samples) < max(1, min_samples):
+            return None
+        return float(np.percentile(samples, percentile))
+
+    def summary(self):
+        """p50/p95/p99 request latencies per kind, event counts and the hedge rate"""
+        with self._lock:
+            requests = {kind: list(values) for kind, values in self._requests.items()}
+            counts = dict(self.counts)
+
+        report = {}
+        for kind, values in requests.items():
+            if values:
+                milliseconds = np.asarray(values) * 1000
+                report[kind] = {
+                    "requests": len(values),
+                    "p50_ms": round(float(np.percentile(milliseconds, 50)), 2),
+                    "p95_ms": round(float(np.percentile(milliseconds, 95)), 2),
+                    "p99_ms": round(float(np.percentile(milliseconds, 99)), 2),
+                }
+        report.update(counts)
+        report["hedge_rate"] = round(counts["hedged"] / counts["calls"], 4) if counts["calls"] else 0.0
+        return report
+
+
+class _Race:
+    """State of one call: the requests sent, the winner, and when to hedge or give up"""
+
+    def __init__(self, model, kind):
+        self.model = model
+        self.kind = kind
+        self.started = time.monotonic()
+        self.deadline = self.started + model.deadline_seconds
+        self.hedge_delay = model._hedge_delay(kind)
+        self.attempts = []
+        self.failed = set()
+        self.winner = None
+        self.error = None
+
+    def start_attempt(self):
+        self.attempts.append(time.monotonic())
+        return len(self.attempts) - 1
+
+    def can_start_another(self):
+        return len(self.attempts) <= self.model.max_hedges
+
+    def wait_seconds(self):
+        """How long to wait for the next event: until the deadline, or the next hedge before a request answers"""
+        until = self.deadline
+        if self.winner is None and self.hedge_delay is not None and self.can_start_another():
+            until = min(until, self.attempts[-1] + self.hedge_delay)
+        return max(0.0, until - time.monotonic())
+
+    def expired(self):
+        """After a wait ran out: True at the deadline"""
+        if time.monotonic() < self.deadline:
+            return False
+        if self.winner is None:
+            # Attempts that answered were booked by accept
+            for index, started in enumerate(self.attempts):
+                if index not in self.failed:
+                    self.model.tracker.record_attempt(self.kind, self.deadline - started)
+        return True
+
+    def should_hedge(self):
+        """After a wait ran out before the deadline: True if it is time to send another request"""
+        return self.winner is None and self.can_start_another()
+
+    def accept(self, index, event, value):
+        """
+        What to do with an event from request `index`: "use" it, "ignore" it,
+        "retry" (start another request) or "raise" self.error
+        """
+        if self.winner is not None:
+            return "use" if index == self.winner else "ignore"
+
+        if event == "error":
+            self.failed.add(index)
+            self.error = value
+            if len(self.failed) < len(self.attempts):
+                return "ignore"
+            return "retry" if self.can_start_another() else "raise"
+
+        now = time.monotonic()
+        self.winner = index
+        tracker = self.model.tracker
+        tracker.record_request(self.kind, now - self.started)
+        for other, started in enumerate(self.attempts):
+            # Requests given up on count with the time they had run, which keeps them in the tail
+            if other not in self.failed:
+                tracker.record_attempt(self.kind, now - started)
+        if index > 0:
+            tracker.count("hedge_wins")
+        return "use"
+
+    def losers(self):
+        return [index for index in range(len(self.attempts)) if index != self.winner]
+
+
+def _prompt_key(messages, stop):
+    text = "\0".join(f"{message.type}:{message.content}" for message in messages) + f"\0{stop}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class HedgedChatModel(BaseChatModel):
+    """
+    Chat model wrapper with a deadline, hedged requests and a circuit breaker
+
+    Args:
+        llm: The chat model that sends the requests
+        deadline_seconds: Time a call may take, hedges and retries included
+        hedge_percentile: Recent-latency percentile after which a duplicate
+            request is sent (None never hedges)
+        hedge_min_seconds: Earliest a duplicate is sent
+        max_hedges: Extra requests per call
+        cache_size: Responses kept per prompt for when the model is unavailable
+    """
+
+    llm: BaseChatModel
+    deadline_seconds: float = LLM_DEADLINE_SECONDS
+    hedge_percentile: Optional[float] = LLM_HEDGE_PERCENTILE
+    hedge_min_seconds: float = LLM_HEDGE_MIN_SECONDS
+    max_hedges: int = LLM_MAX_HEDGES
+    cache_size: int = LLM_RESPONSE_CACHE_SIZE
+    breaker: CircuitBreaker = Field(default_factory=CircuitBreaker)
+    tracker: Optional[LatencyTracker] = None
+
+    _responses: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _responses_lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        if self.tracker is None:
+            self.tracker = LatencyTracker(getattr(self.llm, "model_name", None) or self.llm._llm_type)
+
+    @property
+    def _llm_type(self) -> str:
+        return f"hedged-{self.llm._llm_type}"
+
+    def get_num_tokens(self, text: str) -> int:
+        return self.llm.get_num_tokens(text)
+
+    def get_num_tokens_from_messages(self, messages, *args, **kwargs) -> int:
+        return self.llm.get_num_tokens_from_messages(messages, *args, **kwargs)
+
+    def stats(self):
+        return {"breaker": self.breaker.state, **self.tracker.summary()}
+
+    def _hedge_delay(self, kind):
+        if self.hedge_percentile is None or self.max_hedges <= 0 or self.breaker.state != "closed":
+            return None
+        latency = self.tracker.attempt_percentile(kind, self.hedge_percentile)
+        return None if latency is None else max(self.hedge_min_seconds, latency)
+
+    def _remember(self, key, text):
+        if self.cache_size <= 0 or not text:
+            return
+        with self._responses_lock:
+            self._responses[key] = text
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.cache_size:
+                self._responses.popitem(last=False)
+
+    def _fallback(self, key, kind, reason, error=None):
+        """Events replaying the cached response to this prompt; raises LLMUnavailableError without one"""
+        with self._responses_lock:
+            text = self._responses.get(key)
+        if text is None:
+            raise LLMUnavailableError(f"Chat model unavailable ({reason})", error)
+
+        logger.warning(f"Chat model unavailable ({reason}), answering from the response cache")
+        self.tracker.count("cache_fallbacks")
+        if kind == "stream":
+            return [("chunk", ChatGenerationChunk(message=AIMessageChunk(content=text))), ("done", None)]
+        return [("done", ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))]))]
+
+    def _begin(self, key, kind):
+        """Fallback events if the breaker refuses the call, else None"""
+        self.tracker.count("calls")
+        if self.breaker.allow():
+            return None
+        self.tracker.count("short_circuited")
+        return self._fallback(key, kind, "circuit breaker open")
+
+    def _succeeded(self, key, parts, value):
+        """Book a successful call; `parts` is the streamed text, `value` the final ChatResult (None when streaming)"""
+        if value is not None and value.generations:
+            parts = parts + [value.generations[0].message.content]
+        self.breaker.record_success()
+        self._remember(key, "".join(str(part) for part in parts))
+
+    def _failed(self, key, kind, error, answered):
+        """Book a failed call; fallback events, or raises when part of the answer is already out"""
+        self.breaker.record_failure()
+        if isinstance(error, _DeadlineExceeded):
+            self.tracker.count("deadline_exceeded")
+            reason, error = f"no answer within {self.deadline_seconds}s", None
+        else:
+            self.tracker.count("failed")
+            reason = type(error).__name__
+        if answered:
+            raise LLMUnavailableError(f"Chat model stream broke off ({reason})", error)
+        return self._fallback(key, kind, reason, error)
+
+    # Requests: coroutines that report their events to a queue (sync and async calls share them)
+
+    def _generate_attempt(self, messages, stop, kwargs):
+        async def attempt(index, events):
+            try:
+                result = await self.llm.agenerate([messages], stop=stop, **kwargs)
+                events.put_nowait((index, "done", ChatResult(generations=result.generations[0], llm_output=result.llm_output)))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                events.put_nowait((index, "error", e))
+        return attempt
+
+    def _stream_attempt(self, messages, stop, kwargs):
+        async def attempt(index, events):
+            try:
+                async for chunk in self.llm.astream(messages, stop=stop, **kwargs):
+                    events.put_nowait((index, "chunk", chunk))
+                events.put_nowait((index, "done", None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                events.put_nowait((index, "error", e))
+        return attempt
+
+    # Sync path: the requests run on the shared request loop and report to a thread-safe queue
+
+    def _race(self, kind, attempt):
+        race, events, futures = _Race(self, kind), queue.Queue(), []
+        loop = _get_request_loop()
+
+        def launch():
+            futures.append(asyncio.run_coroutine_threadsafe(attempt(race.start_attempt(), events), loop))
+
+        launch()
+        try:
+            while True:
+                try:
+                    index, event, value = events.get(timeout=race.wait_seconds())
+                except queue.Empty:
+                    if race.expired():
+                        raise _DeadlineExceeded()
+                    if race.should_hedge():
+                        self.tracker.count("hedged")
+                        launch()
+                    continue
+
+                action = race.accept(index, event, value)
+                if action == "ignore":
+                    continue
+                if action == "retry":
+                    self.tracker.count("retried")
+                    launch()
+                    continue
+                if action == "raise":
+                    raise race.error
+
+                for loser in race.losers():
+                    futures[loser].cancel()
+                yield event, value
+                if event == "done":
+                    return
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _call(self, messages, stop, kind, attempt):
+        key = _prompt_key(messages, stop)
+        fallback = self._begin(key, kind)
+        if fallback is not None:
+            yield from fallback
+            return
+
+        parts, answered = [], False
+        try:
+            for event, value in self._race(kind, attempt):
+                if event == "chunk":
+                    answered = True
+                    parts.append(value.content)
+                else:
+                    # Booked before "done" is passed on: the caller stops reading there
+                    self._succeeded(key, parts, value)
+                yield event, value
+        except Exception as e:
+            yield from self._failed(key, kind, e, answered)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        kwargs.pop("stream", None)
+        attempt = self._generate_attempt(messages, stop, kwargs)
+        for event, value in self._call(messages, stop, "generate", attempt):
+            if event == "done":
+                return value
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        kwargs.pop("stream", None)
+        attempt = self._stream_attempt(messages, stop, kwargs)
+        for event, value in self._call(messages, stop, "stream", attempt):
+            if event == "chunk":
+                yield value if isinstance(value, ChatGenerationChunk) else ChatGenerationChunk(message=value)
+
+    # Async path: every request is a task; the losers are cancelled
+
+    async def _arace(self, kind, attempt):
+        race, events, tasks = _Race(self, kind), asyncio.Queue(), []
+
+        def launch():
+            tasks.append(asyncio.ensure_future(attempt(race.start_attempt(), events)))
+
+        launch()
+        try:
+            while True:
+                try:
+                    index, event, value = await asyncio.wait_for(events.get(), race.wait_seconds())
+                except asyncio.TimeoutError:
+                    if race.expired():
+                        raise _DeadlineExceeded()
+                    if race.should_hedge():
+                        self.tracker.count("hedged")
+                        launch()
+                    continue
+
+                action = race.accept(index, event, value)
+                if action == "ignore":
+                    continue
+                if action == "retry":
+                    self.tracker.count("retried")
+                    launch()
+                    continue
+                if action == "raise":
+                    raise race.error
+
+                for loser in race.losers():
+                    tasks[loser].cancel()
+                yield event, value
+                if event == "done":
+                    return
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _acall(self, messages, stop, kind, attempt):
+        key = _prompt_key(messages, stop)
+        fallback = self._begin(key, kind)
+        if fallback is not None:
+            for event, value in fallback:
+                yield event, value
+            return
+
+        parts, answered, error = [], False, None
+        try:
+            async for event, value in self._arace(kind, attempt):
+                if event == "chunk":
+                    answered = True
+                    parts.append(value.content)
+                else:
+                    self._succeeded(key, parts, value)
+                yield event, value
+        except Exception as e:
+            error = e
+
+        if error is not None:
+            for event, value in self._failed(key, kind, error, answered):
+                yield event, value
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        kwargs.pop("stream", None)
+        attempt = self._generate_attempt(messages, stop, kwargs)
+        async for event, value in self._acall(messages, stop, "generate", attempt):
+            if event == "done":
+                return value
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        kwargs.pop("stream", None)
+        attempt = self._stream_attempt(messages, stop, kwargs)
+        async for event, value in self._acall(messages, stop, "stream", attempt):
+            if event == "chunk":
+                yield value if isinstance(value, ChatGenerationChunk) else ChatGenerationChunk(message=value)
@@ -0,0 +1,94 @@
+from typing import Any, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from components.vector_store import search_vector_store, asearch_vector_store, search_vector_store_batch
+from components.sharded_store import matches_filter
+from common.logger import get_logger
+from common.metrics import span
+
+from config.config import RETRIEVER_K, HYBRID_SEARCH_ENABLED, HYBRID_FETCH_K, RRF_K
+
+logger = get_logger(__name__)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Dense + BM25 retrieval merged with reciprocal-rank fusion
+
+    Exact terms (drug names, ICD codes, abbreviations) that dense search
+    misses are recovered by the lexical index, so k can stay small.
+    Without a lexical index this is plain vector search. `filter` limits both
+    sides to chunks with matching metadata (see search_vector_store).
+    """
+
+    vector_store: Any
+    lexical_index: Optional[Any] = None
+    k: int = RETRIEVER_K
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = RRF_K
+    filter: Optional[dict] = None
+
+    def _lexical_documents(self, query):
+        docstore = self.vector_store.docstore
+        mapping = self.vector_store.index_to_docstore_id
+        with span("lexical_search"):
+            documents = [docstore.search(mapping[position]) for position, _ in self.lexical_index.search(query, self.fetch_k)]
+        if self.filter:
+            documents = [document for document in documents if matches_filter(document.metadata, self.filter)]
+        return documents
+
+    def _fuse(self, rankings):
+        scores, documents = {}, {}
+        for ranking in rankings:
+            for rank, document in enumerate(ranking):
+                key = document.id or document.page_content
+                scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+                documents.setdefault(key, document)
+
+        best = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return [documents[key] for key in best]
+
+    def retrieve_batch(self, queries, vectors):
+        """Documents for many queries from their precomputed vectors, with one FAISS search"""
+        with span("retrieval"):
+            if self.lexical_index is None:
+                return search_vector_store_batch(self.vector_store, vectors, self.k, self.filter, self.fetch_k)
+
+            dense = search_vector_store_batch(self.vector_store, vectors, self.fetch_k, self.filter, self.fetch_k)
+            return [self._fuse([hits, self._lexical_documents(query)]) for query, hits in zip(queries, dense)]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        with span("retrieval"):
+            if self.lexical_index is None:
+                return search_vector_store(self.vector_store, query, self.k, self.filter)
+
+            return self._fuse([
+                search_vector_store(self.vector_store, query, self.fetch_k, self.filter),
+                self._lexical_documents(query),
+            ])
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        # The query embedding is awaited; the FAISS and BM25 lookups are CPU-bound and short
+        with span("retrieval"):
+            if self.lexical_index is None:
+                return await asearch_vector_store(self.vector_store, query, self.k, self.filter)
+
+            return self._fuse([
+                await asearch_vector_store(self.vector_store, query, self.fetch_k, self.filter),
+                self._lexical_documents(query),
+            ])
+
+
+def create_retriever(db, lexical_index=None):
+    """Retriever used by both QA chains"""
+    return HybridRetriever(
+        vector_store=db,
+        lexical_index=lexical_index if HYBRID_SEARCH_ENABLED else None,
+    )
@@ -0,0 +1,242 @@
+"""
+Versioned index directories under DB_FAISS_PATH
+
+Every ingestion run writes a complete index into a new directory,
+DB_FAISS_PATH/versions/<version>/, and publishes it by atomically replacing
+the DB_FAISS_PATH/CURRENT pointer file, so a reader always sees either the
+old or the new index, never a half-written one. A published version is never
+modified. Processes serving a version, or still writing one, hold a shared
+lock on its `.readers` file; other versions are deleted once they are not
+among the INDEX_KEEP_VERSIONS most recently modified and nobody holds that lock.
+Versions newer than the published one (left behind by a rollback) are
+collected like older ones.
+
+Stores from before versioning (files directly in DB_FAISS_PATH) are still
+read from there until the first versioned build is published.
+
+    python -m components.index_versions --list
+    python -m components.index_versions --publish <version>   # roll back or forward
+"""
+import argparse
+import os
+import shutil
+import weakref
+from datetime import datetime
+
+from common.logger import get_logger
+from common.custom_exception import CustomException
+
+from config.config import DB_FAISS_PATH, INDEX_KEEP_VERSIONS
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows: versions are then only kept by INDEX_KEEP_VERSIONS
+    fcntl = None
+
+logger = get_logger(__name__)
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+READERS_FILE = ".readers"
+
+# Leases on the versions this process is writing, so they are not collected before publishing
+_staged_leases = {}
+
+
+def versions_root(root=DB_FAISS_PATH):
+    return os.path.join(root, VERSIONS_DIR)
+
+def current_version(root=DB_FAISS_PATH):
+    """Name of the published version, or None for an unversioned (or missing) store"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def version_dir(version, root=DB_FAISS_PATH):
+    """Directory of an index version (DB_FAISS_PATH itself for None, an unversioned store)"""
+    return os.path.join(versions_root(root), version) if version else root
+
+def current_index_dir(root=DB_FAISS_PATH):
+    """Directory of the published index"""
+    return version_dir(current_version(root), root)
+
+def list_versions(root=DB_FAISS_PATH):
+    """Version names, oldest first (names sort by creation time)"""
+    if not os.path.isdir(versions_root(root)):
+        return []
+    return sorted(
+        name for name in os.listdir(versions_root(root))
+        if os.path.isdir(os.path.join(versions_root(root), name))
+    )
+
+def new_index_dir(root=DB_FAISS_PATH):
+    """
+    Empty directory for the next version; invisible to readers until published
+
+    The version is leased until it is published or discarded (or this
+    process exits), so a concurrent collect_old_versions leaves it alone.
+    """
+    version = f"{datetime.now():%Y%m%dT%H%M%S%f}-{os.getpid()}"
+    path = os.path.join(versions_root(root), version)
+    os.makedirs(path)
+    _staged_leases[os.path.normpath(path)] = acquire_reader_lease(path)
+    return path
+
+def _release_staged_lease(index_dir):
+    lease = _staged_leases.pop(os.path.normpath(index_dir), None)
+    if lease is not None:
+        lease.release()
+
+def publish_index_dir(index_dir, root=DB_FAISS_PATH):
+    """Point CURRENT at `index_dir` (one atomic rename), then drop unused old versions"""
+    version = os.path.basename(os.path.normpath(index_dir))
+    if not os.path.isdir(os.path.join(versions_root(root), version)):
+        raise CustomException(f"No index version {version} in {versions_root(root)}")
+
+    tmp_path = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+    logger.info(f"Published index version {version}")
+    _release_staged_lease(index_dir)
+
+    collect_old_versions(root)
+    return version
+
+def discard_index_dir(index_dir):
+    """Remove a version that was staged but is not going to be published"""
+    _release_staged_lease(index_dir)
+    shutil.rmtree(index_dir, ignore_errors=True)
+
+def link_index_dir(source, target):
+    """Copy an index directory by hard links (files are never modified once published)"""
+    def link(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    # An unversioned store lives in DB_FAISS_PATH itself, next to the versions
+    shutil.copytree(
+        source, target, copy_function=link, dirs_exist_ok=True,
+        ignore=shutil.ignore_patterns(READERS_FILE, "*.tmp", VERSIONS_DIR, CURRENT_FILE),
+    )
+
+
+class _ReaderLease:
+    """Shared lock on a version's `.readers` file, held while the version is being served"""
+
+    def __init__(self, handle):
+        self._handle = handle
+
+    def release(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+def acquire_reader_lease(index_dir):
+    """
+    Lease on the version containing `index_dir`, or None if that version was
+    deleted meanwhile (resolve CURRENT again and retry)
+
+    Unversioned stores and platforms without flock get a lease that does nothing.
+    """
+    version_dir = os.path.normpath(index_dir)
+    if os.path.basename(os.path.dirname(version_dir)) != VERSIONS_DIR or fcntl is None:
+        return _ReaderLease(None)
+
+    try:
+        handle = open(os.path.join(version_dir, READERS_FILE), "a")
+    except FileNotFoundError:
+        return None
+    fcntl.flock(handle, fcntl.LOCK_SH)
+    # The garbage collector may have removed the version while we waited for the lock
+    if not os.path.isdir(version_dir) or not os.path.exists(os.path.join(version_dir, READERS_FILE)):
+        handle.close()
+        return None
+    return _ReaderLease(handle)
+
+def hold_lease(resource, lease):
+    """Keep `lease` until `resource` (e.g. the loaded store) is garbage-collected"""
+    weakref.finalize(resource, lease.release)
+    return resource
+
+def _remove_if_unused(version_dir):
+    """Delete the version unless a process holds a lease on it; True if it was deleted"""
+    if fcntl is None:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        return True
+    try:
+        handle = open(os.path.join(version_dir, READERS_FILE), "a")
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    # Deleted while the exclusive lock is held, so no reader can slip in
+    shutil.rmtree(version_dir, ignore_errors=True)
+    handle.close()
+    return True
+
+def _modified_at(version, root):
+    try:
+        return os.stat(os.path.join(versions_root(root), version)).st_mtime
+    except OSError:
+        return 0.0
+
+def collect_old_versions(root=DB_FAISS_PATH, keep=INDEX_KEEP_VERSIONS):
+    """
+    Delete the versions other than the published one, least recently
+    modified first, beyond the `keep` most recent (the published one
+    included), that no process is reading or writing
+
+    Returns the names of the deleted versions.
+    """
+    current = current_version(root)
+    if current is None:
+        return []
+
+    others = [version for version in list_versions(root) if version != current]
+    if fcntl is None:
+        # Without leases a version being written cannot be told apart; only older names are safe
+        others = [version for version in others if version < current]
+    others.sort(key=lambda version: (_modified_at(version, root), version))
+    candidates = others[:max(len(others) - max(keep - 1, 0), 0)]
+
+    removed = [
+        version for version in candidates
+        if _remove_if_unused(os.path.join(versions_root(root), version))
+    ]
+    if removed:
+        logger.info(f"Removed {len(removed)} old index versions: {', '.join(removed)}")
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--list", action="store_true", help="List the versions on disk")
+    group.add_argument("--publish", metavar="VERSION", help="Point CURRENT at an existing version")
+    group.add_argument("--gc", action="store_true", help="Delete old versions nobody is reading")
+    args = parser.parse_args()
+
+    if args.list:
+        current = current_version()
+        for version in list_versions():
+            print(f"{'*' if version == current else ' '} {version}")
+    elif args.publish:
+        publish_index_dir(version_dir(args.publish))
+    else:
+        print("\n".join(collect_old_versions()))
+
+
+if __name__ == "__main__":
+    main()
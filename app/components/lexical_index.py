@@ -0,0 +1,171 @@
+import os
+import re
+import shutil
+import time
+from collections import Counter
+
+import numpy as np
+
+from common.logger import get_logger
+from common.custom_exception import CustomException
+
+from config.config import BM25_K1, BM25_B
+
+logger = get_logger(__name__)
+
+LEXICAL_DIR = "lexical"
+_ARRAYS = ("vocab", "indptr", "docs", "tfs", "doc_lengths")
+
+# Keeps codes and compound terms together: "e11.9", "hba1c", "covid-19", "5-fu"
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+_MAX_TOKEN_LENGTH = 40
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what which "
+    "with how why when who do does can".split()
+)
+
+
+def tokenize(text):
+    """Lowercased terms; compounds are indexed whole and by their parts"""
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        token = token[:_MAX_TOKEN_LENGTH]
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-./]", token) if part and part not in _STOPWORDS)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 over an inverted index stored as sparse (CSR) arrays
+
+    Row t of the postings holds the chunk positions (FAISS order) containing
+    the t-th term of the sorted vocabulary, with their term frequencies. All
+    arrays are memory-mapped, so loading costs next to nothing.
+    """
+
+    def __init__(self, arrays):
+        self.vocab = arrays["vocab"]
+        self.indptr = arrays["indptr"]
+        self.docs = arrays["docs"]
+        self.tfs = arrays["tfs"]
+        self.doc_lengths = arrays["doc_lengths"]
+        self.avg_doc_length = max(float(self.doc_lengths.mean()), 1.0) if len(self.doc_lengths) else 1.0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def _term_row(self, term):
+        row = int(np.searchsorted(self.vocab, term))
+        if row < len(self.vocab) and self.vocab[row] == term:
+            return row
+        return None
+
+    def document_frequency(self, term):
+        """Chunks containing `term` (a single token)"""
+        row = self._term_row(term)
+        return 0 if row is None else int(self.indptr[row + 1] - self.indptr[row])
+
+    def search(self, query, k):
+        """Return [(position, score)] of the k best BM25 matches"""
+        started = time.perf_counter()
+        n_docs = len(self)
+
+        positions, scores = [], []
+        for term in set(tokenize(query)):
+            row = self._term_row(term)
+            if row is None:
+                continue
+            start, end = int(self.indptr[row]), int(self.indptr[row + 1])
+            docs = np.asarray(self.docs[start:end])
+            tfs = np.asarray(self.tfs[start:end], dtype=np.float32)
+
+            df = end - start
+            idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_lengths[docs] / self.avg_doc_length)
+            positions.append(docs)
+            scores.append(idf * tfs * (BM25_K1 + 1.0) / (tfs + norm))
+
+        results = []
+        if positions:
+            unique, inverse = np.unique(np.concatenate(positions), return_inverse=True)
+            totals = np.bincount(inverse, weights=np.concatenate(scores))
+            top = np.argsort(-totals)[:k]
+            results = [(int(unique[i]), float(totals[i])) for i in top]
+
+        logger.info(f"Lexical lookup took {(time.perf_counter() - started) * 1000:.2f}ms ({len(results)} hits)")
+        return results
+
+
+def build_lexical_index(documents, index_dir):
+    """
+    Build the inverted index for documents given in FAISS position order
+
+    Args:
+        documents: Iterable of Documents
+        index_dir: Index directory; the arrays go to its `lexical/` subdirectory
+    """
+    try:
+        started = time.perf_counter()
+
+        vocabulary, term_ids, doc_ids, tfs, doc_lengths = {}, [], [], [], []
+        for position, document in enumerate(documents):
+            counts = Counter(tokenize(document.page_content))
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(position)
+                tfs.append(tf)
+
+        # Renumber terms in sorted order so lookups are a binary search
+        terms = sorted(vocabulary)
+        rank = np.empty(len(terms), dtype=np.int64)
+        rank[[vocabulary[term] for term in terms]] = np.arange(len(terms))
+        term_rows = rank[np.asarray(term_ids, dtype=np.int64)] if term_ids else np.zeros(0, dtype=np.int64)
+
+        order = np.argsort(term_rows, kind="stable")
+        arrays = {
+            "vocab": np.asarray(terms, dtype=str),
+            "indptr": np.concatenate([[0], np.cumsum(np.bincount(term_rows, minlength=len(terms)))]).astype(np.int64),
+            "docs": np.asarray(doc_ids, dtype=np.int32)[order],
+            "tfs": np.asarray(tfs, dtype=np.uint16)[order],
+            "doc_lengths": np.asarray(doc_lengths, dtype=np.float32),
+        }
+
+        lexical_dir = os.path.join(index_dir, LEXICAL_DIR)
+        tmp_dir = lexical_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+        shutil.rmtree(lexical_dir, ignore_errors=True)
+        os.replace(tmp_dir, lexical_dir)
+
+        logger.info(
+            f"Built lexical index over {len(doc_lengths)} chunks / {len(terms)} terms "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+    except Exception as e:
+        error_message = CustomException("Failed to build lexical index", e)
+        logger.error(str(error_message))
+        raise error_message
+
+def lexical_index_exists(index_dir):
+    lexical_dir = os.path.join(index_dir, LEXICAL_DIR)
+    return all(os.path.exists(os.path.join(lexical_dir, f"{name}.npy")) for name in _ARRAYS)
+
+def load_lexical_index(index_dir):
+    """Memory-map the lexical index, or return None if it was never built"""
+    lexical_dir = os.path.join(index_dir, LEXICAL_DIR)
+    if not lexical_index_exists(index_dir):
+        logger.warning(f"No lexical index in {index_dir}; retrieval will be vector-only")
+        return None
+
+    return LexicalIndex({
+        name: np.load(os.path.join(lexical_dir, f"{name}.npy"), mmap_mode="r")
+        for name in _ARRAYS
+    })
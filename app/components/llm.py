@@ -1,11 +1,35 @@
 from langchain_openai import ChatOpenAI
-from config.config import OPEN_AI_API_KEY,OPEN_AI_MODEL
+from langchain_core.callbacks import BaseCallbackHandler
+from components.hedged_llm import HedgedChatModel
+from config.config import OPEN_AI_API_KEY,OPEN_AI_MODEL,METRICS_ENABLED,LLM_DEADLINE_SECONDS,LLM_MAX_RETRIES
 
 from common.logger import get_logger
 from common.custom_exception import CustomException
+from common.metrics import count_tokens
 
 logger = get_logger(__name__)
 
+class TokenUsageHandler(BaseCallbackHandler):
+    """Adds the token usage reported for each chat model call to the metrics"""
+
+    run_inline = True
+
+    def __init__(self, model):
+        self.model = model
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage")
+        if usage:
+            count_tokens(self.model, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+            return
+
+        # Streamed calls report usage on the final message instead
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    count_tokens(self.model, usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+
 def load_llm(OPEN_AI_MODEL: str = OPEN_AI_MODEL ,OPEN_AI_API_KEY :str = OPEN_AI_API_KEY):
     try:
         logger.info("Loading OpenAI LLM")
@@ -13,11 +37,16 @@ def load_llm(OPEN_AI_MODEL: str = OPEN_AI_MODEL ,OPEN_AI_API_KEY :str = OPEN_AI_
         llm = ChatOpenAI(
                 model=OPEN_AI_MODEL,
                 api_key=OPEN_AI_API_KEY,
+                stream_usage=METRICS_ENABLED,
+                callbacks=[TokenUsageHandler(OPEN_AI_MODEL)] if METRICS_ENABLED else None,
+                # The wrapper hedges and retries within the deadline; the client must not outlast it
+                timeout=LLM_DEADLINE_SECONDS,
+                max_retries=LLM_MAX_RETRIES,
             )
 
         logger.info("OpenAI LLM loaded successfully...")
 
-        return llm
+        return HedgedChatModel(llm=llm)
     
     except Exception as e:
         error_message = CustomException("Failed to load a llm" , e)
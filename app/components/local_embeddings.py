@@ -0,0 +1,331 @@
+"""
+Embedding models that run on the local CPU, without network calls
+
+TfidfSvdEmbeddings (EMBEDDING_BACKEND = "local") hashes the words and word
+pairs of a text into LOCAL_EMBEDDING_HASH_FEATURES buckets, weights them by
+TF-IDF and projects them onto the leading LOCAL_EMBEDDING_DIMENSIONS singular
+vectors of the TF-IDF matrix of a corpus sample (latent semantic analysis).
+It is fitted on the PDFs in DATA_PATH and saved to LOCAL_EMBEDDING_MODEL_PATH;
+the ingestion fits it when that file does not exist yet.
+
+OnnxEmbeddings (EMBEDDING_BACKEND = "onnx") runs a sentence-embedding model
+exported to ONNX, with its Hugging Face tokenizer.json. It needs the optional
+onnxruntime and tokenizers packages.
+
+Large document batches are spread over LOCAL_EMBEDDING_WORKERS processes
+(local model) or ONNX Runtime threads.
+
+    python -m components.local_embeddings fit    # then rebuild the index with --full
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import random
+import re
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from common.logger import get_logger
+from common.custom_exception import CustomException
+
+from config.config import (
+    LOCAL_EMBEDDING_MODEL_PATH, LOCAL_EMBEDDING_DIMENSIONS, LOCAL_EMBEDDING_HASH_FEATURES, LOCAL_EMBEDDING_FIT_SAMPLE,
+    LOCAL_EMBEDDING_WORKERS, ONNX_EMBEDDING_MODEL_PATH, ONNX_EMBEDDING_TOKENIZER_PATH, ONNX_EMBEDDING_MAX_LENGTH,
+)
+
+logger = get_logger(__name__)
+
+_WORD_PATTERN = re.compile(r"\w+")
+# Products computed at once in SparseRows.dot; bounds the temporary memory
+_PRODUCTS_PER_STEP = 1 << 16
+# Smaller batches are not worth sending to the worker processes
+_MIN_TEXTS_PER_WORKER = 64
+
+
+def _hashed_terms(text, features):
+    """Hash buckets of the words and word pairs of `text` (crc32, so equal in every process)"""
+    words = _WORD_PATTERN.findall(text.lower())
+    terms = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+    return [zlib.crc32(term.encode("utf-8")) % features for term in terms]
+
+def _hashed_counts(texts, features):
+    """(rows, columns, counts) of the hashed term counts of `texts`, sorted by row and column"""
+    rows, columns = [], []
+    for row, text in enumerate(texts):
+        buckets = _hashed_terms(text, features)
+        columns.extend(buckets)
+        rows.extend([row] * len(buckets))
+
+    keys, counts = np.unique(np.asarray(rows, dtype=np.int64) * features + np.asarray(columns, dtype=np.int64), return_counts=True)
+    rows, columns = np.divmod(keys, features)
+    return rows, columns, counts
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+class SparseRows:
+    """Sparse matrix as (row, column, value) triples sorted by row; just enough for `matrix @ dense`"""
+
+    def __init__(self, rows, columns, values, shape):
+        self.rows = rows
+        self.columns = columns
+        self.values = values
+        self.shape = shape
+
+    @classmethod
+    def tfidf(cls, rows, columns, counts, idf, n_rows):
+        """Sublinear TF-IDF weights, each row scaled to unit length"""
+        values = ((1 + np.log(counts)) * idf[columns]).astype(np.float32)
+        norms = np.sqrt(np.bincount(rows, weights=values.astype(np.float64) ** 2, minlength=n_rows))
+        values /= np.where(norms > 0, norms, 1)[rows].astype(np.float32)
+        return cls(rows, columns, values, (n_rows, len(idf)))
+
+    def transpose(self):
+        order = np.argsort(self.columns, kind="stable")
+        return SparseRows(self.columns[order], self.rows[order], self.values[order], self.shape[::-1])
+
+    def dot(self, dense):
+        """self @ dense, gathering the rows of `dense` a bounded number of products at a time"""
+        out = np.zeros((self.shape[0], dense.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.values), _PRODUCTS_PER_STEP):
+            rows = self.rows[start:start + _PRODUCTS_PER_STEP]
+            products = self.values[start:start + _PRODUCTS_PER_STEP, None] * dense[self.columns[start:start + _PRODUCTS_PER_STEP]]
+            # A row cut off by the step boundary gets its two partial sums added
+            firsts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+            out[rows[firsts]] += np.add.reduceat(products, firsts, axis=0)
+        return out
+
+
+def randomized_svd(matrix, rank, iterations=2, oversampling=10, seed=0):
+    """
+    Leading singular values and right singular vectors (rank × columns) of a SparseRows matrix
+
+    Randomized range finder with power iterations (Halko, Martinsson and Tropp),
+    so only products with thin dense matrices are needed.
+    """
+    transposed = matrix.transpose()
+    rng = np.random.default_rng(seed)
+    sample = matrix.dot(rng.standard_normal((matrix.shape[1], rank + oversampling)).astype(np.float32))
+    for _ in range(iterations):
+        sample, _ = np.linalg.qr(sample)
+        sample, _ = np.linalg.qr(transposed.dot(sample))
+        sample = matrix.dot(sample)
+    basis, _ = np.linalg.qr(sample)
+
+    _, singular_values, components = np.linalg.svd(transposed.dot(basis).T, full_matrices=False)
+    return singular_values[:rank], components[:rank]
+
+
+class TfidfSvdEmbeddings(Embeddings):
+    """
+    Hashed TF-IDF vectors projected onto the singular vectors of a corpus sample
+
+    Args:
+        idf: Inverse document frequency of every hash bucket
+        projection: (buckets × dimensions) matrix mapping TF-IDF vectors to embeddings
+        path: File the model was loaded from; worker processes load it from there
+        workers: Processes used for large document batches
+    """
+
+    def __init__(self, idf, projection, path=None, workers=LOCAL_EMBEDDING_WORKERS):
+        self.idf = idf
+        self.projection = projection
+        self.path = path
+        self.workers = workers
+        self.dimensions = projection.shape[1]
+        self.fingerprint = hashlib.sha256(idf.tobytes() + projection.tobytes()).hexdigest()[:16]
+        self.signature = {"backend": "local", "model": f"tfidf-svd-{self.fingerprint}", "dimensions": self.dimensions}
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+
+    @classmethod
+    def fit(cls, texts, dimensions=LOCAL_EMBEDDING_DIMENSIONS, features=LOCAL_EMBEDDING_HASH_FEATURES):
+        """Fit the IDF weights and the projection on a sample of chunk texts"""
+        texts = list(texts)
+        if not texts:
+            raise CustomException("No texts to fit the local embedding model on")
+
+        rows, columns, counts = _hashed_counts(texts, features)
+        document_frequency = np.bincount(columns, minlength=features)
+        idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+
+        rank = min(dimensions, len(texts))
+        _, components = randomized_svd(SparseRows.tfidf(rows, columns, counts, idf, len(texts)), rank)
+        return cls(idf, np.ascontiguousarray(components.T, dtype=np.float32))
+
+    @classmethod
+    def load(cls, path=LOCAL_EMBEDDING_MODEL_PATH, workers=LOCAL_EMBEDDING_WORKERS):
+        if not os.path.exists(path):
+            raise CustomException(
+                f"No local embedding model at {path}; run the ingestion or python -m components.local_embeddings fit"
+            )
+        with np.load(path) as data:
+            return cls(data["idf"], data["projection"], path=path, workers=workers)
+
+    def save(self, path=LOCAL_EMBEDDING_MODEL_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, idf=self.idf, projection=self.projection)
+        os.replace(path + ".tmp", path)
+        self.path = path
+
+    def transform(self, texts):
+        """Unit-length embeddings of `texts` as a (len(texts) × dimensions) array"""
+        rows, columns, counts = _hashed_counts(texts, len(self.idf))
+        return _normalize(SparseRows.tfidf(rows, columns, counts, self.idf, len(texts)).dot(self.projection))
+
+    def _pool(self):
+        # Worker processes do not survive fork(); spawned ones load the saved model
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_load_worker_model, initargs=(self.path,),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def embed_documents(self, texts):
+        parts = min(self.workers, len(texts) // _MIN_TEXTS_PER_WORKER)
+        if parts < 2 or self.path is None:
+            return self.transform(texts).tolist()
+
+        futures = [self._pool().submit(_embed_in_worker, list(part)) for part in np.array_split(np.asarray(texts, dtype=object), parts)]
+        return np.vstack([future.result() for future in futures]).tolist()
+
+    def embed_query(self, text):
+        return self.transform([text])[0].tolist()
+
+
+_worker_model = None
+
+def _load_worker_model(path):
+    global _worker_model
+    _worker_model = TfidfSvdEmbeddings.load(path, workers=1)
+
+def _embed_in_worker(texts):
+    return _worker_model.transform(texts)
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence-embedding model exported to ONNX, mean pooled and normalized
+
+    Args:
+        model_path: The .onnx file
+        tokenizer_path: Its tokenizer.json (Hugging Face tokenizers format)
+        max_length: Tokens per text; longer texts are truncated
+        batch_size: Texts per ONNX Runtime call
+        threads: ONNX Runtime intra-op threads
+    """
+
+    def __init__(self, model_path=ONNX_EMBEDDING_MODEL_PATH, tokenizer_path=ONNX_EMBEDDING_TOKENIZER_PATH,
+                 max_length=ONNX_EMBEDDING_MAX_LENGTH, batch_size=32, threads=LOCAL_EMBEDDING_WORKERS):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise CustomException("The onnx embedding backend needs the onnxruntime and tokenizers packages", e)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+        self.dimensions = len(self._embed(["dimension probe"])[0])
+        self.signature = {
+            "backend": "onnx",
+            "model": f"{os.path.basename(model_path)}-{_file_digest(model_path)}",
+            "dimensions": self.dimensions,
+        }
+
+    def _embed(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feed = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": mask,
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        output = self.session.run(None, {name: value for name, value in feed.items() if name in self.input_names})[0]
+        if output.ndim == 3:
+            # Token embeddings: average those that are not padding
+            output = (output * mask[:, :, None]).sum(axis=1) / np.maximum(mask.sum(axis=1, keepdims=True), 1)
+        return _normalize(output.astype(np.float32))
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return np.vstack([
+            self._embed(texts[start:start + self.batch_size]) for start in range(0, len(texts), self.batch_size)
+        ]).tolist()
+
+    def embed_query(self, text):
+        return self._embed([text])[0].tolist()
+
+
+def _file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+def sample_corpus_chunks(file_paths=None, sample_size=LOCAL_EMBEDDING_FIT_SAMPLE, seed=0):
+    """Texts of `sample_size` chunks drawn evenly from the cleaned-up PDFs (reservoir sampling)"""
+    from components.pdf_loader import list_pdf_files, iter_pdf_pages, iter_clean_chunks
+
+    rng = random.Random(seed)
+    sample = []
+    for seen, chunk in enumerate(iter_clean_chunks(iter_pdf_pages(file_paths or list_pdf_files()))):
+        if len(sample) < sample_size:
+            sample.append(chunk.page_content)
+        else:
+            position = rng.randint(0, seen)
+            if position < sample_size:
+                sample[position] = chunk.page_content
+    return sample
+
+def fit_local_embedding_model(file_paths=None, path=LOCAL_EMBEDDING_MODEL_PATH, sample_size=LOCAL_EMBEDDING_FIT_SAMPLE):
+    """Fit the local embedding model on the PDFs in DATA_PATH and save it; indexes built with another fit must be rebuilt"""
+    try:
+        texts = sample_corpus_chunks(file_paths, sample_size)
+        logger.info(f"Fitting the local embedding model on {len(texts)} chunks")
+        model = TfidfSvdEmbeddings.fit(texts)
+        model.save(path)
+        logger.info(f"Saved local embedding model {model.fingerprint} ({model.dimensions} dimensions) to {path}")
+        return model
+
+    except Exception as e:
+        error_message = CustomException("Failed to fit the local embedding model", e)
+        logger.error(str(error_message))
+        raise error_message
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    fit = commands.add_parser("fit", help="Fit the local model on the PDFs in DATA_PATH and save it")
+    fit.add_argument("--sample", type=int, default=LOCAL_EMBEDDING_FIT_SAMPLE, help="Chunks to fit on")
+    args = parser.parse_args()
+
+    if args.command == "fit":
+        fit_local_embedding_model(sample_size=args.sample)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from common.logger import get_logger
+from common.custom_exception import CustomException
+
+from config.config import DB_FAISS_PATH, DATA_PATH, CHUNK_SIZE, CHUNK_OVERLAP, FAISS_INDEX_FACTORY
+from config.config import (
+    BOILERPLATE_STRIPPING_ENABLED, BOILERPLATE_MIN_PAGES, BOILERPLATE_MIN_PAGE_FRACTION,
+    BOILERPLATE_EDGE_LINES, BOILERPLATE_SAMPLE_PAGES,
+    CHUNK_DEDUP_ENABLED, CHUNK_NEAR_DUPLICATE_THRESHOLD,
+)
+
+logger = get_logger(__name__)
+
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_FORMAT_VERSION = 1
+
+
+def get_manifest_path(index_dir=DB_FAISS_PATH):
+    return os.path.join(index_dir, MANIFEST_FILE_NAME)
+
+def cleanup_settings():
+    """Ingestion clean-up settings; which chunks exist (and their ids) depends on them"""
+    return {
+        "boilerplate": [
+            BOILERPLATE_MIN_PAGES, BOILERPLATE_MIN_PAGE_FRACTION, BOILERPLATE_EDGE_LINES, BOILERPLATE_SAMPLE_PAGES,
+        ] if BOILERPLATE_STRIPPING_ENABLED else None,
+        "dedup": {"near_duplicate_threshold": CHUNK_NEAR_DUPLICATE_THRESHOLD} if CHUNK_DEDUP_ENABLED else None,
+    }
+
+def new_manifest():
+    """Empty manifest for the current chunking settings"""
+    return {
+        "format_version": MANIFEST_FORMAT_VERSION,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "index_factory": FAISS_INDEX_FACTORY,
+        "cleanup": cleanup_settings(),
+        "updated_at": None,
+        "files": {},
+    }
+
+def load_manifest(index_dir=DB_FAISS_PATH):
+    """Load the ingestion manifest, or None if there is none"""
+    manifest_path = get_manifest_path(index_dir)
+    if not os.path.exists(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable manifest {manifest_path}: {e}")
+        return None
+
+def save_manifest(manifest, index_dir=DB_FAISS_PATH):
+    """Write the manifest next to the FAISS index (atomically)"""
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+        manifest["updated_at"] = datetime.now().isoformat(timespec="seconds")
+
+        manifest_path = get_manifest_path(index_dir)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    except Exception as e:
+        error_message = CustomException("Failed to save ingestion manifest", e)
+        logger.error(str(error_message))
+        raise error_message
+
+def is_compatible(manifest):
+    """A manifest can only be reused if chunks were cut and indexed the same way"""
+    return (
+        manifest is not None
+        and manifest.get("format_version") == MANIFEST_FORMAT_VERSION
+        and manifest.get("chunk_size") == CHUNK_SIZE
+        and manifest.get("chunk_overlap") == CHUNK_OVERLAP
+        and manifest.get("index_factory", "Flat") == FAISS_INDEX_FACTORY
+        and manifest.get("cleanup") == cleanup_settings()
+    )
+
+def file_key(file_path):
+    """Manifest key of a PDF, relative to DATA_PATH"""
+    return os.path.relpath(file_path, DATA_PATH).replace(os.sep, "/")
+
+def collection_of(file_path):
+    """First folder of the PDF under DATA_PATH ("default" for PDFs directly in it)"""
+    key = file_key(file_path)
+    return key.split("/", 1)[0] if "/" in key else "default"
+
+def hash_file(file_path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id(key, chunk, seen):
+    """
+    Content-derived id of a chunk
+
+    The id only depends on the file key, the page and the chunk text, so a chunk
+    that survives an edit of its file keeps its id (and its embedding).
+
+    Args:
+        key: Manifest key of the file the chunk comes from
+        chunk: The chunk
+        seen: Per-file dict used to tell apart identical chunks on the same page
+    """
+    page = chunk.metadata.get("page", "")
+    chunk_hash = hashlib.sha256(f"{key}\0{page}\0{chunk.page_content}".encode("utf-8")).hexdigest()[:32]
+
+    occurrence = seen.get(chunk_hash, 0)
+    seen[chunk_hash] = occurrence + 1
+    return chunk_hash if occurrence == 0 else f"{chunk_hash}-{occurrence}"
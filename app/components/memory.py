@@ -1,11 +1,15 @@
 from langchain.memory import ConversationBufferWindowMemory, ConversationSummaryBufferMemory
 from langchain_core.prompts import PromptTemplate
 from langchain.chains import ConversationalRetrievalChain
-from components.llm import load_llm
-from components.vector_store import load_vector_store
-from config.config import OPEN_AI_MODEL, OPEN_AI_API_KEY
+from components.registry import (
+    get_shared_llm, get_shared_vector_store, get_shared_retriever, get_shared_condense_llm, get_shared_question_rewrites,
+)
+from components.question_condenser import create_question_generator
+from components.answer_chain import create_answer_chain
+from common.metrics import span
 from common.logger import get_logger
 from common.custom_exception import CustomException
+from config.config import SUMMARY_AFTER_MESSAGES, SUMMARY_MAX_TOKENS, CONDENSE_QUESTION_SKIP_SELF_CONTAINED
 
 logger = get_logger(__name__)
 
@@ -28,6 +32,21 @@ Instructions:
 
 Answer:"""
 
+class DeferredSummaryBufferMemory(ConversationSummaryBufferMemory):
+    """
+    Summary buffer memory that never summarizes during a request
+
+    Messages that overflow the token limit are folded into the summary later
+    by the summary worker, so the answer is not held up by a summarization call.
+    """
+
+    def prune(self):
+        pass
+
+    async def aprune(self):
+        pass
+
+
 class ConversationalMemory:
     def __init__(self, memory_type="window", max_token_limit=1000, k=3):
         """
@@ -45,9 +64,9 @@ class ConversationalMemory:
         self.memory = None
         
     def _get_llm(self):
-        """Get LLM instance (cached)"""
+        """Get LLM instance (shared across requests)"""
         if self.llm is None:
-            self.llm = load_llm(OPEN_AI_MODEL, OPEN_AI_API_KEY)
+            self.llm = get_shared_llm()
         return self.llm
     
     def create_memory(self):
@@ -64,7 +83,7 @@ class ConversationalMemory:
             elif self.memory_type == "summary":
                 # Summarize old conversations, keep recent ones
                 llm = self._get_llm()
-                self.memory = ConversationSummaryBufferMemory(
+                self.memory = DeferredSummaryBufferMemory(
                     llm=llm,
                     max_token_limit=self.max_token_limit,
                     memory_key="chat_history",
@@ -87,7 +106,7 @@ class ConversationalMemory:
             self.create_memory()
         return self.memory
 
-def create_conversational_qa_chain(memory_type="window", max_token_limit=1000, k=3):
+def create_conversational_qa_chain(memory_type="window", max_token_limit=1000, k=3, stream_answer=False):
     """
     Create a conversational QA chain with memory
     
@@ -95,16 +114,18 @@ def create_conversational_qa_chain(memory_type="window", max_token_limit=1000, k
         memory_type: "window" for recent messages, "summary" for summarized conversations
         max_token_limit: Maximum tokens in memory
         k: Number of recent conversation turns to keep
+        stream_answer: Generate the answer with the model's streaming API so
+            callbacks receive it token by token
     """
     try:
         logger.info("Creating conversational QA chain with memory")
         
-        # Load components
-        db = load_vector_store()
+        # Shared components are loaded once per worker; only the memory is per session
+        db = get_shared_vector_store()
         if db is None:
             raise CustomException("Vector store not present or empty")
             
-        llm = load_llm(OPEN_AI_MODEL, OPEN_AI_API_KEY)
+        llm = get_shared_llm()
         if llm is None:
             raise CustomException("LLM not loaded")
         
@@ -118,16 +139,27 @@ def create_conversational_qa_chain(memory_type="window", max_token_limit=1000, k
             input_variables=["context", "chat_history", "question"]
         )
         
-        # Create conversational retrieval chain
-        qa_chain = ConversationalRetrievalChain.from_llm(
-            llm=llm,
-            retriever=db.as_retriever(search_kwargs={'k': 5}),
+        # Create conversational retrieval chain; follow-ups skip the rewrite
+        # call when self-contained or already rewritten
+        retriever = get_shared_retriever()
+        qa_chain = ConversationalRetrievalChain(
+            retriever=retriever,
             memory=memory,
-            combine_docs_chain_kwargs={'prompt': custom_prompt},
+            combine_docs_chain=create_answer_chain(llm, custom_prompt),
+            question_generator=create_question_generator(
+                get_shared_condense_llm(),
+                rewrites=get_shared_question_rewrites(),
+                skip_self_contained=CONDENSE_QUESTION_SKIP_SELF_CONTAINED,
+                lexical_index=getattr(retriever, "lexical_index", None),
+            ),
             verbose=False,
             return_source_documents=False
         )
         
+        if stream_answer:
+            # Only the answer streams; the follow-up question rewrite stays one call
+            qa_chain.combine_docs_chain.llm_chain.llm_kwargs = {"stream": True}
+        
         logger.info("Successfully created conversational QA chain")
         return qa_chain
         
@@ -136,49 +168,66 @@ def create_conversational_qa_chain(memory_type="window", max_token_limit=1000, k
         logger.error(str(error_message))
         raise error_message
 
-def create_session_qa_chain(session_messages=None, memory_type="window"):
+def append_turn(state, question, answer):
     """
-    Create QA chain and populate with existing session messages
+    Memory state after a turn: the previous state's recent messages plus the
+    new question and answer. The summary worker trims the messages back under
+    SUMMARY_MAX_TOKENS and folds the rest into the running summary.
+    """
+    state = state or {"messages": [], "summary": ""}
+    return {
+        **state,
+        "messages": state["messages"] + [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": answer},
+        ],
+    }
+
+def restore_memory(memory, state):
+    """Load a memory state (recent messages and running summary) into a fresh memory"""
+    for message in state.get("messages", []):
+        if message["role"] == "user":
+            memory.chat_memory.add_user_message(message["content"])
+        else:
+            memory.chat_memory.add_ai_message(message["content"])
+
+    if isinstance(memory, ConversationSummaryBufferMemory):
+        memory.moving_summary_buffer = state.get("summary", "")
+
+def create_session_qa_chain(memory_state=None, message_count=0, stream_answer=False):
+    """
+    Create QA chain whose memory resumes from the previous turn's state
     
     Args:
-        session_messages: List of message dicts with 'role' and 'content'
-        memory_type: Type of memory to use
+        memory_state: Memory state stored after the previous turn
+        message_count: Messages in the conversation, including the current question
+        stream_answer: Stream the answer tokens to callbacks
     """
     try:
         # Determine memory settings based on conversation length
-        if session_messages:
-            msg_count = len(session_messages)
-            if msg_count > 10:
+        if message_count:
+            if message_count > SUMMARY_AFTER_MESSAGES:
                 # Use summary memory for long conversations
                 memory_type = "summary"
-                max_tokens = 1500
+                max_tokens = SUMMARY_MAX_TOKENS
                 k = 6
             else:
                 # Use window memory for short conversations
                 memory_type = "window" 
                 max_tokens = 1000
-                k = min(msg_count, 4)
+                k = min(message_count, 4)
         else:
             memory_type = "window"
             max_tokens = 1000
             k = 3
         
-        # Create QA chain
-        qa_chain = create_conversational_qa_chain(memory_type, max_tokens, k)
-        
-        # Populate memory with existing conversation
-        if session_messages and len(session_messages) > 1:
-            logger.info(f"Populating memory with {len(session_messages)} existing messages")
+        with span("build_chain"):
+            # Create QA chain
+            qa_chain = create_conversational_qa_chain(memory_type, max_tokens, k, stream_answer)
             
-            for i in range(0, len(session_messages), 2):
-                if i + 1 < len(session_messages):
-                    user_msg = session_messages[i]
-                    assistant_msg = session_messages[i + 1]
-                    
-                    if user_msg['role'] == 'user' and assistant_msg['role'] == 'assistant':
-                        # Add to memory
-                        qa_chain.memory.chat_memory.add_user_message(user_msg['content'])
-                        qa_chain.memory.chat_memory.add_ai_message(assistant_msg['content'])
+            # Resume the memory instead of replaying the whole conversation
+            if memory_state:
+                restore_memory(qa_chain.memory, memory_state)
         
         return qa_chain
         
@@ -1,11 +1,21 @@
 import os
-from langchain_community.document_loaders import DirectoryLoader,PyPDFLoader
+import re
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from pypdf import PdfReader
+from langchain_core.documents import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+from components.manifest import collection_of
+from components.chunk_dedup import ChunkDeduplicator
+from components.context_packer import count_tokens
+
 from common.logger import get_logger
 from common.custom_exception import CustomException
 
-from config.config import DATA_PATH,CHUNK_SIZE,CHUNK_OVERLAP
+from config.config import DATA_PATH,CHUNK_SIZE,CHUNK_OVERLAP,PDF_LOADER_WORKERS,PDF_PAGES_PER_TASK,EMBED_BATCH_SIZE
+from config.config import BOILERPLATE_STRIPPING_ENABLED,BOILERPLATE_MIN_PAGES,BOILERPLATE_MIN_PAGE_FRACTION,CHUNK_DEDUP_ENABLED
+from config.config import BOILERPLATE_EDGE_LINES,BOILERPLATE_SAMPLE_PAGES
 
 logger = get_logger(__name__)
 
@@ -16,9 +26,7 @@ def load_pdf_files():
         
         logger.info(f"Loading files from {DATA_PATH}")
 
-        loader = DirectoryLoader(DATA_PATH,glob="*.pdf",loader_cls=PyPDFLoader)
-
-        documents=loader.load()
+        documents=list(iter_pdf_pages(list_pdf_files()))
 
         if not documents:
             logger.warning("No pdfs were found")
@@ -33,6 +41,255 @@ def load_pdf_files():
         return []
     
 
+def list_pdf_files():
+    """Return the PDF paths under DATA_PATH and its folders (collections), in a stable order"""
+    if not os.path.exists(DATA_PATH):
+        raise CustomException("Data path doesnt exist")
+
+    return sorted(
+        os.path.join(folder, name)
+        for folder, _, names in os.walk(DATA_PATH)
+        for name in names
+        if name.endswith(".pdf")
+    )
+
+def load_pdf_file(file_path):
+    """Load the pages of a single PDF"""
+    try:
+        logger.info(f"Loading {file_path}")
+        return list(iter_pdf_pages([file_path], workers=1))
+
+    except Exception as e:
+        error_message = CustomException(f"Failed to load PDF {file_path}" , e)
+        logger.error(str(error_message))
+        raise error_message
+
+def _parse_page_range(file_path, start, end):
+    """Extract pages [start, end) of one PDF (runs in a worker process)"""
+    reader = PdfReader(file_path)
+    total_pages = len(reader.pages)
+    try:
+        page_labels = reader.page_labels
+    except Exception:
+        page_labels = None
+
+    pages = []
+    for page_number in range(start, min(end, total_pages)):
+        pages.append(Document(
+            page_content=reader.pages[page_number].extract_text(),
+            metadata={
+                "source": file_path,
+                "collection": collection_of(file_path),
+                "total_pages": total_pages,
+                "page": page_number,
+                "page_label": page_labels[page_number] if page_labels else str(page_number + 1),
+            },
+        ))
+    return pages
+
+def _plan_parse_tasks(file_paths, pages_per_task):
+    """Yield (file, start, end) page ranges, one file or slice of a file per task"""
+    for file_path in file_paths:
+        try:
+            total_pages = len(PdfReader(file_path).pages)
+        except Exception as e:
+            logger.error(str(CustomException(f"Skipping unreadable PDF {file_path}", e)))
+            continue
+
+        for start in range(0, total_pages, pages_per_task):
+            yield file_path, start, start + pages_per_task
+
+def iter_pdf_pages(file_paths, workers=PDF_LOADER_WORKERS, pages_per_task=PDF_PAGES_PER_TASK):
+    """
+    Parse PDFs in a process pool and yield their pages as they become available
+
+    Pages come out in document order. At most `2 * workers` page ranges are in
+    flight at once, so memory does not grow with the size of the corpus.
+
+    Args:
+        file_paths: PDFs to parse
+        workers: Number of parsing processes (1 parses in this process)
+        pages_per_task: Number of pages one task parses
+    """
+    tasks = _plan_parse_tasks(file_paths, pages_per_task)
+
+    if workers <= 1:
+        for task in tasks:
+            yield from _parse_page_range(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(_parse_page_range, *task))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+def new_cleanup_stats():
+    """Counters filled by strip_boilerplate and deduplicate_chunks"""
+    return {
+        "pages": 0, "boilerplate_lines": 0, "boilerplate_tokens": 0,
+        "chunks": 0, "duplicate_chunks": 0, "duplicate_tokens": 0, "duplicates_by_source": {},
+    }
+
+def log_cleanup_stats(stats):
+    if stats["pages"] or stats["chunks"]:
+        logger.info(
+            f"Removed {stats['boilerplate_lines']} boilerplate lines ({stats['boilerplate_tokens']} tokens) "
+            f"from {stats['pages']} pages and {stats['duplicate_chunks']} duplicate chunks "
+            f"({stats['duplicate_tokens']} tokens) of {stats['chunks']}"
+        )
+
+def _line_pattern(line):
+    """Edge line with digits masked, so "Page 12" and "Page 13" count as the same line"""
+    return re.sub(r"\d+", "#", " ".join(line.split()))
+
+def _edge_lines(lines, edge_lines):
+    """Positions of the first and last `edge_lines` non-empty lines, where headers and footers sit"""
+    positions = [i for i, line in enumerate(lines) if line.strip()]
+    return set(positions[:edge_lines] + positions[-edge_lines:])
+
+def _learn_boilerplate(sample, min_pages, min_fraction, edge_lines):
+    """Edge-line patterns repeated on enough of the sampled pages of one document"""
+    counts = Counter()
+    for page in sample:
+        lines = page.page_content.splitlines()
+        counts.update({_line_pattern(lines[i]) for i in _edge_lines(lines, edge_lines)})
+
+    threshold = max(min_pages, min_fraction * len(sample))
+    return {pattern for pattern, count in counts.items() if count >= threshold}
+
+def _strip_page(page, boilerplate, stats, edge_lines):
+    """Remove the edge lines of `page` that match a boilerplate pattern; body lines are kept as they are"""
+    if not boilerplate:
+        return page
+
+    lines = page.page_content.splitlines()
+    removed = {i for i in _edge_lines(lines, edge_lines) if _line_pattern(lines[i]) in boilerplate}
+    if removed:
+        page.page_content = "\n".join(line for i, line in enumerate(lines) if i not in removed)
+        stats["boilerplate_lines"] += len(removed)
+        stats["boilerplate_tokens"] += count_tokens("\n".join(lines[i] for i in sorted(removed)))
+    return page
+
+def strip_boilerplate(pages, stats=None, min_pages=BOILERPLATE_MIN_PAGES, min_fraction=BOILERPLATE_MIN_PAGE_FRACTION,
+                      edge_lines=BOILERPLATE_EDGE_LINES, sample_pages=BOILERPLATE_SAMPLE_PAGES):
+    """
+    Strip running headers, footers and copyright lines from a page stream
+
+    Only the first and last `edge_lines` lines of a page are candidates. The
+    repeated ones are learnt from the first `sample_pages` pages of each
+    document, which are held back meanwhile; later pages stream through.
+
+    Args:
+        pages: Pages of one or more PDFs, in document order
+        stats: Counters to update (see new_cleanup_stats)
+        min_pages: Sampled pages a line must appear on to be boilerplate
+        min_fraction: Fraction of the sampled pages it must appear on
+        edge_lines: Lines at the top and at the bottom of a page that are candidates
+        sample_pages: Pages of a document the repeated lines are learnt from
+    """
+    if stats is None:
+        stats = new_cleanup_stats()
+
+    source, sample, boilerplate = object(), [], None
+    for page in pages:
+        stats["pages"] += 1
+        if page.metadata.get("source") != source:
+            if sample:
+                boilerplate = _learn_boilerplate(sample, min_pages, min_fraction, edge_lines)
+                yield from (_strip_page(held, boilerplate, stats, edge_lines) for held in sample)
+            source, sample, boilerplate = page.metadata.get("source"), [], None
+
+        if boilerplate is not None:
+            yield _strip_page(page, boilerplate, stats, edge_lines)
+            continue
+
+        sample.append(page)
+        if len(sample) >= sample_pages:
+            boilerplate = _learn_boilerplate(sample, min_pages, min_fraction, edge_lines)
+            yield from (_strip_page(held, boilerplate, stats, edge_lines) for held in sample)
+            sample = []
+
+    if sample:
+        boilerplate = _learn_boilerplate(sample, min_pages, min_fraction, edge_lines)
+        yield from (_strip_page(held, boilerplate, stats, edge_lines) for held in sample)
+
+def deduplicate_chunks(chunks, deduplicator, stats=None):
+    """
+    Drop the chunks that repeat (exactly or nearly) one seen before
+
+    Args:
+        chunks: Chunk stream
+        deduplicator: ChunkDeduplicator holding the chunks kept so far
+        stats: Counters to update (see new_cleanup_stats)
+    """
+    if stats is None:
+        stats = new_cleanup_stats()
+
+    for chunk in chunks:
+        stats["chunks"] += 1
+        if deduplicator.add(chunk.page_content):
+            yield chunk
+            continue
+
+        source = chunk.metadata.get("source")
+        stats["duplicate_chunks"] += 1
+        stats["duplicate_tokens"] += count_tokens(chunk.page_content)
+        stats["duplicates_by_source"][source] = stats["duplicates_by_source"].get(source, 0) + 1
+
+def _counted(chunks, stats):
+    for chunk in chunks:
+        stats["chunks"] += 1
+        yield chunk
+
+def iter_clean_chunks(pages, deduplicator=None, stats=None):
+    """
+    Split pages into chunks with the configured clean-up: boilerplate lines
+    stripped (BOILERPLATE_STRIPPING_ENABLED) and duplicate chunks dropped
+    (CHUNK_DEDUP_ENABLED)
+
+    Args:
+        pages: Pages of one or more PDFs, in document order
+        deduplicator: ChunkDeduplicator, e.g. seeded with chunks already indexed
+            (a new one when None)
+        stats: Counters to update (see new_cleanup_stats)
+    """
+    if stats is None:
+        stats = new_cleanup_stats()
+    if BOILERPLATE_STRIPPING_ENABLED:
+        pages = strip_boilerplate(pages, stats)
+
+    chunks = iter_text_chunks(pages)
+    if CHUNK_DEDUP_ENABLED:
+        chunks = deduplicate_chunks(chunks, deduplicator or ChunkDeduplicator(), stats)
+    else:
+        chunks = _counted(chunks, stats)
+    return chunks
+
+def iter_text_chunks(pages):
+    """Split pages into chunks as they arrive"""
+    # start_index lets the prompt stage merge neighbouring chunks exactly
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE,chunk_overlap=CHUNK_OVERLAP,add_start_index=True)
+
+    for page in pages:
+        yield from text_splitter.split_documents([page])
+
+def iter_chunk_batches(chunks, batch_size=EMBED_BATCH_SIZE):
+    """Group a chunk stream into lists of at most `batch_size` for the embedding stage"""
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def create_text_chunks(documents):
     try:
         if not documents:
@@ -40,9 +297,9 @@ def create_text_chunks(documents):
         
         logger.info(f"Splitting {len(documents)} documents into chunks")
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE,chunk_overlap=CHUNK_OVERLAP)
-
-        text_chunks = text_splitter.split_documents(documents)
+        stats = new_cleanup_stats()
+        text_chunks = list(iter_clean_chunks(documents, stats=stats))
+        log_cleanup_stats(stats)
 
         logger.info(f"Generated {len(text_chunks)} text chunks")
         return text_chunks
@@ -51,8 +308,3 @@ def create_text_chunks(documents):
         error_message = CustomException("Failed to generate chunks" , e)
         logger.error(str(error_message))
         return []
-
-
-
-
-
@@ -0,0 +1,211 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from langchain.chains import LLMChain
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+
+from components.lexical_index import tokenize
+from common.logger import get_logger
+from common.metrics import span, count_cache_event
+
+from config.config import CONDENSE_QUESTION_CACHE_SIZE, CONDENSE_ENTITY_MAX_DOCUMENT_FRACTION
+
+logger = get_logger(__name__)
+
+_WORD_PATTERN = re.compile(r"[a-z0-9][a-z0-9'\-]*")
+
+# Words that point back at something said earlier
+_ANAPHORA = {
+    "it", "its", "itself", "this", "that", "these", "those", "they", "them", "their", "theirs",
+    "he", "him", "his", "she", "her", "hers", "one", "ones", "same", "such",
+    "former", "latter", "above", "else", "also", "too", "again", "another", "other", "others",
+}
+_CONTINUATIONS = ("and ", "or ", "but ", "so ", "what about ", "how about ", "what else", "why not")
+
+# Question words and fillers that say nothing about the topic
+_FUNCTION_WORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "with", "by", "from", "at", "as", "about", "into",
+    "is", "are", "was", "were", "be", "been", "being", "do", "does", "did", "can", "could", "should",
+    "would", "will", "may", "might", "must", "have", "has", "had", "not", "no", "any", "some", "all",
+    "what", "which", "who", "whom", "whose", "when", "where", "why", "how", "much", "many",
+    "i", "me", "my", "we", "our", "you", "your", "please", "tell", "explain", "describe", "know",
+    "there", "common", "usual", "usually", "main", "best", "more", "most", "get", "give",
+}
+
+# Aspects asked about any condition or drug; they never name the topic themselves
+_ASPECT_WORDS = {
+    "symptom", "symptoms", "sign", "signs", "side", "effect", "effects", "cause", "causes", "risk", "risks",
+    "treatment", "treatments", "treat", "treated", "therapy", "cure", "diagnosis", "diagnosed", "prognosis",
+    "prevention", "prevent", "complications", "test", "tests", "dose", "doses", "dosage", "dosing",
+    "medication", "medications", "medicine", "drug", "drugs", "surgery", "recovery", "outlook",
+    "children", "child", "kids", "adults", "adult", "elderly", "patients", "patient", "people", "women", "men",
+    "often", "long", "take", "taken", "follow", "followed", "up", "normal", "range", "safe", "serious",
+}
+
+
+def _is_entity(word, lexical_index, max_document_fraction):
+    """True if `word` is a term of the corpus specific enough to name a topic (a condition, a drug)"""
+    if word in _ASPECT_WORDS or not len(lexical_index):
+        return False
+    limit = max_document_fraction * len(lexical_index)
+    return any(0 < lexical_index.document_frequency(term) <= limit for term in tokenize(word))
+
+def is_self_contained(question, lexical_index=None, max_document_fraction=CONDENSE_ENTITY_MAX_DOCUMENT_FRACTION):
+    """
+    Cheap check that a follow-up question needs no chat history to be understood
+
+    Conservative: a question counts as self-contained only when it has no
+    pronoun or other back reference, does not open like a continuation
+    ("and what about ..."), names at least two topic words and one of them is
+    a domain entity: a term of the lexical index found in at most
+    `max_document_fraction` of the chunks. So "What are the side effects?"
+    after a question about metformin is still rewritten. Without a lexical
+    index nothing counts as self-contained.
+    """
+    if lexical_index is None:
+        return False
+
+    text = question.strip().lower()
+    if text.startswith(_CONTINUATIONS):
+        return False
+
+    words = _WORD_PATTERN.findall(text)
+    if any(word in _ANAPHORA for word in words):
+        return False
+    topic_words = [word for word in words if word not in _FUNCTION_WORDS]
+    return len(topic_words) >= 2 and any(_is_entity(word, lexical_index, max_document_fraction) for word in topic_words)
+
+
+class QuestionRewriteCache:
+    """
+    Per-process LRU of standalone questions keyed by chat history and follow-up
+
+    Also counts how each follow-up was condensed ("skipped", "cache_hits",
+    "rewritten"); `stats()` returns a snapshot.
+
+    Args:
+        max_items: Rewrites kept; 0 disables caching
+    """
+
+    def __init__(self, max_items=CONDENSE_QUESTION_CACHE_SIZE):
+        self.max_items = max_items
+        self._rewrites = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"skipped": 0, "cache_hits": 0, "rewritten": 0, "rewrite_seconds": 0.0}
+
+    def key(self, chat_history, question):
+        normalized = " ".join(question.split())
+        return hashlib.sha256(f"{chat_history}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            rewrite = self._rewrites.get(key)
+            if rewrite is not None:
+                self._rewrites.move_to_end(key)
+            return rewrite
+
+    def put(self, key, rewrite):
+        if not self.max_items:
+            return
+        with self._lock:
+            self._rewrites[key] = rewrite
+            self._rewrites.move_to_end(key)
+            while len(self._rewrites) > self.max_items:
+                self._rewrites.popitem(last=False)
+
+    def record(self, path, seconds=0.0):
+        with self._lock:
+            self.counters[path] += 1
+            self.counters["rewrite_seconds"] += seconds
+        count_cache_event("question_rewrite", path)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["rewrite_seconds"] = round(stats["rewrite_seconds"], 4)
+        follow_ups = stats["skipped"] + stats["cache_hits"] + stats["rewritten"]
+        stats["llm_calls_avoided"] = round((follow_ups - stats["rewritten"]) / follow_ups, 4) if follow_ups else 0.0
+        return stats
+
+
+class CondenseQuestionChain(LLMChain):
+    """
+    Question generator for ConversationalRetrievalChain that avoids the rewrite call when it can
+
+    A follow-up that `is_self_contained` is used as is; otherwise an earlier
+    rewrite of the same question against the same chat history is reused;
+    only then is the LLM asked for a standalone question.
+    """
+
+    rewrites: Any = None
+    skip_self_contained: bool = True
+    lexical_index: Any = None
+
+    def _condense(self, inputs):
+        """Return (standalone question or None, cache key) without calling the LLM"""
+        question = inputs["question"]
+        if self.skip_self_contained and is_self_contained(question, self.lexical_index):
+            self._record("skipped")
+            return question, None
+        if self.rewrites is None:
+            return None, None
+
+        key = self.rewrites.key(inputs["chat_history"], question)
+        rewrite = self.rewrites.get(key)
+        if rewrite is not None:
+            self._record("cache_hits")
+        return rewrite, key
+
+    def _record(self, path, seconds=0.0):
+        if self.rewrites is not None:
+            self.rewrites.record(path, seconds)
+        logger.info(f"Condensed follow-up question ({path}) in {seconds:.3f}s")
+
+    def _remember(self, key, outputs, started):
+        if key is not None:
+            self.rewrites.put(key, outputs[self.output_key])
+        self._record("rewritten", time.perf_counter() - started)
+        return outputs
+
+    def _call(self, inputs: dict[str, Any], run_manager: Optional[Any] = None) -> dict[str, str]:
+        question, key = self._condense(inputs)
+        if question is not None:
+            return {self.output_key: question}
+
+        started = time.perf_counter()
+        with span("condense_question"):
+            outputs = super()._call(inputs, run_manager=run_manager)
+        return self._remember(key, outputs, started)
+
+    async def _acall(self, inputs: dict[str, Any], run_manager: Optional[Any] = None) -> dict[str, str]:
+        question, key = self._condense(inputs)
+        if question is not None:
+            return {self.output_key: question}
+
+        started = time.perf_counter()
+        with span("condense_question"):
+            outputs = await super()._acall(inputs, run_manager=run_manager)
+        return self._remember(key, outputs, started)
+
+
+def create_question_generator(llm, rewrites=None, skip_self_contained=True, lexical_index=None):
+    """
+    Condense-question stage for ConversationalRetrievalChain
+
+    Args:
+        llm: Model that rewrites follow-ups (may be smaller than the answering model)
+        rewrites: Shared QuestionRewriteCache, or None to always call the LLM
+        skip_self_contained: Use self-contained follow-ups without rewriting them
+        lexical_index: Corpus vocabulary that tells domain entities apart (see is_self_contained)
+    """
+    return CondenseQuestionChain(
+        llm=llm,
+        prompt=CONDENSE_QUESTION_PROMPT,
+        rewrites=rewrites,
+        skip_self_contained=skip_self_contained,
+        lexical_index=lexical_index,
+    )
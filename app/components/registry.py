@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+
+from components.embeddings import get_embedding_model
+from components.llm import load_llm
+from components.vector_store import load_vector_store
+from components.answer_cache import SemanticAnswerCache
+from components.lexical_index import load_lexical_index
+from components.hybrid_retriever import create_retriever
+from components.sharded_store import ShardedVectorStore
+from components.conversation_store import create_conversation_store
+from components.summary_worker import SummaryWorker
+from components.question_condenser import QuestionRewriteCache
+from components.index_versions import current_version, version_dir, acquire_reader_lease, hold_lease, collect_old_versions
+
+from config.config import OPEN_AI_MODEL, OPEN_AI_API_KEY, CONDENSE_QUESTION_MODEL, INDEX_RELOAD_INTERVAL_SECONDS
+from common.logger import get_logger
+from common.custom_exception import CustomException
+
+logger = get_logger(__name__)
+
+
+class ResourceRegistry:
+    """Process-wide, thread-safe cache for resources that are expensive to build
+
+    Each resource is loaded once per worker by its registered loader and then
+    shared by every request. Load times, cache hits and misses are tracked per
+    resource and can be read with `stats()`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaders = {}
+        self._load_locks = {}
+        self._resources = {}
+        self._stats = {}
+
+    def register(self, name, loader):
+        """Register (or replace) the loader used to build a resource"""
+        with self._lock:
+            self._loaders[name] = loader
+            self._load_locks.setdefault(name, threading.Lock())
+            self._stats.setdefault(name, {"hits": 0, "misses": 0, "loads": 0, "last_load_seconds": None, "total_load_seconds": 0.0})
+            self._resources.pop(name, None)
+
+    def get(self, name):
+        """Return the shared resource, loading it on first use"""
+        if name not in self._loaders:
+            raise CustomException(f"Unknown shared resource: {name}")
+
+        resource = self._resources.get(name)
+        if resource is not None:
+            self._record_hit(name)
+            return resource
+
+        # Only one thread loads a given resource; the others wait and reuse it
+        with self._load_locks[name]:
+            resource = self._resources.get(name)
+            if resource is not None:
+                self._record_hit(name)
+                return resource
+
+            logger.info(f"Loading shared resource '{name}'")
+            started = time.perf_counter()
+            resource = self._loaders[name]()
+            elapsed = time.perf_counter() - started
+
+            if resource is None:
+                raise CustomException(f"Loader for shared resource '{name}' returned nothing")
+
+            with self._lock:
+                self._resources[name] = resource
+                stats = self._stats[name]
+                stats["misses"] += 1
+                stats["loads"] += 1
+                stats["last_load_seconds"] = round(elapsed, 4)
+                stats["total_load_seconds"] += elapsed
+
+            logger.info(f"Loaded shared resource '{name}' in {elapsed:.3f}s")
+            return resource
+
+    def replace(self, name, resource):
+        """Swap in a resource loaded elsewhere; requests already holding the old one keep it"""
+        if name not in self._loaders:
+            raise CustomException(f"Unknown shared resource: {name}")
+        with self._lock:
+            self._resources[name] = resource
+            self._stats[name]["loads"] += 1
+        logger.info(f"Replaced shared resource '{name}'")
+
+    def invalidate(self, name=None):
+        """Drop one (or every) cached resource so the next `get` reloads it"""
+        with self._lock:
+            if name is None:
+                self._resources.clear()
+            else:
+                self._resources.pop(name, None)
+        logger.info(f"Invalidated shared resource '{name or 'all'}'")
+
+    def stats(self):
+        """Return a snapshot of load times and cache hits per resource"""
+        with self._lock:
+            return {name: dict(values) for name, values in self._stats.items()}
+
+    def _record_hit(self, name):
+        with self._lock:
+            self._stats[name]["hits"] += 1
+
+
+class IndexReloader:
+    """Swaps the shared vector store and retriever when a new index version is published
+
+    A daemon thread polls the CURRENT pointer every INDEX_RELOAD_INTERVAL_SECONDS.
+    The new version is loaded next to the old one, so requests are answered by
+    the old store until the swap; its reader lease is released when the last
+    request using it is done, and the old version can then be collected.
+    """
+
+    def __init__(self, registry, interval=INDEX_RELOAD_INTERVAL_SECONDS):
+        self.registry = registry
+        self.interval = interval
+        self.version = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def loaded(self, version):
+        """Record the version being served and make sure this process polls for the next one"""
+        self.version = version
+        if self.interval <= 0:
+            return
+        with self._lock:
+            # Threads do not survive a fork: each worker process starts its own
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="index-reloader", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Reloading the vector store failed, still serving version {self.version}: {e}")
+
+    def check(self):
+        """Load and swap in the published version if it changed; True when it did"""
+        version = current_version()
+        if version is None or version == self.version:
+            return False
+
+        logger.info(f"Index version {version} published, reloading (serving {self.version})")
+        db = _load_shared_vector_store()
+        retriever = _create_retriever(db)
+        self.registry.replace("vector_store", db)
+        self.registry.replace("retriever", retriever)
+        collect_old_versions()
+        return True
+
+
+def _load_shared_vector_store():
+    """The published version, with a reader lease that lasts as long as the store"""
+    for _ in range(3):
+        version = current_version()
+        index_dir = version_dir(version)
+        lease = acquire_reader_lease(index_dir)
+        if lease is not None:
+            break
+    else:
+        raise CustomException("The published index version was removed while loading it")
+
+    try:
+        db = load_vector_store(registry.get("embedding_model"), index_dir=index_dir)
+    except Exception:
+        lease.release()
+        raise
+
+    served_dir = _served_index_dir(db)
+    if os.path.normpath(served_dir) != os.path.normpath(index_dir):
+        # The version could not be read and was rebuilt (and published) as a new one
+        lease.release()
+        lease = acquire_reader_lease(served_dir)
+        if lease is None:
+            raise CustomException(f"The rebuilt index version {served_dir} was removed while loading it")
+        version = os.path.basename(os.path.normpath(served_dir))
+    hold_lease(db, lease)
+    index_reloader.loaded(version)
+    return db
+
+def _served_index_dir(db):
+    """Directory of the version a loaded store reads from"""
+    return db.index_dir if isinstance(db, ShardedVectorStore) else db.docstore.index_dir
+
+def _create_retriever(db):
+    # A sharded store brings the lexical indexes of its shards
+    if isinstance(db, ShardedVectorStore):
+        lexical_index = db.lexical_index
+    else:
+        lexical_index = load_lexical_index(_served_index_dir(db))
+    return create_retriever(db, lexical_index)
+
+
+registry = ResourceRegistry()
+index_reloader = IndexReloader(registry)
+registry.register("embedding_model", get_embedding_model)
+registry.register("vector_store", _load_shared_vector_store)
+registry.register("llm", lambda: load_llm(OPEN_AI_MODEL, OPEN_AI_API_KEY))
+registry.register("answer_cache", lambda: SemanticAnswerCache(registry.get("embedding_model")))
+registry.register("retriever", lambda: _create_retriever(registry.get("vector_store")))
+registry.register("conversation_store", create_conversation_store)
+registry.register("condense_llm", lambda: load_llm(CONDENSE_QUESTION_MODEL, OPEN_AI_API_KEY) if CONDENSE_QUESTION_MODEL else registry.get("llm"))
+registry.register("question_rewrites", QuestionRewriteCache)
+registry.register("summary_worker", lambda: SummaryWorker(registry.get("conversation_store"), registry.get("llm")))
+
+
+def get_shared_embedding_model():
+    return registry.get("embedding_model")
+
+def get_shared_vector_store():
+    return registry.get("vector_store")
+
+def get_shared_llm():
+    return registry.get("llm")
+
+def get_shared_answer_cache():
+    return registry.get("answer_cache")
+
+def get_shared_retriever():
+    return registry.get("retriever")
+
+def get_shared_conversation_store():
+    return registry.get("conversation_store")
+
+def get_shared_condense_llm():
+    return registry.get("condense_llm")
+
+def get_shared_question_rewrites():
+    return registry.get("question_rewrites")
+
+def get_shared_summary_worker():
+    return registry.get("summary_worker")
@@ -1,12 +1,12 @@
 from langchain.chains import RetrievalQA
 from langchain_core.prompts import PromptTemplate
 
-from components.llm import load_llm
-from components.vector_store import load_vector_store
+from components.registry import get_shared_llm,get_shared_vector_store,get_shared_retriever
+from components.answer_chain import create_answer_chain
 
-from config.config import OPEN_AI_MODEL,OPEN_AI_API_KEY
 from common.logger import get_logger
 from common.custom_exception import CustomException
+from common.metrics import span
 
 
 logger = get_logger(__name__)
@@ -25,26 +25,35 @@ Answer:
 def set_custom_prompt():
     return PromptTemplate(template=CUSTOM_PROMPT_TEMPLATE,input_variables=["context" , "question"])
 
-def create_qa_chain():
+def create_qa_chain(filter=None):
+    """
+    Single-turn QA chain over the shared retriever
+
+    Args:
+        filter: Metadata the retrieved chunks must match, e.g. {"collection": "cardiology"}
+    """
     try:
         logger.info("Loading vector store for context")
-        db = load_vector_store()
-
-        if db is None:
-            raise CustomException("Vector store not present or empty")
-
-        llm = load_llm(OPEN_AI_MODEL=OPEN_AI_MODEL , OPEN_AI_API_KEY=OPEN_AI_API_KEY )
-
-        if llm is None:
-            raise CustomException("LLM not loaded")
-        
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever = db.as_retriever(search_kwargs={'k':5}),
-            return_source_documents=False,
-            chain_type_kwargs={'prompt': set_custom_prompt()}
-        )
+        with span("build_chain"):
+            db = get_shared_vector_store()
+
+            if db is None:
+                raise CustomException("Vector store not present or empty")
+
+            llm = get_shared_llm()
+
+            if llm is None:
+                raise CustomException("LLM not loaded")
+            
+            retriever = get_shared_retriever()
+            if filter:
+                retriever = retriever.model_copy(update={"filter": filter})
+
+            qa_chain = RetrievalQA(
+                combine_documents_chain=create_answer_chain(llm, set_custom_prompt()),
+                retriever = retriever,
+                return_source_documents=False,
+            )
 
         logger.info("Sucesfully created the QA chain")
         return qa_chain
@@ -0,0 +1,263 @@
+"""
+Vector store split into shards, searched in parallel
+
+With VECTOR_STORE_SHARDING = "collection" every first-level directory under
+DATA_PATH (PDFs directly in DATA_PATH form the "default" collection) gets its
+own index under <index version>/shards/; with "file" every PDF does. Each
+shard is a complete store (index, docstore, lexical index, manifest), so
+ingestion only rebuilds the shards whose PDFs changed; the others are carried
+into the new version by hard links.
+
+At query time the shards are presented as one store: chunk positions are
+global (shard offset + position in the shard), FAISS searches run on a
+thread pool (FAISS releases the GIL) and their top-k lists are merged by
+distance. A metadata filter on "collection" or "source" skips the shards that
+cannot match before anything is searched.
+"""
+import bisect
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+from components.docstore import PositionalIdMap
+from components.lexical_index import load_lexical_index
+from components.manifest import file_key, collection_of
+from components.vector_store import SHARDS_DIR, SHARDS_FILE, load_vector_store
+
+from common.logger import get_logger
+from common.custom_exception import CustomException
+
+from config.config import VECTOR_STORE_SHARDING, VECTOR_SHARD_SEARCH_WORKERS, HYBRID_FETCH_K
+
+logger = get_logger(__name__)
+
+
+def shard_key(file_path, sharding=VECTOR_STORE_SHARDING):
+    if sharding == "collection":
+        return collection_of(file_path)
+    if sharding == "file":
+        return file_key(file_path)
+    raise CustomException(f"Unknown VECTOR_STORE_SHARDING {sharding!r}; use 'collection' or 'file'")
+
+def shard_name(key):
+    """Directory name of a shard: readable, and unique thanks to the hash suffix"""
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", key).strip("_.")[:60]
+    return f"{slug}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}"
+
+def shard_dir(name, index_dir):
+    """Directory of a shard inside the index version `index_dir`"""
+    return os.path.join(index_dir, SHARDS_DIR, name)
+
+def group_files_by_shard(file_paths, sharding=VECTOR_STORE_SHARDING):
+    """{shard name: (shard key, [PDF paths])}"""
+    groups = {}
+    for file_path in file_paths:
+        key = shard_key(file_path, sharding)
+        groups.setdefault(shard_name(key), (key, []))[1].append(file_path)
+    return groups
+
+def load_shard_list(index_dir):
+    """{shard name: metadata} of an index version, or None if it is not sharded"""
+    path = os.path.join(index_dir, SHARDS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["shards"]
+
+def save_shard_list(shards, index_dir):
+    """Write the shard list of an index version; it is what a sharded load reads"""
+    os.makedirs(index_dir, exist_ok=True)
+    path = os.path.join(index_dir, SHARDS_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"sharding": VECTOR_STORE_SHARDING, "shards": shards}, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def _allowed(value):
+    return set(value) if isinstance(value, (list, tuple, set)) else {value}
+
+def matches_filter(metadata, filter):
+    """True if every filter key has one of its allowed values (a value or a list) in `metadata`"""
+    return all(metadata.get(key) in _allowed(value) for key, value in filter.items())
+
+def shard_may_match(shard, filter):
+    """False when the shard's collection or sources rule out every chunk in it"""
+    for key, value in (filter or {}).items():
+        if key == "collection" and shard.get("collection") not in _allowed(value):
+            return False
+        if key == "source" and not _allowed(value).intersection(shard.get("sources", ())):
+            return False
+    return True
+
+
+class ShardedIndex:
+    """
+    Duck-typed FAISS index over the shards' indexes
+
+    `search` returns global positions, so code written against one FAISS
+    index (e.g. search_vector_store_batch) works unchanged.
+    """
+
+    def __init__(self, indexes, offsets, workers=VECTOR_SHARD_SEARCH_WORKERS):
+        self.indexes = indexes
+        self.offsets = offsets
+        self.ntotal = offsets[-1]
+        self.d = indexes[0].d if indexes else 0
+        self.is_trained = True
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="shard-search")
+
+    def search(self, queries, k, shard_ids=None):
+        """
+        Merged top-k (L2 distances, global positions) of the given shards
+
+        Args:
+            queries: Query vectors, one per row
+            k: Results per query
+            shard_ids: Shards to search (all when None)
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if shard_ids is None:
+            shard_ids = range(len(self.indexes))
+        shard_ids = [i for i in shard_ids if self.indexes[i].ntotal]
+
+        if len(shard_ids) > 1:
+            futures = [self._pool.submit(self.indexes[i].search, queries, k) for i in shard_ids]
+            results = [future.result() for future in futures]
+        else:
+            results = [self.indexes[i].search(queries, k) for i in shard_ids]
+
+        if not results:
+            return np.full((len(queries), k), np.inf, dtype=np.float32), np.full((len(queries), k), -1, dtype=np.int64)
+
+        distances = np.hstack([d for d, _ in results]).astype(np.float32)
+        positions = np.hstack([
+            np.where(p == -1, -1, p + self.offsets[i]) for i, (_, p) in zip(shard_ids, results)
+        ]).astype(np.int64)
+        distances[positions == -1] = np.inf
+
+        best = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, best, axis=1), np.take_along_axis(positions, best, axis=1)
+
+
+class ShardedDocstore(Docstore):
+    """Looks global positions (or chunk ids) up in the shard that holds them"""
+
+    def __init__(self, docstores, offsets):
+        self.docstores = docstores
+        self.offsets = offsets
+
+    def search(self, search):
+        if isinstance(search, (int, np.integer)):
+            position = int(search)
+            if not 0 <= position < self.offsets[-1]:
+                return f"ID {search} not found."
+            shard = bisect.bisect_right(self.offsets, position) - 1
+            return self.docstores[shard].search(position - self.offsets[shard])
+
+        for docstore in self.docstores:
+            document = docstore.search(search)
+            if isinstance(document, Document):
+                return document
+        return f"ID {search} not found."
+
+
+class ShardedLexicalIndex:
+    """
+    BM25 over every shard, merged by score
+
+    Term statistics are per shard, so scores from different shards are only
+    roughly comparable; fine for reciprocal-rank fusion, which uses the ranks.
+    """
+
+    def __init__(self, indexes, offsets):
+        self.indexes = indexes
+        self.offsets = offsets
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def document_frequency(self, term):
+        return sum(index.document_frequency(term) for index in self.indexes if index is not None)
+
+    def search(self, query, k):
+        """Return [(global position, score)] of the k best BM25 matches"""
+        hits = []
+        for index, offset in zip(self.indexes, self.offsets):
+            if index is not None:
+                hits.extend((position + offset, score) for position, score in index.search(query, k))
+        return sorted(hits, key=lambda hit: hit[1], reverse=True)[:k]
+
+
+class ShardedVectorStore:
+    """
+    Read-only stand-in for the FAISS store when the corpus is sharded
+
+    Provides what retrieval uses: `similarity_search_by_vector` (with the
+    metadata filter), `index`, `docstore`, `index_to_docstore_id` and
+    `embedding_function`, plus `lexical_index` over every shard.
+    """
+
+    def __init__(self, shards, embedding_function, index_dir, workers=VECTOR_SHARD_SEARCH_WORKERS):
+        self.index_dir = index_dir
+        self.names = [name for name, _, _ in shards]
+        self.metadata = [metadata for _, metadata, _ in shards]
+        self.embedding_function = embedding_function
+        self._normalize_L2 = False
+
+        offsets = [0]
+        for _, _, db in shards:
+            offsets.append(offsets[-1] + db.index.ntotal)
+        self.offsets = offsets
+
+        self.index = ShardedIndex([db.index for _, _, db in shards], offsets, workers)
+        self.docstore = ShardedDocstore([db.docstore for _, _, db in shards], offsets)
+        self.index_to_docstore_id = PositionalIdMap(offsets[-1])
+        self.lexical_index = ShardedLexicalIndex(
+            [load_lexical_index(shard_dir(name, index_dir)) for name in self.names], offsets
+        )
+
+    def select_shards(self, filter=None):
+        """Indices of the shards that may hold chunks matching `filter`"""
+        return [i for i, metadata in enumerate(self.metadata) if shard_may_match(metadata, filter)]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, fetch_k=HYBRID_FETCH_K, **kwargs):
+        shard_ids = self.select_shards(filter)
+        # The shard choice already settles "collection"; other keys are checked per chunk
+        chunk_filter = {key: value for key, value in (filter or {}).items() if key != "collection"}
+
+        _, positions = self.index.search(
+            np.asarray([embedding], dtype=np.float32), max(k, fetch_k) if chunk_filter else k, shard_ids
+        )
+        documents = []
+        for position in positions[0]:
+            if position == -1:
+                break
+            document = self.docstore.search(int(position))
+            if chunk_filter and not matches_filter(document.metadata, chunk_filter):
+                continue
+            documents.append(document)
+            if len(documents) == k:
+                break
+        return documents
+
+
+def load_sharded_vector_store(embedding_model, index_dir, workers=VECTOR_SHARD_SEARCH_WORKERS):
+    """Every shard listed in the version's shards.json, memory-mapped read-only, behind one ShardedVectorStore"""
+    shard_list = load_shard_list(index_dir)
+    if shard_list is None:
+        raise CustomException(
+            f"No {SHARDS_FILE} in {index_dir}; run the ingestion with VECTOR_STORE_SHARDING set"
+        )
+
+    shards = [
+        (name, metadata, load_vector_store(embedding_model, index_dir=shard_dir(name, index_dir)))
+        for name, metadata in sorted(shard_list.items())
+    ]
+    store = ShardedVectorStore(shards, embedding_model, index_dir, workers)
+    logger.info(f"Loaded {len(shards)} shards with {store.index.ntotal} chunks")
+    return store
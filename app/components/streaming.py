@@ -0,0 +1,127 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+
+from langchain_core.callbacks import AsyncCallbackHandler, BaseCallbackHandler
+
+from common.logger import get_logger
+from common.custom_exception import CustomException
+from common.metrics import observe
+
+logger = get_logger(__name__)
+
+_DONE = object()
+
+
+class TokenQueueHandler(BaseCallbackHandler):
+    """Forwards every streamed LLM token to a queue"""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def on_llm_new_token(self, token, **kwargs):
+        if token:
+            self.queue.put(token)
+
+
+class AsyncTokenQueueHandler(AsyncCallbackHandler):
+    """Forwards every streamed LLM token to an asyncio queue"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    async def on_llm_new_token(self, token, **kwargs):
+        if token:
+            self.queue.put_nowait(token)
+
+
+class AnswerStream:
+    """
+    Run a QA chain and iterate over its answer tokens
+
+    `for` runs the chain in a background thread; `async for` runs it with
+    `ainvoke` on the event loop. After iteration `answer` holds the chain's
+    final answer. Time to first token and total latency are logged separately.
+
+    Args:
+        qa_chain: Chain built with `stream_answer=True`
+        inputs: Chain inputs, e.g. {"question": ...}
+        output_key: Key of the answer in the chain output
+    """
+
+    def __init__(self, qa_chain, inputs, output_key="answer"):
+        self.qa_chain = qa_chain
+        self.inputs = inputs
+        self.output_key = output_key
+        self.answer = None
+        self.time_to_first_token = None
+        self.total_seconds = None
+
+    def _run(self, handler, result):
+        try:
+            result["response"] = self.qa_chain.invoke(self.inputs, config={"callbacks": [handler]})
+        except Exception as e:
+            result["error"] = e
+        finally:
+            handler.queue.put(_DONE)
+
+    async def _arun(self, handler, result):
+        try:
+            result["response"] = await self.qa_chain.ainvoke(self.inputs, config={"callbacks": [handler]})
+        except Exception as e:
+            result["error"] = e
+        finally:
+            handler.queue.put_nowait(_DONE)
+
+    def _on_token(self, started):
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - started
+            logger.info(f"Time to first token: {self.time_to_first_token:.3f}s")
+            observe("time_to_first_token", self.time_to_first_token)
+
+    def __iter__(self):
+        handler, result = TokenQueueHandler(), {}
+        started = time.perf_counter()
+        # The chain's spans belong to the request that iterates
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._run, handler, result), daemon=True).start()
+
+        while True:
+            token = handler.queue.get()
+            if token is _DONE:
+                break
+            self._on_token(started)
+            yield token
+
+        self._finish(started, result)
+
+    async def __aiter__(self):
+        handler, result = AsyncTokenQueueHandler(), {}
+        started = time.perf_counter()
+        task = asyncio.ensure_future(self._arun(handler, result))
+
+        try:
+            while True:
+                token = await handler.queue.get()
+                if token is _DONE:
+                    break
+                self._on_token(started)
+                yield token
+        finally:
+            # The client went away; stop generating
+            if not task.done():
+                task.cancel()
+
+        self._finish(started, result)
+
+    def _finish(self, started, result):
+        self.total_seconds = time.perf_counter() - started
+        if "error" in result:
+            error_message = CustomException("Failed to stream answer", result["error"])
+            logger.error(str(error_message))
+            raise error_message
+
+        self.answer = result["response"].get(self.output_key)
+        logger.info(f"Streamed answer in {self.total_seconds:.3f}s total")
@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import AIMessage, HumanMessage
+
+from common.logger import get_logger
+
+from config.config import SUMMARY_MAX_TOKENS
+
+logger = get_logger(__name__)
+
+
+def _to_messages(messages):
+    return [
+        HumanMessage(content=message["content"]) if message["role"] == "user" else AIMessage(content=message["content"])
+        for message in messages
+    ]
+
+
+class SummaryWorker:
+    """
+    Background thread that keeps each conversation's running summary up to date
+
+    After a turn the session is queued; the worker drops the oldest messages
+    until the memory buffer fits in `max_token_limit` and folds only those
+    into the stored summary, so text is never summarized twice and the user's
+    answer never waits for it. Sessions queued again while waiting are
+    summarized once.
+
+    Args:
+        store: Conversation store holding the memory states
+        llm: Chat model used for summarizing
+        max_token_limit: Token budget of the recent-message buffer
+    """
+
+    def __init__(self, store, llm, max_token_limit=SUMMARY_MAX_TOKENS):
+        self.store = store
+        self.max_token_limit = max_token_limit
+        self._summarizer = ConversationSummaryBufferMemory(llm=llm, max_token_limit=max_token_limit)
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="summary-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, session_id):
+        """Queue a conversation for summarizing (no-op if it is already queued)"""
+        with self._lock:
+            if session_id in self._queued:
+                return
+            self._queued.add(session_id)
+        self._queue.put(session_id)
+
+    def _run(self):
+        while True:
+            session_id = self._queue.get()
+            with self._lock:
+                self._queued.discard(session_id)
+            try:
+                self.summarize(session_id)
+            except Exception as e:
+                # The next turn queues the conversation again
+                logger.warning(f"Summarizing conversation {session_id} failed: {e}")
+
+    def summarize(self, session_id):
+        """Fold the messages that overflow the buffer into the summary"""
+        state = self.store.load_memory_state(session_id)
+        if not state:
+            return
+
+        messages = state["messages"]
+        llm = self._summarizer.llm
+        sizes = [llm.get_num_tokens_from_messages(_to_messages([message])) for message in messages]
+
+        pruned, total = 0, sum(sizes)
+        while total > self.max_token_limit and pruned < len(messages):
+            total -= sizes[pruned]
+            pruned += 1
+        if not pruned:
+            return
+
+        started = time.perf_counter()
+        summary = self._summarizer.predict_new_summary(_to_messages(messages[:pruned]), state["summary"])
+
+        applied = []
+
+        def apply(current):
+            # Turns may have been appended meanwhile; anything else (cleared,
+            # summarized by another worker) means this result is stale
+            if (
+                not current
+                or current["summary"] != state["summary"]
+                or current["messages"][:pruned] != messages[:pruned]
+            ):
+                return None
+            applied.append(True)
+            return {**current, "messages": current["messages"][pruned:], "summary": summary}
+
+        self.store.update_memory_state(session_id, apply)
+        if not applied:
+            logger.info(f"Discarded a stale summary of conversation {session_id}")
+            return
+        logger.info(
+            f"Folded {pruned} messages into the summary of conversation {session_id} "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
@@ -1,43 +1,175 @@
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.faiss import dependable_faiss_import
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
 import os
-from components.embeddings import get_embedding_model
+import json
+import numpy as np
+from components.embeddings import get_embedding_model,embedding_signature
+from components.batch_embedder import embed_batches,EmbeddingCheckpoint
+from components.docstore import MmapDocstore,PositionalIdMap,docstore_exists,write_docstore
+from components.faiss_index import create_faiss_index,train_faiss_index,apply_search_parameters,supports_removal
+from components.lexical_index import build_lexical_index
+from components.index_versions import current_index_dir,current_version,new_index_dir,publish_index_dir
+from components.compact_index import (
+    COMPACT_INDEX_FILE,FULL_VECTORS_FILE,compact_mode_enabled,compact_index_exists,load_reranking_index,write_compact_index,
+)
+from common.metrics import span
 
 from common.logger import get_logger
 from common.custom_exception import CustomException
 
-from config.config import DB_FAISS_PATH
+from config.config import DB_FAISS_PATH,FAISS_INDEX_FACTORY,FAISS_TRAIN_SAMPLE_SIZE,VECTOR_COMPACT_DIMENSIONS,VECTOR_STORE_SHARDING,HYBRID_FETCH_K
 
 logger = get_logger(__name__)
 
-def load_vector_store():
+# Sharded layout (VECTOR_STORE_SHARDING): <index version>/shards/<name>/ are
+# complete stores; shards.json lists them with their metadata
+SHARDS_DIR = "shards"
+SHARDS_FILE = "shards.json"
+# Backend, model and dimensions of the embeddings in an index
+EMBEDDING_INFO_FILE = "embedding.json"
+
+def _read_index(index_path, writable):
+    faiss = dependable_faiss_import()
+    if writable:
+        return apply_search_parameters(faiss.read_index(index_path))
+
+    # Map the vectors instead of copying them, so workers share the pages
+    try:
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0))
+    except Exception as e:
+        logger.warning(f"Could not memory-map {index_path} ({e}), reading it into memory")
+        index = faiss.read_index(index_path)
+    return apply_search_parameters(index)
+
+def _read_search_index(index_dir, writable):
+    """The compact index with full-precision rerank when it is configured and built, else index.faiss"""
+    if not writable and compact_mode_enabled():
+        if compact_index_exists(index_dir):
+            index = load_reranking_index(index_dir)
+            if not VECTOR_COMPACT_DIMENSIONS or index.compact_index.d == VECTOR_COMPACT_DIMENSIONS:
+                return index
+            logger.warning(
+                f"Compact index has {index.compact_index.d} dimensions, not {VECTOR_COMPACT_DIMENSIONS}; "
+                "searching the full index until the vector store is rebuilt"
+            )
+        else:
+            logger.warning("Compact vectors are configured but not built; searching the full index until the next update")
+    return _read_index(os.path.join(index_dir, "index.faiss"), writable)
+
+def load_embedding_info(index_dir):
+    """Signature of the embedding model that built the index in `index_dir`, or None for indexes older than the record"""
     try:
+        with open(os.path.join(index_dir, EMBEDDING_INFO_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_embedding_info(embedding_model, index_dir):
+    path = os.path.join(index_dir, EMBEDDING_INFO_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(embedding_signature(embedding_model), f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def embedding_mismatch(index_dir, embedding_model=None):
+    """
+    Why the index in `index_dir` cannot be searched with `embedding_model`
+    (the one ingestion embeds with when None), or None if it can; indexes
+    without the record were built with OpenAI
+    """
+    if embedding_model is None:
         embedding_model = get_embedding_model()
+    stored = load_embedding_info(index_dir)
+    current = embedding_signature(embedding_model)
+    if stored is None:
+        if current["backend"] == "openai":
+            return None
+        stored = {"backend": "openai"}
+    if stored == current:
+        return None
+    return f"the index was built with {stored} but the embedding model is {current}"
+
+def _read_vector_store(index_dir, embedding_model, writable):
+    index = _read_search_index(index_dir, writable)
+    mapped_docstore = MmapDocstore(index_dir)
 
-        if os.path.exists(DB_FAISS_PATH):
+    if index.ntotal != len(mapped_docstore):
+        raise CustomException(f"Index has {index.ntotal} vectors but docstore has {len(mapped_docstore)} documents")
+
+    if writable:
+        # Ingestion adds and removes chunks, which needs the mutable structures
+        documents = list(mapped_docstore.iter_documents())
+        docstore = InMemoryDocstore({document.id: document for document in documents})
+        index_to_docstore_id = {position: document.id for position, document in enumerate(documents)}
+    else:
+        docstore = mapped_docstore
+        index_to_docstore_id = PositionalIdMap(index.ntotal)
+
+    return FAISS(embedding_model, index, docstore, index_to_docstore_id)
+
+def load_vector_store(embedding_model=None, writable=False, index_dir=None):
+    """
+    Load the FAISS index and its docstore from the published version of DB_FAISS_PATH
+    
+    With VECTOR_STORE_SHARDING set, a read-only load of a sharded version
+    returns every shard behind one ShardedVectorStore (see components.sharded_store).
+    
+    Args:
+        embedding_model: Embedding model for queries (loaded when None)
+        writable: Load everything into memory so chunks can be added or removed
+            (ingestion); otherwise both are memory-mapped read-only
+        index_dir: Directory of the index, e.g. one version or one shard
+            (the published version when None)
+    """
+    try:
+        if embedding_model is None:
+            embedding_model = get_embedding_model()
+        if index_dir is None:
+            index_dir = current_index_dir()
+
+        if VECTOR_STORE_SHARDING and not writable and os.path.exists(os.path.join(index_dir, SHARDS_FILE)):
+            from components.sharded_store import load_sharded_vector_store
+            return load_sharded_vector_store(embedding_model, index_dir)
+
+        if os.path.exists(index_dir):
             logger.info("Loading existing vectorstore...")
             
-            # Check if both index files exist
-            index_path = os.path.join(DB_FAISS_PATH, "index.faiss")
-            pkl_path = os.path.join(DB_FAISS_PATH, "index.pkl")
+            index_path = os.path.join(index_dir, "index.faiss")
+            pkl_path = os.path.join(index_dir, "index.pkl")
+
+            # One-time migration from the pickled layout
+            if os.path.exists(index_path) and not docstore_exists(index_dir) and os.path.exists(pkl_path):
+                convert_legacy_vector_store(embedding_model, index_dir)
             
-            if not os.path.exists(index_path) or not os.path.exists(pkl_path):
-                error_message = CustomException(f"Vector store files missing. Expected: {index_path} and {pkl_path}")
+            if not os.path.exists(index_path) or not docstore_exists(index_dir):
+                error_message = CustomException(f"Vector store files missing. Expected: {index_path} and the docstore files")
                 logger.error(str(error_message))
                 raise error_message
             
-            try:
-                return FAISS.load_local(
-                    DB_FAISS_PATH,
-                    embedding_model,
-                    allow_dangerous_deserialization=True
+            # A different embedding model is a configuration change, not damage a rebuild from here should hide
+            mismatch = embedding_mismatch(index_dir, embedding_model)
+            if mismatch:
+                error_message = CustomException(
+                    f"Cannot use the vector store in {index_dir}: {mismatch}. "
+                    "Rebuild it with python -m components.data_loader --full or switch EMBEDDING_BACKEND back"
                 )
+                logger.error(str(error_message))
+                raise error_message
+
+            try:
+                with span("index_load"):
+                    return _read_vector_store(index_dir, embedding_model, writable)
             except Exception as load_error:
+                if os.path.basename(os.path.dirname(os.path.normpath(index_dir))) == SHARDS_DIR:
+                    # A shard is rebuilt by the next ingestion run, not from here
+                    raise
                 logger.warning(f"Failed to load existing vector store: {load_error}")
                 logger.info("Vector store may be incompatible with current embedding model")
                 # Try to recreate the vector store
-                return recreate_vector_store()
+                return recreate_vector_store(embedding_model, writable)
         else:
-            error_message = CustomException("No vector store found at path: " + DB_FAISS_PATH)
+            error_message = CustomException("No vector store found at path: " + index_dir)
             logger.error(str(error_message))
             raise error_message
 
@@ -46,35 +178,80 @@ def load_vector_store():
         logger.error(str(error_message))
         raise error_message
 
-def recreate_vector_store():
+def convert_legacy_vector_store(embedding_model=None, index_dir=None):
+    """
+    Rewrite an index.faiss/index.pkl store in the pickle-free layout
+
+    Args:
+        embedding_model: Embedding model for queries (loaded when None)
+        index_dir: Directory of the store (the published version when None)
+    """
+    try:
+        if index_dir is None:
+            index_dir = current_index_dir()
+        pkl_path = os.path.join(index_dir, "index.pkl")
+        logger.info(f"Converting {pkl_path} to the memory-mapped docstore format")
+
+        db = FAISS.load_local(
+            index_dir,
+            embedding_model or get_embedding_model(),
+            allow_dangerous_deserialization=True
+        )
+        # Stores this old predate versioning and are converted in place
+        persist_vector_store(db, index_dir)
+        os.remove(pkl_path)
+
+        logger.info(f"Converted vectorstore with {db.index.ntotal} vectors")
+        return db
+
+    except Exception as e:
+        error_message = CustomException("Failed to convert legacy vectorstore", e)
+        logger.error(str(error_message))
+        raise error_message
+
+def vector_store_exists(index_dir=None):
+    """
+    True if the FAISS index and its docstore are present in `index_dir` (the
+    published version when None, where a sharded store only needs its shard list)
+    """
+    if index_dir is None:
+        index_dir = current_index_dir()
+        if VECTOR_STORE_SHARDING:
+            return os.path.exists(os.path.join(index_dir, SHARDS_FILE))
+    return os.path.exists(os.path.join(index_dir, "index.faiss")) and docstore_exists(index_dir)
+
+def get_vector_store_version():
+    """Cheap identifier of the published index; changes whenever a new one is published"""
+    version = current_version()
+    if version is not None:
+        return version
+
+    # Unversioned store: its files are rewritten in place
+    try:
+        stat = os.stat(os.path.join(DB_FAISS_PATH, "index.faiss"))
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+def recreate_vector_store(embedding_model=None, writable=False):
     """Recreate vector store from PDF data if it's incompatible"""
     try:
-        from components.pdf_loader import load_pdf_files, create_text_chunks
-        from config.config import DATA_PATH
+        from components.data_loader import rebuild_vector_store
         
         logger.info("Recreating vector store from source data...")
         
-        # Check if data directory exists
-        if not os.path.exists(DATA_PATH):
-            raise CustomException(f"Data directory not found: {DATA_PATH}")
-        
-        # Load PDF documents
-        documents = load_pdf_files()
-        if not documents:
-            raise CustomException("No documents loaded from PDFs")
-        
-        # Create text chunks
-        text_chunks = create_text_chunks(documents)
-        if not text_chunks:
-            raise CustomException("No text chunks extracted from PDFs")
-        
-        # Remove old vector store
-        import shutil
-        if os.path.exists(DB_FAISS_PATH):
-            shutil.rmtree(DB_FAISS_PATH)
-        
-        # Create new vector store
-        return save_vector_store(text_chunks)
+        # Built as a new version and published when complete, so readers
+        # never see a missing or half-written index
+        rebuild_vector_store()
+
+        # Then read back like any other load, so the store has its version directory (and lexical index)
+        if embedding_model is None:
+            embedding_model = get_embedding_model()
+        index_dir = current_index_dir()
+        if VECTOR_STORE_SHARDING and not writable and os.path.exists(os.path.join(index_dir, SHARDS_FILE)):
+            from components.sharded_store import load_sharded_vector_store
+            return load_sharded_vector_store(embedding_model, index_dir)
+        return _read_vector_store(index_dir, embedding_model, writable)
         
     except Exception as e:
         logger.error(f"Failed to recreate vector store: {e}")
@@ -88,13 +265,13 @@ def save_vector_store(text_chunks):
         
         logger.info("Generating your new vectorstore")
 
-        embedding_model = get_embedding_model()
-
-        db = FAISS.from_documents(text_chunks,embedding_model)
+        db = add_chunk_batches([text_chunks])
 
         logger.info("Saving vectorstoree")
 
-        db.save_local(DB_FAISS_PATH)
+        index_dir = new_index_dir()
+        persist_vector_store(db, index_dir)
+        publish_index_dir(index_dir)
 
         logger.info("Vectostore saved sucesfulyy...")
 
@@ -104,5 +281,169 @@ def save_vector_store(text_chunks):
         error_message = CustomException("Failed to create new vectorstore " , e)
         logger.error(str(error_message))
         raise error_message
+
+def add_chunk_batches(batches, db=None):
+    """
+    Embed chunk batches as they arrive and add them to an index
+    
+    Batches are embedded concurrently with retries and checkpointed to
+    EMBED_CHECKPOINT_PATH (see components.batch_embedder), so an interrupted
+    build resumes where it stopped. Chunk ids are taken from `Document.id`.
+    
+    Args:
+        batches: Iterable of chunk lists, e.g. from pdf_loader.iter_chunk_batches
+        db: Existing FAISS store to extend; a new one is created when None
     
+    Returns:
+        The FAISS store, or None if there was nothing to add
+    """
+    try:
+        embedding_model = get_embedding_model()
+        added = 0
+        index, untrained = None, []
+
+        for batch, vectors in embed_batches(batches, embedding_model):
+            if db is None:
+                # Trained index types (IVF, PQ) need a sample before anything is added
+                if index is None:
+                    index = create_faiss_index(len(vectors[0]))
+                untrained.append((batch, vectors))
+                if not index.is_trained and sum(len(b) for b, _ in untrained) < FAISS_TRAIN_SAMPLE_SIZE:
+                    continue
+                db = _new_vector_store(index, untrained, embedding_model)
+                untrained = []
+            else:
+                _add_embeddings(db, batch, vectors)
+            added += len(batch)
+            logger.info(f"Embedded {added} chunks so far")
+
+        if untrained:
+            db = _new_vector_store(index, untrained, embedding_model)
+
+        return db
+
+    except Exception as e:
+        error_message = CustomException("Failed to embed chunks", e)
+        logger.error(str(error_message))
+        raise error_message
+
+def _add_embeddings(db, batch, vectors):
+    text_embeddings = [(chunk.page_content, vector) for chunk, vector in zip(batch, vectors)]
+    metadatas = [chunk.metadata for chunk in batch]
+    ids = [chunk.id for chunk in batch] if all(chunk.id for chunk in batch) else None
+    db.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+
+def _new_vector_store(index, batches, embedding_model):
+    """Index of the configured type, trained on the buffered batches"""
+    if not index.is_trained:
+        sample = np.concatenate([np.asarray(vectors, dtype=np.float32) for _, vectors in batches])
+        index = train_faiss_index(index, sample[:FAISS_TRAIN_SAMPLE_SIZE])
+
+    db = FAISS(embedding_model, apply_search_parameters(index), InMemoryDocstore(), {})
+    for batch, vectors in batches:
+        _add_embeddings(db, batch, vectors)
+    return db
+
+def delete_from_vector_store(db, ids):
+    """Remove vectors by docstore id; ids the index never had are ignored"""
+    known_ids = set(db.index_to_docstore_id.values())
+    ids = [id_ for id_ in ids if id_ in known_ids]
+
+    if ids:
+        if not supports_removal(db.index):
+            raise CustomException(f"{FAISS_INDEX_FACTORY} indexes cannot remove vectors; rebuild with --full")
+        logger.info(f"Removing {len(ids)} stale vectors")
+        db.delete(ids)
+    return db
+
+def search_vector_store(db, query, k, filter=None):
+    """
+    Embed the query and search the index, timing the two stages separately
+
+    `filter` keeps only chunks whose metadata matches (a value or a list of
+    allowed values per key); a sharded store also skips the shards that cannot match.
+    """
+    with span("query_embedding"):
+        vector = db.embedding_function.embed_query(query)
+    with span("faiss_search"):
+        return db.similarity_search_by_vector(vector, k=k, filter=filter)
+
+async def asearch_vector_store(db, query, k, filter=None):
+    """`search_vector_store` with the query embedding awaited"""
+    with span("query_embedding"):
+        vector = await db.embedding_function.aembed_query(query)
+    # The FAISS lookup is CPU-bound and short
+    with span("faiss_search"):
+        return db.similarity_search_by_vector(vector, k=k, filter=filter)
+
+def search_vector_store_batch(db, vectors, k, filter=None, fetch_k=HYBRID_FETCH_K):
+    """
+    Top-k documents for many query vectors with a single FAISS search call
+
+    With `filter`, max(k, fetch_k) candidates are fetched per query and those
+    whose metadata does not match are dropped, as in search_vector_store; a
+    sharded store only searches the shards that may match.
+    """
+    from components.sharded_store import matches_filter
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if db._normalize_L2:
+        dependable_faiss_import().normalize_L2(vectors)
+
+    chunk_filter = filter
+    with span("faiss_search"):
+        if filter and hasattr(db, "select_shards"):
+            # The shard choice already settles "collection"; other keys are checked per chunk
+            chunk_filter = {key: value for key, value in filter.items() if key != "collection"}
+            _, positions = db.index.search(vectors, max(k, fetch_k) if chunk_filter else k, db.select_shards(filter))
+        else:
+            _, positions = db.index.search(vectors, max(k, fetch_k) if filter else k)
+
+    results = []
+    for row in positions:
+        documents = []
+        for position in row:
+            if position == -1:
+                continue
+            document = db.docstore.search(db.index_to_docstore_id[position])
+            if chunk_filter and not matches_filter(document.metadata, chunk_filter):
+                continue
+            documents.append(document)
+            if len(documents) == k:
+                break
+        results.append(documents)
+    return results
+
+def iter_vector_store_documents(db):
+    """Documents of a FAISS store in index position order"""
+    for position in range(db.index.ntotal):
+        id_ = db.index_to_docstore_id[position]
+        document = db.docstore.search(id_)
+        if not isinstance(document, Document):
+            raise CustomException(f"Docstore has no document for id {id_}")
+        document.id = document.id or id_
+        yield document
+
+def persist_vector_store(db, index_dir):
+    """Write the index to `index_dir` (a new version or a shard of one) and drop the embedding checkpoint"""
+    faiss = dependable_faiss_import()
+
+    # The docstore and lexical index go first: index.faiss is what marks a new version
+    write_docstore(iter_vector_store_documents(db), index_dir)
+    build_lexical_index(MmapDocstore(index_dir).iter_documents(), index_dir)
+    if compact_mode_enabled():
+        write_compact_index(db.index, index_dir)
+    else:
+        # Left over from an earlier compact build; it would no longer match
+        for name in (COMPACT_INDEX_FILE, FULL_VECTORS_FILE):
+            if os.path.exists(os.path.join(index_dir, name)):
+                os.remove(os.path.join(index_dir, name))
+
+    save_embedding_info(db.embedding_function, index_dir)
+
+    index_path = os.path.join(index_dir, "index.faiss")
+    faiss.write_index(db.index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
 
+    EmbeddingCheckpoint().clear()
+    logger.info(f"Vectorstore saved with {db.index.ntotal} vectors")
@@ -8,3 +8,132 @@ DB_FAISS_PATH="vectorstore/db_faiss"
 DATA_PATH="data/"
 CHUNK_SIZE=500
 CHUNK_OVERLAP=50
+
+# Ingestion pipeline
+PDF_LOADER_WORKERS=os.cpu_count() or 1   # processes parsing PDFs in parallel (1 = parse inline)
+PDF_PAGES_PER_TASK=25                    # page range handed to one parsing task
+EMBED_BATCH_SIZE=128                     # chunks sent to the embedding stage at once
+EMBED_MAX_CONCURRENCY=4                  # embedding requests in flight at once
+EMBED_MAX_RETRIES=6                      # attempts per batch before the build fails
+EMBED_BACKOFF_SECONDS=1.0                # base delay, doubled after each failed attempt
+EMBED_CHECKPOINT_PATH="vectorstore/embedding_checkpoint"  # finished batches, so interrupted builds resume
+
+# Embedding backend (the index records which one built it; switching needs a rebuild with --full)
+EMBEDDING_BACKEND="openai"               # "openai" (EMBEDDING_MODEL), "local" (TF-IDF + SVD fitted on the corpus) or "onnx"
+LOCAL_EMBEDDING_MODEL_PATH="vectorstore/local_embedding_model.npz"  # fitted by the ingestion when missing
+LOCAL_EMBEDDING_DIMENSIONS=256
+LOCAL_EMBEDDING_HASH_FEATURES=32768      # hash buckets for words and word pairs
+LOCAL_EMBEDDING_FIT_SAMPLE=10000         # chunks the local model is fitted on
+LOCAL_EMBEDDING_WORKERS=os.cpu_count() or 1  # processes (local) or threads (onnx) embedding large batches
+ONNX_EMBEDDING_MODEL_PATH="models/embedding/model.onnx"
+ONNX_EMBEDDING_TOKENIZER_PATH="models/embedding/tokenizer.json"
+ONNX_EMBEDDING_MAX_LENGTH=256            # tokens per chunk; longer chunks are truncated
+
+# Query embedding cache
+EMBEDDING_MODEL="text-embedding-3-small"
+EMBEDDING_DIMENSIONS=1536
+EMBEDDING_CACHE_ENABLED=True
+EMBEDDING_CACHE_PATH="vectorstore/embedding_cache.sqlite3"  # shared by every worker process
+EMBEDDING_CACHE_MEMORY_ITEMS=2048        # per-process LRU in front of SQLite
+EMBEDDING_CACHE_MAX_ENTRIES=100000       # on-disk entries kept before the least recently used are evicted
+
+# Semantic answer cache (first-turn questions only)
+ANSWER_CACHE_ENABLED=True
+ANSWER_CACHE_THRESHOLD=0.95              # cosine similarity needed to reuse an earlier answer
+ANSWER_CACHE_TTL_SECONDS=24*60*60
+ANSWER_CACHE_MAX_ENTRIES=5000
+
+# FAISS index type (any faiss.index_factory string), e.g. "Flat" (exact),
+# "IVF1024,Flat", "IVF1024,PQ64", "HNSW32". Compare them with
+# `python -m benchmarks.index_types`.
+FAISS_INDEX_FACTORY="Flat"
+FAISS_TRAIN_SAMPLE_SIZE=20000            # vectors used to train IVF/PQ indexes
+FAISS_NPROBE=16                          # IVF lists searched per query
+FAISS_EF_SEARCH=64                       # HNSW search depth
+
+# Retrieval
+RETRIEVER_K=5                            # chunks put into the prompt
+HYBRID_SEARCH_ENABLED=True               # fuse BM25 (exact terms, codes, drug names) with vector hits
+HYBRID_FETCH_K=20                        # candidates taken from each side before fusion
+RRF_K=60                                 # reciprocal-rank-fusion damping constant
+BM25_K1=1.5
+BM25_B=0.75
+
+# Async (ASGI) serving: `uvicorn asgi_application:app`
+ASYNC_MAX_CONCURRENT_QUESTIONS=64        # questions answered at once per worker
+ASYNC_MAX_QUEUED_QUESTIONS=256           # questions allowed to wait for a slot; beyond that 503
+ASYNC_QUEUE_TIMEOUT_SECONDS=30           # longest wait for a slot before 503
+
+# Conversations are kept server-side; the cookie only carries a session id
+CONVERSATION_STORE="sqlite"              # "sqlite" (shared by every worker process) or "memory" (per-process LRU)
+CONVERSATION_STORE_PATH="vectorstore/conversations.sqlite3"
+CONVERSATION_STORE_MAX_SESSIONS=10000    # conversations kept by the "memory" backend
+
+# Long conversations use summary memory; the summary is updated by a background worker
+SUMMARY_AFTER_MESSAGES=10                # conversations longer than this are summarized
+SUMMARY_MAX_TOKENS=1500                  # recent messages kept verbatim; older ones are folded into the summary
+
+# Follow-up questions are condensed into standalone questions before retrieval
+CONDENSE_QUESTION_SKIP_SELF_CONTAINED=True  # use follow-ups that need no history as they are (no LLM call)
+CONDENSE_QUESTION_MODEL=""               # faster model for the rewrite; empty uses OPEN_AI_MODEL
+CONDENSE_QUESTION_CACHE_SIZE=2048        # rewrites cached per worker by chat history + question (0 disables)
+CONDENSE_ENTITY_MAX_DOCUMENT_FRACTION=0.05  # a follow-up is used as is only if it names a term found in at most this share of chunks
+
+# Stage timings and token counts, served at /metrics in the Prometheus text format
+METRICS_ENABLED=True
+SERVER_TIMING_ENABLED=False             # add a Server-Timing header with the stage timings of each response
+METRICS_LATENCY_BUCKETS=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Retrieved chunks are packed into the prompt: overlapping chunks merged, near-duplicates dropped
+CONTEXT_PACKING_ENABLED=True
+CONTEXT_TOKEN_BUDGET=1500                # most tokens of retrieved text put into {context}
+CONTEXT_DEDUP_THRESHOLD=0.8              # word-shingle similarity at which a chunk counts as a duplicate
+CONTEXT_MMR_LAMBDA=None                  # 0-1 to diversify with MMR (lower = more diverse); None keeps retrieval order
+
+# Query embeddings of concurrent requests are sent to the API in one call
+QUERY_EMBED_BATCHING_ENABLED=True
+QUERY_EMBED_BATCH_WINDOW_MS=5            # longest wait for more queries after the first one
+QUERY_EMBED_MAX_BATCH=32                 # most queries per embedding call
+QUERY_EMBED_MAX_CONCURRENCY=4            # batches in flight at once
+
+# Bulk question answering (python -m components.bulk_qa)
+BULK_QA_BATCH_SIZE=64                    # questions embedded and searched together
+BULK_QA_CONCURRENCY=16                   # LLM calls in flight at once
+
+# Compact vectors: search truncated / quantized copies, rerank against full precision (memory-mapped)
+# Compare the settings with `python -m benchmarks.compact_vectors`.
+VECTOR_COMPACT_DIMENSIONS=None           # e.g. 256 or 512 leading dimensions searched; None keeps all
+VECTOR_COMPACT_QUANTIZATION=None         # "int8" or "float16" codes in the search index; None keeps float32
+VECTOR_RERANK_FACTOR=4                   # candidates per result reranked with the full-precision vectors
+
+# Sharded vector store: one index per collection (first folder under DATA_PATH) or per PDF
+# under <index version>/shards/, searched in parallel; compare with `python -m benchmarks.shard_scaling`
+VECTOR_STORE_SHARDING=None               # "collection", "file" or None (one index)
+VECTOR_SHARD_SEARCH_WORKERS=min(8, os.cpu_count() or 1)  # threads searching shards at once
+
+# Index versions: each ingestion run publishes a new directory under DB_FAISS_PATH/versions/
+INDEX_KEEP_VERSIONS=2                    # newest versions kept even when unused (current included), for rolling back
+INDEX_RELOAD_INTERVAL_SECONDS=5          # how often workers look for a newly published version (0 = never)
+
+# Ingestion clean-up before embedding: running headers/footers stripped, duplicate chunks dropped
+BOILERPLATE_STRIPPING_ENABLED=True
+BOILERPLATE_EDGE_LINES=3                 # only this many lines at the top and at the bottom of a page can be boilerplate
+BOILERPLATE_SAMPLE_PAGES=20              # repeated lines are learnt from the first this many pages of a PDF
+BOILERPLATE_MIN_PAGES=3                  # a line is boilerplate if it repeats on at least this many sampled pages
+BOILERPLATE_MIN_PAGE_FRACTION=0.5        # ...and on at least this fraction of them (digits ignored, for page numbers)
+CHUNK_DEDUP_ENABLED=True
+CHUNK_NEAR_DUPLICATE_THRESHOLD=0.9       # word 3-shingle Jaccard (MinHash estimate) above which chunks are duplicates (None = exact only)
+
+# Chat model calls: end-to-end deadline, hedged duplicate of slow calls, circuit breaker
+# Compare with and without with `python -m benchmarks.llm_hedging`.
+LLM_DEADLINE_SECONDS=30                  # a call (hedges included) gives up after this long; also the HTTP timeout
+LLM_MAX_RETRIES=1                        # retries inside the OpenAI client, within the deadline
+LLM_HEDGE_PERCENTILE=95                  # a duplicate request goes out once a call is slower than this percentile (None = never)
+LLM_HEDGE_MIN_SECONDS=0.5                # ...but not before this long
+LLM_HEDGE_MIN_SAMPLES=20                 # calls timed before hedging starts
+LLM_MAX_HEDGES=1                         # extra requests per call (also used to retry a failed one at once)
+LLM_LATENCY_WINDOW=500                   # recent calls the percentiles are computed over
+LLM_BREAKER_FAILURES=5                   # consecutive failed calls that open the circuit breaker (0 = never)
+LLM_BREAKER_RESET_SECONDS=30             # calls fail fast this long, then one trial call may close it again
+LLM_RESPONSE_CACHE_SIZE=256              # recent responses per prompt, served when the model is unavailable (0 disables)
+LLM_DEGRADED_ANSWER="The assistant is temporarily unavailable. Please try again in a few minutes."
@@ -0,0 +1,9 @@
+"""
+Tests run from the app/ directory (python -m pytest -q), with the same flat
+imports as the application; models are the offline stand-ins in benchmarks/fakes.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,106 @@
+import threading
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from benchmarks.fakes import StubEmbeddings
+from components.batch_embedder import AdaptiveConcurrency, EmbeddingCheckpoint, embed_batches
+from common.custom_exception import CustomException
+
+
+class FlakyEmbeddings(StubEmbeddings):
+    """StubEmbeddings that records every text it embeds and fails on the texts in `fail_on`"""
+
+    def __init__(self, fail_on=(), dimension=8):
+        super().__init__(dimension=dimension)
+        self.fail_on = set(fail_on)
+        self.embedded = []
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        if self.fail_on.intersection(texts):
+            raise ValueError("upstream unavailable")
+        with self._lock:
+            self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def make_batches(batch_count, batch_size=4):
+    return [
+        [Document(page_content=f"chunk {b}-{i}", id=f"id-{b}-{i}") for i in range(batch_size)]
+        for b in range(batch_count)
+    ]
+
+def run(embedder, checkpoint, batches):
+    return list(embed_batches(batches, embedder, checkpoint, max_concurrency=1, max_retries=1, backoff_seconds=0))
+
+
+def test_resumed_build_embeds_only_unfinished_batches(tmp_path):
+    batches = make_batches(5)
+    signature = {"backend": "stub", "model": "a", "dimensions": 8}
+
+    failing = FlakyEmbeddings(fail_on={"chunk 3-0"})
+    with pytest.raises(CustomException):
+        run(failing, EmbeddingCheckpoint(str(tmp_path), signature), batches)
+    finished = set(failing.embedded)
+    assert {d.page_content for batch in batches[:3] for d in batch} <= finished
+    assert "chunk 3-0" not in finished
+
+    resumed = FlakyEmbeddings()
+    results = run(resumed, EmbeddingCheckpoint(str(tmp_path), signature), batches)
+
+    # Batches finished before the failure (including any that ran ahead of it) are not sent again
+    unfinished = {d.page_content for batch in batches for d in batch} - finished
+    assert sorted(resumed.embedded) == sorted(unfinished)
+    assert [batch for batch, _ in results] == batches
+    expected = StubEmbeddings(dimension=8)
+    for batch, vectors in results:
+        assert np.allclose(vectors, expected.embed_documents([d.page_content for d in batch]))
+
+def test_checkpoint_of_another_model_is_discarded(tmp_path):
+    batches = make_batches(2)
+    run(FlakyEmbeddings(), EmbeddingCheckpoint(str(tmp_path), {"backend": "stub", "model": "a", "dimensions": 8}), batches)
+
+    checkpoint = EmbeddingCheckpoint(str(tmp_path), {"backend": "stub", "model": "b", "dimensions": 8})
+    assert len(checkpoint) == 0
+
+    embedder = FlakyEmbeddings()
+    run(embedder, checkpoint, batches)
+    assert len(embedder.embedded) == 8
+
+
+def test_concurrency_halves_on_rate_limits_and_grows_back():
+    concurrency = AdaptiveConcurrency(8)
+
+    for expected in (4, 2, 1, 1):
+        concurrency.acquire()
+        concurrency.release(rate_limited=True)
+        assert concurrency.limit == expected
+
+    for expected in (2, 3, 4):
+        while concurrency.limit < expected:
+            concurrency.acquire()
+            concurrency.release()
+        assert concurrency.limit == expected
+    assert concurrency.max_limit == 8
+
+def test_concurrency_never_exceeds_limit():
+    concurrency = AdaptiveConcurrency(2)
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def work():
+        concurrency.acquire()
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        with lock:
+            active[0] -= 1
+        concurrency.release()
+
+    threads = [threading.Thread(target=work) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] <= 2
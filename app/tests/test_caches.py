@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from benchmarks.fakes import StubEmbeddings
+from common.metrics import CACHE_EVENTS, render_metrics
+from components.answer_cache import SemanticAnswerCache
+from components.embeddings import BatchingEmbeddings, CachedEmbeddings
+
+
+class CountingEmbeddings(StubEmbeddings):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return super().embed_documents(texts)
+
+
+def test_answers_are_reused_for_the_same_index_version():
+    cache = SemanticAnswerCache(StubEmbeddings(), threshold=0.95)
+    assert cache.lookup("What is asthma?", "v1") is None
+
+    cache.store("What is asthma?", "A lung disease.", "v1")
+    assert cache.lookup("What is asthma?", "v1") == "A lung disease."
+    assert cache.lookup("What is gout?", "v1") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+def test_new_index_version_clears_the_answers():
+    cache = SemanticAnswerCache(StubEmbeddings())
+    cache.store("What is asthma?", "A lung disease.", "v1")
+
+    assert cache.lookup("What is asthma?", "v2") is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["invalidations"] == 1
+
+def test_answers_expire_and_least_recent_are_evicted():
+    cache = SemanticAnswerCache(StubEmbeddings(), ttl_seconds=0.1, max_entries=2)
+    for question in ["a?", "b?", "c?"]:
+        cache.store(question, question.upper(), "v1")
+    assert cache.lookup("a?", "v1") is None
+    assert cache.lookup("c?", "v1") == "C?"
+
+    time.sleep(0.15)
+    assert cache.lookup("c?", "v1") is None
+    assert cache.stats()["entries"] == 1
+
+
+def test_query_embeddings_are_cached_in_memory_and_on_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    model = CountingEmbeddings(8)
+    cache = CachedEmbeddings(model, "stub", 8, path=path)
+
+    vector = cache.embed_query("What is  asthma?")
+    assert cache.embed_query("What is asthma?") == vector
+    assert len(model.calls) == 1
+
+    # Another worker process sharing the file
+    other = CachedEmbeddings(model, "stub", 8, path=path)
+    assert other.embed_query("What is asthma?") == pytest.approx(vector)
+    assert len(model.calls) == 1
+    assert other.stats()["disk_hits"] == 1
+
+    different_model = CachedEmbeddings(model, "other", 8, path=path)
+    different_model.embed_query("What is asthma?")
+    assert len(model.calls) == 2
+
+def test_least_recently_used_embeddings_are_evicted_from_disk(tmp_path):
+    cache = CachedEmbeddings(StubEmbeddings(8), "stub", 8, path=str(tmp_path / "cache.sqlite3"), memory_items=1, max_entries=3)
+    for i in range(10):
+        cache.embed_query(f"question {i}")
+
+    (count,) = cache._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()
+    assert count <= 3
+
+
+def test_concurrent_queries_share_one_batch():
+    model = CountingEmbeddings(8, latency=0.05)
+    batching = BatchingEmbeddings(model, window_ms=100, max_batch=16)
+    questions = [f"question {i % 6}" for i in range(12)]
+    results = {}
+
+    def ask(i):
+        results[i] = batching.embed_query(questions[i])
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(len(questions))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [results[i] for i in range(len(questions))] == [StubEmbeddings(8).embed_query(q) for q in questions]
+    assert len(model.calls) < len(questions)
+    assert sum(len(call) for call in model.calls) <= 6 * len(model.calls)
+    assert batching.stats()["queries"] == len(questions)
+
+def test_batch_errors_reach_every_caller():
+    class FailingEmbeddings(StubEmbeddings):
+        def embed_documents(self, texts):
+            raise RuntimeError("embedding service down")
+
+    batching = BatchingEmbeddings(FailingEmbeddings(8), window_ms=1)
+    with pytest.raises(RuntimeError, match="service down"):
+        batching.embed_query("question")
+
+def test_async_lookups_keep_sqlite_off_the_event_loop(tmp_path, monkeypatch):
+    cache = CachedEmbeddings(StubEmbeddings(8), "stub", 8, path=str(tmp_path / "cache.sqlite3"), memory_items=1)
+    cache.embed_query("What is gout?")
+    cache.embed_query("What is asthma?")
+    loop_threads = set()
+
+    def connect(original=cache._connect):
+        loop_threads.add(threading.current_thread() is threading.main_thread())
+        return original()
+
+    monkeypatch.setattr(cache, "_connect", connect)
+
+    async def ask():
+        return await cache.aembed_query("What is gout?"), await cache.aembed_query("What is eczema?")
+
+    gout, eczema = asyncio.run(ask())
+    assert gout == pytest.approx(StubEmbeddings(8).embed_query("What is gout?"))
+    assert eczema == StubEmbeddings(8).embed_query("What is eczema?")
+    assert loop_threads == {False}
+    assert cache.stats()["disk_hits"] == 1
+
+def test_cache_events_reach_the_metrics_endpoint(tmp_path):
+    def count(cache, event):
+        return CACHE_EVENTS._values.get((cache, event), 0)
+
+    before = {event: count("answer", event) for event in ("hits", "misses", "stores")}
+    cache = SemanticAnswerCache(StubEmbeddings())
+    cache.lookup("What is asthma?", "v1")
+    cache.store("What is asthma?", "A lung disease.", "v1")
+    cache.lookup("What is asthma?", "v1")
+    assert {event: count("answer", event) - before[event] for event in before} == {"hits": 1, "misses": 1, "stores": 1}
+
+    misses = count("query_embedding", "misses")
+    CachedEmbeddings(StubEmbeddings(8), "stub", 8, path=str(tmp_path / "cache.sqlite3")).embed_query("What is gout?")
+    assert count("query_embedding", "misses") == misses + 1
+    assert 'rag_cache_events_total{cache="answer",event="hits"}' in render_metrics()
@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.messages import AIMessageChunk
+
+from benchmarks.fakes import StubChatModel
+from components.hedged_llm import CircuitBreaker, HedgedChatModel, LLMUnavailableError
+
+
+class SlowFirstStub(StubChatModel):
+    """Only the first request is slow; records the requests that were cancelled"""
+
+    slow_latency: float = 2.0
+    calls: list = []
+    cancelled: list = []
+
+    def _draw(self):
+        self.calls.append(time.monotonic())
+        return (self.slow_latency if len(self.calls) == 1 else self.latency), False
+
+    async def _agenerate(self, *args, **kwargs):
+        try:
+            return await super()._agenerate(*args, **kwargs)
+        except asyncio.CancelledError:
+            self.cancelled.append(len(self.calls))
+            raise
+
+
+class StallingStub(StubChatModel):
+    """Streams its first word, then stalls"""
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        yield ChatGenerationChunk(message=AIMessageChunk(content=self._words()[0]))
+        await asyncio.sleep(self.latency)
+
+
+def hedging_model(llm, **kwargs):
+    model = HedgedChatModel(llm=llm, hedge_percentile=50, hedge_min_seconds=0.05, **kwargs)
+    for _ in range(20):
+        model.tracker.record_attempt("generate", 0.01)
+    return model
+
+
+def test_slow_request_is_hedged_and_cancelled():
+    model = hedging_model(SlowFirstStub(latency=0.01, calls=[], cancelled=[]))
+
+    started = time.monotonic()
+    assert model.invoke("question").content == model.llm.answer
+    assert time.monotonic() - started < 1
+
+    assert len(model.llm.calls) == 2
+    assert model.tracker.counts["hedged"] == 1 and model.tracker.counts["hedge_wins"] == 1
+    time.sleep(0.05)
+    assert model.llm.cancelled == [2]
+
+def test_slow_request_is_hedged_and_cancelled_async():
+    model = hedging_model(SlowFirstStub(latency=0.01, calls=[], cancelled=[]))
+
+    async def ask():
+        answer = await model.ainvoke("question")
+        await asyncio.sleep(0.05)
+        return answer
+
+    assert asyncio.run(ask()).content == model.llm.answer
+    assert model.tracker.counts["hedge_wins"] == 1
+    assert model.llm.cancelled == [2]
+
+def test_no_hedge_before_enough_latencies():
+    model = HedgedChatModel(llm=StubChatModel(latency=0.01), hedge_percentile=50, hedge_min_seconds=0.0)
+    model.invoke("question")
+    assert model.tracker.counts["hedged"] == 0
+
+
+def test_breaker_opens_and_recovers_half_open():
+    model = HedgedChatModel(
+        llm=StubChatModel(latency=0.0, failure_probability=1.0), breaker=CircuitBreaker(failures=2, reset_seconds=0.2),
+    )
+    for _ in range(2):
+        with pytest.raises(LLMUnavailableError):
+            model.invoke("question")
+    assert model.breaker.state == "open"
+    assert model.tracker.counts["retried"] == 2
+
+    with pytest.raises(LLMUnavailableError, match="circuit breaker open"):
+        model.invoke("question")
+    assert model.tracker.counts["short_circuited"] == 1
+
+    time.sleep(0.25)
+    assert model.breaker.state == "half_open"
+    model.llm.failure_probability = 0.0
+    assert model.invoke("question").content == model.llm.answer
+    assert model.breaker.state == "closed"
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(failures=1, reset_seconds=0.1)
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    time.sleep(0.15)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_deadline_falls_back_to_the_cached_response():
+    model = HedgedChatModel(llm=StubChatModel(latency=0.0), deadline_seconds=0.2)
+    model.invoke("question")
+    model.llm.latency = 2.0
+
+    started = time.monotonic()
+    assert model.invoke("question").content == model.llm.answer
+    with pytest.raises(LLMUnavailableError, match="no answer within"):
+        model.invoke("another question")
+    assert time.monotonic() - started < 1
+    assert model.tracker.counts["deadline_exceeded"] == 2
+
+def test_deadline_holds_while_streaming():
+    model = HedgedChatModel(llm=StallingStub(latency=5.0), deadline_seconds=0.2)
+
+    started, chunks = time.monotonic(), []
+    with pytest.raises(LLMUnavailableError, match="stream broke off"):
+        for chunk in model.stream("question"):
+            chunks.append(chunk.content)
+    assert chunks == [model.llm._words()[0]]
+    assert time.monotonic() - started < 1
+
+def test_deadline_holds_while_streaming_async():
+    model = HedgedChatModel(llm=StallingStub(latency=5.0), deadline_seconds=0.2)
+
+    async def read():
+        return [chunk.content async for chunk in model.astream("question")]
+
+    started = time.monotonic()
+    with pytest.raises(LLMUnavailableError, match="stream broke off"):
+        asyncio.run(read())
+    assert time.monotonic() - started < 1
@@ -0,0 +1,43 @@
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from benchmarks.fakes import StubEmbeddings
+from components.hybrid_retriever import HybridRetriever
+from components.lexical_index import build_lexical_index, load_lexical_index
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    texts = [f"note {i} about {'asthma' if i % 2 else 'diabetes'} care" for i in range(40)]
+    metadatas = [{"source": f"book{i % 4}.pdf", "collection": "lungs" if i % 2 else "endocrine"} for i in range(40)]
+    db = FAISS.from_texts(texts, StubEmbeddings(dimension=16), metadatas=metadatas)
+
+    index_dir = str(tmp_path_factory.mktemp("index"))
+    build_lexical_index((Document(page_content=text) for text in texts), index_dir)
+    return db, load_lexical_index(index_dir)
+
+
+@pytest.mark.parametrize("hybrid", [False, True])
+@pytest.mark.parametrize("filter", [{"collection": "lungs"}, {"source": ["book1.pdf", "book3.pdf"]}, {"source": "book0.pdf"}])
+def test_batched_retrieval_applies_the_filter(store, hybrid, filter):
+    db, lexical_index = store
+    retriever = HybridRetriever(vector_store=db, lexical_index=lexical_index if hybrid else None, k=4, fetch_k=20, filter=filter)
+    questions = ["asthma care", "diabetes care", "note 7"]
+    vectors = [db.embedding_function.embed_query(question) for question in questions]
+
+    batches = retriever.retrieve_batch(questions, vectors)
+    assert len(batches) == len(questions)
+    for question, documents in zip(questions, batches):
+        assert documents
+        for document in documents:
+            for key, value in filter.items():
+                assert document.metadata[key] in (value if isinstance(value, list) else [value])
+        # Same documents as the one-question path
+        assert {d.page_content for d in documents} == {d.page_content for d in retriever.invoke(question)}
+
+def test_batched_retrieval_without_filter_searches_everything(store):
+    db, _ = store
+    retriever = HybridRetriever(vector_store=db, k=5)
+    vectors = [db.embedding_function.embed_query("note 3 about asthma care")]
+    assert [d.page_content for d in retriever.retrieve_batch(["q"], vectors)[0]][0] == "note 3 about asthma care"
@@ -0,0 +1,116 @@
+import os
+import time
+
+import pytest
+
+from components import index_versions as iv
+
+
+def stage(root, payload="index"):
+    """A version with one file, published or not"""
+    path = iv.new_index_dir(root)
+    with open(os.path.join(path, "index.faiss"), "w") as f:
+        f.write(payload)
+    time.sleep(0.01)
+    return path
+
+def age(root, version, seconds):
+    path = os.path.join(iv.versions_root(root), version)
+    modified = os.stat(path).st_mtime - seconds
+    os.utime(path, (modified, modified))
+
+
+def test_publish_points_current_at_the_new_version(tmp_path):
+    root = str(tmp_path)
+    assert iv.current_version(root) is None
+    assert iv.current_index_dir(root) == root
+
+    path = stage(root)
+    version = iv.publish_index_dir(path, root)
+    assert iv.current_version(root) == version
+    assert iv.current_index_dir(root) == path
+
+def test_old_versions_beyond_keep_are_collected(tmp_path):
+    root = str(tmp_path)
+    versions = []
+    for i in range(4):
+        versions.append(os.path.basename(stage(root)))
+        age(root, versions[-1], 100 - i)
+    for version in versions:
+        iv._release_staged_lease(iv.version_dir(version, root))
+    iv.publish_index_dir(iv.version_dir(versions[-1], root), root)
+
+    # Publishing already collects with INDEX_KEEP_VERSIONS
+    iv.collect_old_versions(root, keep=2)
+    assert iv.list_versions(root) == versions[2:]
+
+def test_versions_newer_than_a_rollback_are_collected(tmp_path):
+    root = str(tmp_path)
+    old, new = os.path.basename(stage(root)), os.path.basename(stage(root))
+    iv.publish_index_dir(iv.version_dir(new, root), root)
+    iv.publish_index_dir(iv.version_dir(old, root), root)  # roll back
+    age(root, new, 60)
+
+    assert iv.collect_old_versions(root, keep=1) == [new]
+    assert iv.list_versions(root) == [old]
+
+@pytest.mark.skipif(iv.fcntl is None, reason="leases need flock")
+def test_leased_and_staged_versions_are_kept(tmp_path):
+    root = str(tmp_path)
+    served = os.path.basename(stage(root))
+    iv.publish_index_dir(iv.version_dir(served, root), root)
+    lease = iv.acquire_reader_lease(iv.version_dir(served, root))
+
+    current = os.path.basename(stage(root))
+    iv.publish_index_dir(iv.version_dir(current, root), root)
+    staged = stage(root)  # still being written by this process
+    age(root, served, 60)
+    age(root, os.path.basename(staged), 60)
+
+    assert iv.collect_old_versions(root, keep=1) == []
+    assert set(iv.list_versions(root)) == {served, current, os.path.basename(staged)}
+
+    lease.release()
+    iv.discard_index_dir(staged)
+    assert iv.collect_old_versions(root, keep=1) == [served]
+    assert iv.list_versions(root) == [current]
+
+def test_link_copies_a_version_without_its_lease_file(tmp_path):
+    root = str(tmp_path)
+    source = stage(root, "vectors")
+    target = stage(root)
+    os.remove(os.path.join(target, "index.faiss"))
+
+    iv.link_index_dir(source, target)
+    assert os.path.samefile(os.path.join(source, "index.faiss"), os.path.join(target, "index.faiss"))
+
+
+def test_unreadable_version_is_rebuilt_and_served(tmp_path, monkeypatch):
+    from benchmarks.fakes import StubEmbeddings, synthetic_pages, write_pdf
+    from components import registry as shared, vector_store
+    from components.data_loader import process_and_store_pdfs
+    from config.config import DATA_PATH
+
+    monkeypatch.chdir(tmp_path)
+    embeddings = StubEmbeddings(16)
+    monkeypatch.setattr(vector_store, "get_embedding_model", lambda: embeddings)
+    monkeypatch.setitem(shared.registry._loaders, "embedding_model", lambda: embeddings)
+    monkeypatch.setattr(shared.index_reloader, "interval", 0)
+    os.makedirs(DATA_PATH)
+    write_pdf(os.path.join(DATA_PATH, "book.pdf"), synthetic_pages(3, 10))
+    process_and_store_pdfs(full=True)
+
+    damaged = iv.current_version()
+    with open(os.path.join(iv.current_index_dir(), "index.faiss"), "wb") as f:
+        f.write(b"not an index")
+
+    shared.registry.invalidate()
+    try:
+        db = shared.get_shared_vector_store()
+        retriever = shared.get_shared_retriever()
+        assert iv.current_version() != damaged
+        assert shared.index_reloader.version == iv.current_version()
+        assert db.docstore.index_dir == iv.current_index_dir()
+        assert retriever.invoke("treatment of asthma")
+    finally:
+        shared.registry.invalidate()
@@ -0,0 +1,100 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmarks.fakes import synthetic_pages
+from components.chunk_dedup import ChunkDeduplicator, minhash
+from components.pdf_loader import new_cleanup_stats, strip_boilerplate
+
+DOSAGE_ROW = "Metformin 500 mg twice daily with meals"
+
+
+def pages_of(source, texts):
+    return [Document(page_content=text, metadata={"source": source, "page": i}) for i, text in enumerate(texts)]
+
+def with_dosage_table(texts):
+    """Put the same dosage row in the middle of every page, as a repeated table would"""
+    pages = []
+    for i, text in enumerate(texts):
+        lines = text.splitlines()
+        middle = len(lines) // 2
+        pages.append("\n".join(lines[:middle] + [DOSAGE_ROW.replace("500", str(500 + i % 2 * 250))] + lines[middle:]))
+    return pages
+
+
+def test_headers_and_footers_are_stripped_but_body_rows_kept():
+    pages = pages_of("book.pdf", with_dosage_table(synthetic_pages(8, 10)))
+    stats = new_cleanup_stats()
+    stripped = list(strip_boilerplate(pages, stats))
+
+    assert len(stripped) == 8
+    for page in stripped:
+        assert "Handbook of Internal Medicine" not in page.page_content
+        assert "Copyright" not in page.page_content
+        assert "Metformin" in page.page_content
+    assert stats["pages"] == 8
+    assert stats["boilerplate_lines"] == 16
+
+def test_short_documents_and_lines_on_few_pages_are_kept():
+    short = pages_of("leaflet.pdf", synthetic_pages(2, 5))
+    assert [page.page_content for page in strip_boilerplate(short)] == synthetic_pages(2, 5)
+
+    texts = synthetic_pages(10, 5, running_header=False)
+    texts[:2] = ["Table 3: Dosage by weight\n" + text for text in texts[:2]]
+    assert [page.page_content for page in strip_boilerplate(pages_of("book.pdf", texts))] == texts
+
+def test_pages_after_the_sample_stream_through():
+    read = []
+    def pages():
+        for page in pages_of("book.pdf", synthetic_pages(100, 5)):
+            read.append(page)
+            yield page
+
+    stream = strip_boilerplate(pages(), sample_pages=10)
+    stripped = [next(stream) for _ in range(11)]
+    assert len(read) == 11
+    assert not any("Handbook" in page.page_content or "Copyright" in page.page_content for page in stripped)
+
+def test_each_document_is_learnt_separately():
+    pages = pages_of("a.pdf", synthetic_pages(5, 5, seed=0)) + pages_of("b.pdf", synthetic_pages(5, 5, seed=1))
+    stripped = list(strip_boilerplate(pages))
+    assert [page.metadata["source"] for page in stripped] == ["a.pdf"] * 5 + ["b.pdf"] * 5
+    assert not any("Handbook" in page.page_content for page in stripped)
+
+
+def test_exact_and_near_duplicates_are_dropped():
+    deduplicator = ChunkDeduplicator(threshold=0.8)
+    text = " ".join(synthetic_pages(1, 8, running_header=False))
+
+    assert deduplicator.add(text)
+    assert not deduplicator.add(text.upper().replace(".", " ."))
+    assert not deduplicator.add(text.replace("patients", "people", 1))
+    assert deduplicator.add(" ".join(synthetic_pages(1, 8, seed=1, running_header=False)))
+
+def test_near_duplicates_are_kept_without_a_threshold():
+    deduplicator = ChunkDeduplicator(threshold=None)
+    text = " ".join(synthetic_pages(1, 8, running_header=False))
+
+    assert deduplicator.add(text)
+    assert not deduplicator.add(text)
+    assert deduplicator.add(text + " Reviewed annually.")
+
+def test_signatures_do_not_depend_on_the_process():
+    text = " ".join(synthetic_pages(1, 8, running_header=False))
+    script = "import sys; from components.chunk_dedup import minhash; print(minhash(sys.argv[1]).tolist())"
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    signatures = []
+    for seed in ["1", "2"]:
+        output = subprocess.run(
+            [sys.executable, "-c", script, text], cwd=app_dir, capture_output=True, text=True, check=True,
+            env=dict(os.environ, PYTHONHASHSEED=seed),
+        ).stdout
+        signatures.append(np.asarray(json.loads(output), dtype=np.uint64))
+
+    assert np.array_equal(signatures[0], signatures[1])
+    assert np.array_equal(signatures[0], minhash(text))
@@ -0,0 +1,67 @@
+import json
+import os
+
+import numpy as np
+
+from benchmarks.fakes import StubEmbeddings
+from components.embeddings import embedding_signature
+from components.local_embeddings import SparseRows, TfidfSvdEmbeddings, randomized_svd, _hashed_counts
+from components.vector_store import EMBEDDING_INFO_FILE, embedding_mismatch, save_embedding_info
+
+TOPICS = {
+    "diabetes": "insulin glucose metformin blood sugar pancreas",
+    "asthma": "inhaler wheezing airway bronchial steroid breath",
+    "gout": "uric acid joint toe crystals purine",
+}
+
+def corpus(per_topic=30, seed=0):
+    rng = np.random.default_rng(seed)
+    texts = []
+    for topic, words in TOPICS.items():
+        words = words.split()
+        texts += [f"{topic} " + " ".join(rng.choice(words, 12)) for _ in range(per_topic)]
+    return texts
+
+
+def test_sparse_product_matches_dense():
+    texts = corpus(5)
+    rows, columns, counts = _hashed_counts(texts, 512)
+    matrix = SparseRows.tfidf(rows, columns, counts, np.ones(512, dtype=np.float32), len(texts))
+    dense = np.zeros(matrix.shape, dtype=np.float32)
+    dense[matrix.rows, matrix.columns] = matrix.values
+    other = np.random.default_rng(1).standard_normal((512, 7)).astype(np.float32)
+
+    assert np.allclose(matrix.dot(other), dense @ other, atol=1e-5)
+    assert np.allclose(matrix.transpose().dot(other[:len(texts)]), dense.T @ other[:len(texts)], atol=1e-5)
+
+    _, components = randomized_svd(matrix, 3)
+    _, _, exact = np.linalg.svd(dense, full_matrices=False)
+    assert np.allclose(np.abs(components @ exact[:3].T), np.eye(3), atol=0.05)
+
+def test_similar_texts_are_close_and_models_round_trip(tmp_path):
+    model = TfidfSvdEmbeddings.fit(corpus(), dimensions=8, features=1024)
+    query = np.asarray(model.embed_query("glucose and insulin in diabetes"))
+    documents = np.asarray(model.embed_documents(["metformin lowers blood sugar", "inhaler for wheezing", "uric acid crystals in a toe"]))
+    assert np.argmax(documents @ query) == 0
+    assert np.allclose(np.linalg.norm(documents, axis=1), 1, atol=1e-5)
+
+    path = str(tmp_path / "model.npz")
+    model.save(path)
+    loaded = TfidfSvdEmbeddings.load(path, workers=1)
+    assert loaded.signature == model.signature
+    assert np.allclose(loaded.embed_query("gout"), model.embed_query("gout"))
+
+def test_index_built_with_another_model_is_detected(tmp_path):
+    index_dir = str(tmp_path)
+    first = TfidfSvdEmbeddings.fit(corpus(seed=0), dimensions=8, features=1024)
+    refit = TfidfSvdEmbeddings.fit(corpus(seed=1), dimensions=8, features=1024)
+
+    save_embedding_info(first, index_dir)
+    with open(os.path.join(index_dir, EMBEDDING_INFO_FILE)) as f:
+        assert json.load(f) == embedding_signature(first)
+    assert embedding_mismatch(index_dir, first) is None
+    assert "built with" in embedding_mismatch(index_dir, refit)
+    assert embedding_mismatch(index_dir, StubEmbeddings()) is not None
+
+def test_index_without_a_record_is_taken_for_openai(tmp_path):
+    assert embedding_mismatch(str(tmp_path), StubEmbeddings()) is not None
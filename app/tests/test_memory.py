@@ -0,0 +1,48 @@
+import asyncio
+
+from benchmarks.fakes import StubChatModel
+from components.memory import DeferredSummaryBufferMemory
+
+
+class CountingChatModel(StubChatModel):
+    calls: list = []
+
+    def _generate(self, *args, **kwargs):
+        self.calls.append("generate")
+        return super()._generate(*args, **kwargs)
+
+    async def _agenerate(self, *args, **kwargs):
+        self.calls.append("agenerate")
+        return await super()._agenerate(*args, **kwargs)
+
+
+def summary_memory():
+    llm = CountingChatModel(latency=0.0, calls=[])
+    memory = DeferredSummaryBufferMemory(
+        llm=llm, max_token_limit=10, memory_key="chat_history", return_messages=True, output_key="answer",
+    )
+    return memory, llm
+
+TURNS = [({"question": f"What is the dosage for patient {i}?"}, {"answer": "Two tablets a day with meals."}) for i in range(5)]
+
+
+def test_saving_turns_never_summarizes():
+    memory, llm = summary_memory()
+    for inputs, outputs in TURNS:
+        memory.save_context(inputs, outputs)
+
+    assert llm.calls == []
+    assert len(memory.chat_memory.messages) == 2 * len(TURNS)
+    assert memory.moving_summary_buffer == ""
+
+def test_saving_turns_never_summarizes_async():
+    memory, llm = summary_memory()
+
+    async def save():
+        for inputs, outputs in TURNS:
+            await memory.asave_context(inputs, outputs)
+
+    asyncio.run(save())
+    assert llm.calls == []
+    assert len(memory.chat_memory.messages) == 2 * len(TURNS)
+    assert memory.moving_summary_buffer == ""
@@ -0,0 +1,56 @@
+import pytest
+from langchain_core.documents import Document
+
+from components.lexical_index import build_lexical_index, load_lexical_index
+from components.question_condenser import QuestionRewriteCache, is_self_contained
+
+
+@pytest.fixture(scope="module")
+def lexical_index(tmp_path_factory):
+    index_dir = str(tmp_path_factory.mktemp("index"))
+    texts = [
+        "Metformin lowers blood glucose in patients with type 2 diabetes. Side effects include nausea.",
+        "Asthma causes wheezing; children often use an inhaler. The dosage depends on age.",
+    ] + [
+        f"Patients should be followed up regularly; treatment and dosage are reviewed at visit {i}. "
+        "Side effects and symptoms of children and adults are recorded."
+        for i in range(60)
+    ]
+    build_lexical_index((Document(page_content=text) for text in texts), index_dir)
+    return load_lexical_index(index_dir)
+
+
+@pytest.mark.parametrize("question", [
+    "What are the side effects?",
+    "What is the dosage for children?",
+    "How often should patients be followed up?",
+    "What are the symptoms?",
+    "Is it safe during pregnancy?",
+    "And what about asthma?",
+    "What are the side effects of this drug?",
+])
+def test_follow_ups_that_need_history_are_rewritten(lexical_index, question):
+    assert not is_self_contained(question, lexical_index)
+
+@pytest.mark.parametrize("question", [
+    "What are the side effects of metformin?",
+    "What is the dosage of an asthma inhaler for children?",
+])
+def test_questions_naming_a_domain_entity_are_used_as_is(lexical_index, question):
+    assert is_self_contained(question, lexical_index)
+
+def test_nothing_is_self_contained_without_a_lexical_index():
+    assert not is_self_contained("What are the side effects of metformin?")
+
+def test_rewrite_cache_is_keyed_by_history_and_evicts_least_recently_used():
+    cache = QuestionRewriteCache(max_items=2)
+    first = cache.key("history a", "what  about   asthma?")
+    assert first == cache.key("history a", "what about asthma?")
+    assert first != cache.key("history b", "what about asthma?")
+
+    cache.put(first, "What about asthma treatment?")
+    cache.put(cache.key("h", "q2"), "r2")
+    assert cache.get(first) == "What about asthma treatment?"
+    cache.put(cache.key("h", "q3"), "r3")
+    assert cache.get(cache.key("h", "q2")) is None
+    assert cache.get(first) is not None
@@ -0,0 +1,47 @@
+import asyncio
+import warnings
+
+import pytest
+from langchain.chains import LLMChain
+from langchain_core.prompts import PromptTemplate
+
+from benchmarks.fakes import StubChatModel
+from common.custom_exception import CustomException
+from components.hedged_llm import HedgedChatModel
+from components.streaming import AnswerStream
+
+
+def streaming_chain(llm):
+    # The QA chains stream their answer the same way (see create_conversational_qa_chain)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return LLMChain(llm=llm, prompt=PromptTemplate.from_template("{question}"), llm_kwargs={"stream": True})
+
+
+@pytest.mark.parametrize("llm", [
+    StubChatModel(latency=0.05),
+    HedgedChatModel(llm=StubChatModel(latency=0.05)),
+])
+def test_tokens_stream_before_the_answer_is_complete(llm):
+    stream = AnswerStream(streaming_chain(llm), {"question": "What is asthma?"}, output_key="text")
+
+    tokens = list(stream)
+    assert len(tokens) > 1
+    assert "".join(tokens) == stream.answer == StubChatModel().answer
+    assert stream.time_to_first_token < stream.total_seconds
+
+def test_tokens_stream_async():
+    stream = AnswerStream(streaming_chain(StubChatModel(latency=0.05)), {"question": "What is asthma?"}, output_key="text")
+
+    async def read():
+        return [token async for token in stream]
+
+    assert "".join(asyncio.run(read())) == stream.answer
+
+def test_failed_chain_raises_once_the_stream_ends():
+    stream = AnswerStream(
+        streaming_chain(StubChatModel(latency=0.0, failure_probability=1.0)), {"question": "What is asthma?"}, output_key="text",
+    )
+    with pytest.raises(CustomException, match="Failed to stream answer"):
+        list(stream)
+    assert stream.answer is None
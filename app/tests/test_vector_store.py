@@ -0,0 +1,31 @@
+import os
+
+from langchain_community.vectorstores import FAISS
+
+from benchmarks.fakes import StubEmbeddings
+from components.docstore import docstore_exists
+from components.vector_store import convert_legacy_vector_store, load_vector_store
+
+
+def test_legacy_store_is_converted_in_its_own_directory(tmp_path):
+    index_dir = str(tmp_path / "old_store")
+    embeddings = StubEmbeddings(16)
+    texts = [f"Chunk {i} about the treatment of asthma." for i in range(5)]
+    FAISS.from_texts(texts, embeddings).save_local(index_dir)
+
+    converted = convert_legacy_vector_store(embeddings, index_dir)
+    assert converted.index.ntotal == len(texts)
+    assert docstore_exists(index_dir)
+    assert not os.path.exists(os.path.join(index_dir, "index.pkl"))
+
+    db = load_vector_store(embeddings, index_dir=index_dir)
+    assert sorted(document.page_content for document in db.docstore.iter_documents()) == sorted(texts)
+
+def test_loading_a_legacy_store_converts_it(tmp_path):
+    index_dir = str(tmp_path / "old_store")
+    embeddings = StubEmbeddings(16)
+    FAISS.from_texts(["Gout is caused by uric acid crystals."], embeddings).save_local(index_dir)
+
+    db = load_vector_store(embeddings, index_dir=index_dir)
+    assert db.index.ntotal == 1
+    assert docstore_exists(index_dir)